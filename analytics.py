@@ -0,0 +1,343 @@
+"""
+Defect Analytics for FieldScribe
+Handles the columnar on-disk store of defect records (one row per defect of
+each inspection's latest report version) and the vectorized aggregations
+behind the CRM dashboard KPIs
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import resources
+import standards
+import storage
+import versions
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DIR = os.environ.get("FIELDSCRIBE_ANALYTICS_DIR", os.path.join(storage.DATA_DIR, "analytics"))
+# Segments are merged (and superseded rows dropped) once there are this many
+COMPACT_SEGMENTS = int(os.environ.get("FIELDSCRIBE_ANALYTICS_COMPACT_SEGMENTS", "32"))
+
+# Column -> dtype. String columns hold int32 codes into DICTIONARY_COLUMNS'
+# value lists; 'day' is days since 1970-01-01 of the report date.
+COLUMNS = {
+    'version': np.int64,
+    'day': np.int32,
+    'client': np.int32,
+    'engineer': np.int32,
+    'category': np.int32,
+    'code': np.int32,
+    'standard': np.int32,
+}
+DICTIONARY_COLUMNS = ('client', 'engineer', 'category', 'code', 'standard')
+# Per segment: versions whose rows the segment's versions replace
+SUPERSEDES = 'supersedes'
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _to_day(value) -> int:
+    try:
+        return int((np.datetime64(str(value)[:10], 'D') - _EPOCH).astype(np.int64))
+    except ValueError:
+        return int((np.datetime64(date.today().isoformat(), 'D') - _EPOCH).astype(np.int64))
+
+
+def _month_start(day: date) -> int:
+    return _to_day(day.replace(day=1).isoformat())
+
+
+def _distinct_codes(codes: np.ndarray) -> int:
+    """Distinct values of a dictionary-coded column (dense small ints: bincount, no sort)."""
+    return int(np.count_nonzero(np.bincount(codes))) if len(codes) else 0
+
+
+def _distinct_runs(values: np.ndarray) -> int:
+    """Distinct values of a column whose equal values are contiguous (a version's rows are)."""
+    return int(np.count_nonzero(values[1:] != values[:-1])) + 1 if len(values) else 0
+
+
+def _write_json_atomic(path: str, obj) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DefectAnalytics:
+    """
+    Append-only columnar store of defect rows.
+
+    Layout:
+        <root>/dictionaries.json          value list per string column (code = index)
+        <root>/segments/<seq>/<col>.npy   one array per column, plus supersedes.npy
+    Each new report version is one segment, written to a temp folder and
+    renamed into place, so readers never see half a segment. A version
+    supersedes its parent, whose rows are then masked out of every query
+    (and dropped for good by compact). Columns are memory-mapped and
+    concatenated once, then extended in memory as segments are appended.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or ANALYTICS_DIR
+        self._segment_dir = os.path.join(self.root, "segments")
+        self._lock = threading.Lock()
+        os.makedirs(self._segment_dir, exist_ok=True)
+        self._dictionaries = self._load_dictionaries()
+        self._lookup = {name: {v: i for i, v in enumerate(values)} for name, values in self._dictionaries.items()}
+        self._segments = self._list_segments()
+        self._columns = None
+        self._superseded = None
+        self._live = None
+        self._versions = None
+
+    # --- LAYOUT ---
+    def _load_dictionaries(self) -> dict:
+        try:
+            with open(os.path.join(self.root, "dictionaries.json"), encoding='utf-8') as f:
+                loaded = json.load(f)
+        except FileNotFoundError:
+            loaded = {}
+        return {name: list(loaded.get(name, [])) for name in DICTIONARY_COLUMNS}
+
+    def _list_segments(self) -> list:
+        return sorted(name for name in os.listdir(self._segment_dir) if name.isdigit())
+
+    def _read_segment(self, name: str) -> dict:
+        path = os.path.join(self._segment_dir, name)
+        return {col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode='r')
+                for col in (*COLUMNS, SUPERSEDES)}
+
+    def _write_segment(self, arrays: dict) -> str:
+        name = f"{int(self._segments[-1]) + 1 if self._segments else 1:010d}"
+        tmp_path = tempfile.mkdtemp(dir=self._segment_dir, suffix=".tmp")
+        try:
+            for col, values in arrays.items():
+                np.save(os.path.join(tmp_path, f"{col}.npy"), values)
+            os.rename(tmp_path, os.path.join(self._segment_dir, name))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._segments.append(name)
+        return name
+
+    def _encode(self, column: str, values) -> np.ndarray:
+        lookup, dictionary = self._lookup[column], self._dictionaries[column]
+        codes = []
+        for value in values:
+            value = value or ''
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(dictionary)
+                dictionary.append(value)
+            codes.append(code)
+        return np.asarray(codes, dtype=COLUMNS[column])
+
+    # --- LOADED COLUMNS ---
+    def _load(self):
+        if self._columns is not None:
+            return
+        start = time.perf_counter()
+        segments = [self._read_segment(name) for name in self._segments]
+        self._columns = {col: np.concatenate([s[col] for s in segments]) if segments else np.empty(0, dtype)
+                         for col, dtype in COLUMNS.items()}
+        self._superseded = (np.concatenate([s[SUPERSEDES] for s in segments]) if segments
+                            else np.empty(0, np.int64))
+        self._live = None
+        self._versions = set(np.unique(self._columns['version']).tolist())
+        logger.info("Loaded %d analytics rows from %d segments in %.3fs", len(self._columns['version']),
+                    len(segments), time.perf_counter() - start)
+
+    def _live_mask(self) -> np.ndarray:
+        if self._live is None:
+            self._live = ~np.isin(self._columns['version'], self._superseded)
+        return self._live
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return int(self._live_mask().sum())
+
+    def has_version(self, version_id: int) -> bool:
+        with self._lock:
+            self._load()
+            return version_id in self._versions
+
+    # --- WRITES ---
+    def add_report(self, version_id: int, report, supersedes=(), engineer: str = None) -> int:
+        """
+        Appends one row per defect of a report version (see versions.py) and
+        masks out the rows of the versions it supersedes. A version already
+        in the store is skipped. Returns the number of rows written.
+        """
+        return self.add_reports([(version_id, report, supersedes, engineer)])
+
+    def add_reports(self, items) -> int:
+        """add_report for many (version_id, report, supersedes, engineer) tuples, as one segment."""
+        with self._lock:
+            self._load()
+            rows = {col: [] for col in COLUMNS}
+            superseded, added = [], set()
+            for version_id, report, supersedes, engineer in items:
+                if version_id in self._versions or version_id in added:
+                    continue
+                added.add(version_id)
+                superseded.extend(v for v in supersedes if v is not None)
+                n = len(report.defects)
+                codes = [d.code or '' for d in report.defects]
+                rows['version'].extend([version_id] * n)
+                rows['day'].extend([_to_day(report.date)] * n)
+                rows['client'].extend([report.client_name] * n)
+                rows['engineer'].extend([engineer or report.engineer] * n)
+                rows['category'].extend(d.category for d in report.defects)
+                rows['code'].extend(codes)
+                rows['standard'].extend(standards.standard_id(c) or c for c in codes)
+            if not added:
+                return 0
+            arrays = {col: (self._encode(col, values) if col in DICTIONARY_COLUMNS
+                            else np.asarray(values, dtype=COLUMNS[col]))
+                      for col, values in rows.items()}
+            arrays[SUPERSEDES] = np.asarray(superseded, np.int64)
+            # Dictionaries first: a crash in between leaves unused values, never dangling codes
+            _write_json_atomic(os.path.join(self.root, "dictionaries.json"), self._dictionaries)
+            self._write_segment(arrays)
+            for col in COLUMNS:
+                self._columns[col] = np.concatenate([self._columns[col], arrays[col]])
+            self._superseded = np.concatenate([self._superseded, arrays[SUPERSEDES]])
+            self._live = None
+            self._versions.update(added)
+            needs_compaction = len(self._segments) >= COMPACT_SEGMENTS
+        if needs_compaction:
+            self.compact()
+        return len(arrays['version'])
+
+    def compact(self) -> dict:
+        """Merges all segments into one, dropping superseded rows."""
+        with self._lock:
+            self._load()
+            old = list(self._segments)
+            live = self._live_mask()
+            if len(old) <= 1 and live.all():
+                return {'segments': len(old), 'rows': len(live), 'dropped': 0}
+            arrays = {col: np.ascontiguousarray(values[live]) for col, values in self._columns.items()}
+            # Kept so a late segment of a superseded version is still masked
+            arrays[SUPERSEDES] = np.unique(self._superseded)
+            self._write_segment(arrays)
+            for name in old:
+                shutil.rmtree(os.path.join(self._segment_dir, name), ignore_errors=True)
+            self._segments = self._segments[-1:]
+            dropped = len(self._columns['version']) - int(live.sum())
+            self._columns = None
+            self._load()
+        logger.info("Compacted %d analytics segments (%d superseded rows dropped)", len(old), dropped)
+        return {'segments': len(old), 'rows': len(arrays['version']), 'dropped': dropped}
+
+    # --- QUERIES ---
+    def _select(self, since=None, until=None) -> np.ndarray:
+        """Row mask: live rows with since <= report date <= until (YYYY-MM-DD or date)."""
+        mask = self._live_mask()
+        day = self._columns['day']
+        if since:
+            mask = mask & (day >= _to_day(since))
+        if until:
+            mask = mask & (day <= _to_day(until))
+        return mask
+
+    def count_by(self, column: str, since=None, until=None, limit=None) -> list:
+        """[(value, defect count)] for a string column, most frequent first."""
+        with self._lock:
+            self._load()
+            codes = self._columns[column][self._select(since, until)]
+            values = self._dictionaries[column]
+        counts = np.bincount(codes, minlength=len(values))
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0][:limit]
+        return [(values[i], int(counts[i])) for i in order]
+
+    def top_standards(self, limit: int = 10, since=None, until=None) -> list:
+        """Most cited standards (clause codes grouped by standard), excluding defects without one."""
+        return [(s, n) for s, n in self.count_by('standard', since, until) if s not in ('', '-')][:limit]
+
+    def category_by_month(self, since=None, until=None):
+        """
+        Defects per category per month: (months as 'YYYY-MM', categories,
+        counts array of shape (months, categories)).
+        """
+        with self._lock:
+            self._load()
+            mask = self._select(since, until)
+            days = self._columns['day'][mask]
+            categories = self._columns['category'][mask]
+            names = list(self._dictionaries['category'])
+        if not len(days):
+            return [], names, np.zeros((0, len(names)), np.int64)
+        months = (_EPOCH + days.astype('timedelta64[D]')).astype('datetime64[M]').astype(np.int64)
+        first = int(months.min())
+        cells = (months - first) * len(names) + categories
+        span = int(months.max()) - first + 1
+        counts = np.bincount(cells, minlength=span * len(names)).reshape(span, len(names))
+        labels = [str(np.datetime64(first + i, 'M')) for i in range(span)]
+        return labels, names, counts
+
+    def kpis(self, today: date = None) -> dict:
+        """Headline numbers for the dashboard."""
+        today = today or date.today()
+        with self._lock:
+            self._load()
+            live = self._live_mask()
+            month = live & (self._columns['day'] >= _month_start(today))
+            clients, report_ids = self._columns['client'], self._columns['version']
+            return {
+                'customers': _distinct_codes(clients[live]),
+                'reports': _distinct_runs(report_ids[live]),
+                'defects': int(live.sum()),
+                'customers_this_month': _distinct_codes(clients[month]),
+                'reports_this_month': _distinct_runs(report_ids[month]),
+                'defects_this_month': int(month.sum()),
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load()
+            return {'segments': len(self._segments), 'rows': len(self._columns['version']),
+                    'live_rows': int(self._live_mask().sum()), 'superseded_versions': len(self._superseded)}
+
+
+def backfill(store: DefectAnalytics, report_versions: versions.ReportVersions = None) -> int:
+    """Adds the latest version of every inspection not yet in the store; returns rows added."""
+    report_versions = report_versions or versions.get_report_versions()
+    items = []
+    for info in report_versions.latest_versions():
+        if not store.has_version(info.id):
+            chain = [v.id for v in report_versions.list_versions(info.series) if v.id != info.id]
+            items.append((info.id, report_versions.load(info.id), chain, None))
+    return store.add_reports(items)
+
+
+def _open_store() -> DefectAnalytics:
+    is_new = not os.path.exists(os.path.join(ANALYTICS_DIR, "dictionaries.json"))
+    store = DefectAnalytics()
+    if is_new:
+        added = backfill(store)
+        if added:
+            logger.info("Backfilled %d analytics rows from the report versions", added)
+    return store
+
+
+def get_defect_analytics() -> DefectAnalytics:
+    """Returns the process-wide analytics store, backfilled from the report versions when first created."""
+    return resources.shared('defect_analytics', _open_store)
@@ -0,0 +1,544 @@
+"""
+Report API for FieldScribe
+Handles the headless HTTP service for programmatic report generation:
+photos are uploaded once into the BlobStore, report definitions are queued
+to a pool of generation workers, and the finished .docx/.pdf files are
+streamed back. Plain asyncio, no web framework
+
+    python -m api --port 8765 --workers 2 --queue 16
+
+Endpoints (JSON unless noted):
+    PUT  /photos                          raw image bytes -> {"digest", "bytes"}
+    POST /reports                         report definition -> 202 {"id", "status", "position"}
+    GET  /reports/<id>[?wait=s]           job status (waits up to s seconds for it to finish)
+    GET  /reports/<id>/<lang>.<fmt>[?wait=s]  the generated file (application/octet-stream)
+    DELETE /reports/<id>                  cancels a queued job / forgets a finished one
+    GET  /health                          queue depth, workers, counters
+
+A report definition mirrors the deck's defect dicts, with photos given as
+digests from PUT /photos:
+    {"client_name": "...", "general_notes": "", "report_mode": "standard",
+     "languages": ["he"], "formats": ["docx"], "preset": "standard", "logo": null,
+     "defects": [{"title": "...", "desc": "", "code": "", "category": "General",
+                  "photos": ["<digest>"], "map_photos": [], "tool_photos": [],
+                  "tool_name": "", "tool_desc": ""}]}
+"""
+
+import argparse
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from urllib import parse
+
+import logic
+import report_model
+import storage
+import sync
+
+logger = logging.getLogger(__name__)
+
+API_HOST = os.environ.get("FIELDSCRIBE_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("FIELDSCRIBE_API_PORT", "8765"))
+# Reports generated at once (each one also uses the shared photo and translation pools)
+API_WORKERS = int(os.environ.get("FIELDSCRIBE_API_WORKERS", "2"))
+# Jobs waiting beyond this are refused with 503 and Retry-After
+API_QUEUE_SIZE = int(os.environ.get("FIELDSCRIBE_API_QUEUE", "16"))
+# Finished jobs (and their files) kept for download, oldest dropped first
+API_KEEP_JOBS = int(os.environ.get("FIELDSCRIBE_API_KEEP_JOBS", "64"))
+# Bearer token required on every request when set
+API_TOKEN = os.environ.get("FIELDSCRIBE_API_TOKEN", "")
+
+MAX_JSON_BYTES = 1024 * 1024
+MAX_PHOTO_BYTES = 64 * 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+# An unread request body up to this size is skipped to keep the connection; larger ones close it
+MAX_DISCARD_BYTES = 64 * 1024
+MAX_WAIT_SECONDS = 120.0
+STREAM_CHUNK_BYTES = 256 * 1024
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_FILE_PATH = re.compile(r"^/reports/([0-9a-f]+)/([a-z]+)\.(docx|pdf)$")
+_JOB_PATH = re.compile(r"^/reports/([0-9a-f]+)$")
+_REASONS = {200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized",
+            404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 411: "Length Required",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+_MIME = {'docx': "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+         'pdf': "application/pdf"}
+PHOTO_FIELDS = ('photos', 'map_photos', 'tool_photos')
+CANCELLED = 'cancelled'
+
+
+class ApiError(Exception):
+    """An HTTP error answer: status code, message and optional extra headers."""
+
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _handles(digests, blobs: storage.BlobStore, where: str) -> tuple:
+    if not isinstance(digests, list):
+        raise ApiError(400, f"{where} must be a list of photo digests")
+    for digest in digests:
+        if not isinstance(digest, str) or not _DIGEST.match(digest) or not blobs.exists(digest):
+            raise ApiError(400, f"{where}: unknown photo {str(digest)[:70]!r} (upload it with PUT /photos)")
+    return tuple(report_model.PhotoHandle(digest) for digest in digests)
+
+
+def report_from_definition(definition: dict, blobs: storage.BlobStore) -> report_model.Report:
+    """Validates a report definition (see the module docstring) and returns the typed Report."""
+    if not isinstance(definition, dict) or not str(definition.get('client_name') or '').strip():
+        raise ApiError(400, "client_name is required")
+    defects = definition.get('defects') or []
+    if not isinstance(defects, list) or not all(isinstance(d, dict) for d in defects):
+        raise ApiError(400, "defects must be a list of objects")
+    typed = []
+    for i, d in enumerate(defects):
+        photos = {name: _handles(d.get(name) or [], blobs, f"defects[{i}].{name}") for name in PHOTO_FIELDS}
+        typed.append(report_model.Defect(
+            title=str(d.get('title') or 'Defect'),
+            desc=str(d.get('desc') or ''),
+            code=report_model.intern_code(d.get('code')),
+            category=report_model.intern_category(d.get('category')),
+            mode=str(d.get('mode') or definition.get('report_mode') or 'standard'),
+            tool_name=str(d.get('tool_name') or ''),
+            tool_desc=str(d.get('tool_desc') or ''),
+            **photos,
+        ))
+    logo = definition.get('logo')
+    return report_model.Report(
+        client_name=str(definition['client_name']).strip(),
+        general_notes=str(definition.get('general_notes') or ''),
+        report_mode=str(definition.get('report_mode') or 'standard'),
+        defects=typed,
+        logo=_handles([logo], blobs, "logo")[0] if logo else None,
+        date=str(definition.get('date') or datetime.now().strftime("%Y-%m-%d")),
+        engineer=str(definition.get('engineer') or logic.ENGINEER_NAME),
+    )
+
+
+def _options(definition: dict) -> tuple:
+    """(languages, formats, preset) of a definition, validated."""
+    languages = definition.get('languages') or [logic.ORIGINAL_LANGUAGE]
+    formats = definition.get('formats') or ['docx']
+    preset = definition.get('preset') or logic.DEFAULT_PRESET
+    if not isinstance(languages, list) or any(lang not in logic.REPORT_LANGUAGES for lang in languages):
+        raise ApiError(400, f"languages must be a list of {sorted(logic.REPORT_LANGUAGES)}")
+    if not isinstance(formats, list) or any(fmt not in _MIME for fmt in formats):
+        raise ApiError(400, f"formats must be a list of {sorted(_MIME)}")
+    if preset not in logic.OUTPUT_PRESETS:
+        raise ApiError(400, f"preset must be one of {sorted(logic.OUTPUT_PRESETS)}")
+    return list(dict.fromkeys(languages)), tuple(dict.fromkeys(formats)), preset
+
+
+@dataclass(slots=True)
+class Job:
+    id: str
+    seq: int
+    report: report_model.Report
+    languages: list
+    formats: tuple
+    preset: str
+    status: str = sync.PENDING
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    error: str = ''
+    outputs: dict = field(default_factory=dict)     # "<lang>.<fmt>" -> bytes
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class ReportService:
+    """
+    Bounded FIFO of report jobs served by `workers` asyncio tasks, each
+    running one generation at a time on a thread (logic.render_reports
+    releases the GIL for the photo work and fans it out to the shared
+    pools). A full queue refuses new jobs instead of growing: the caller
+    sees 503 with Retry-After. Must be created inside the running loop.
+    """
+
+    def __init__(self, workers: int = API_WORKERS, queue_size: int = API_QUEUE_SIZE, keep: int = API_KEEP_JOBS,
+                 blobs: storage.BlobStore = None, translator=None):
+        self.blobs = blobs or storage.BlobStore()
+        self.translator = translator
+        self.workers = workers
+        self.keep = keep
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._seq = itertools.count(1)
+        self._dequeued = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-report")
+        self._tasks = []
+        self.counters = {'submitted': 0, 'refused': 0, 'done': 0, 'failed': 0, 'cancelled': 0,
+                         'generate_seconds': 0.0}
+
+    def start(self) -> None:
+        if self.translator is None:
+            self.translator = sync.cached_translator()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"api-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- JOBS ---
+    def submit(self, definition: dict) -> Job:
+        """Validates and queues a report definition; ApiError(503) when the queue is full."""
+        languages, formats, preset = _options(definition)
+        report = report_from_definition(definition, self.blobs)
+        job = Job(os.urandom(8).hex(), next(self._seq), report, languages, formats, preset)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['refused'] += 1
+            raise ApiError(503, "Queue full, retry later", {'Retry-After': str(self._retry_after())})
+        self._jobs[job.id] = job
+        self.counters['submitted'] += 1
+        return job
+
+    def _retry_after(self) -> int:
+        done = self.counters['done'] + self.counters['failed']
+        mean = self.counters['generate_seconds'] / done if done else 5.0
+        return max(1, round(mean * self._queue.qsize() / self.workers))
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ApiError(404, "No such report job")
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """A queued job is marked cancelled (skipped by the workers); a finished one is forgotten."""
+        job = self.get(job_id)
+        if job.status == sync.RUNNING:
+            raise ApiError(409, "The report is being generated")
+        if job.status == sync.PENDING:
+            job.status, job.finished = CANCELLED, time.time()
+            self.counters['cancelled'] += 1
+            job.done.set()
+        else:
+            del self._jobs[job_id]
+        return job
+
+    def _forget_old(self) -> None:
+        finished = [j.id for j in self._jobs.values() if j.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job_id]
+
+    def _generate(self, job: Job) -> dict:
+        outputs = logic.render_reports(job.report, job.languages, self.translator, job.formats, job.preset)
+        return {f"{language}.{fmt}": buffer.getvalue()
+                for language, files in outputs.items() for fmt, buffer in files.items()}
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            self._dequeued = job.seq
+            try:
+                if job.status == CANCELLED:
+                    continue
+                job.status, job.started = sync.RUNNING, time.time()
+                try:
+                    job.outputs = await loop.run_in_executor(self._executor, self._generate, job)
+                    job.status = sync.DONE
+                except Exception as e:
+                    logger.exception("Report job %s failed", job.id)
+                    job.status, job.error = sync.FAILED, f"{type(e).__name__}: {e}"
+                job.finished = time.time()
+                self.counters[job.status] += 1
+                self.counters['generate_seconds'] += job.finished - job.started
+                job.report = None  # the files are all that is needed from here on
+                job.done.set()
+                self._forget_old()
+            finally:
+                self._queue.task_done()
+
+    def describe(self, job: Job) -> dict:
+        info = {'id': job.id, 'status': job.status, 'created': job.created}
+        if job.status == sync.PENDING:
+            info['position'] = max(1, job.seq - self._dequeued)
+        if job.started:
+            info['started'] = job.started
+        if job.finished:
+            info['finished'] = job.finished
+            if job.started:
+                info['seconds'] = round(job.finished - job.started, 3)
+        if job.error:
+            info['error'] = job.error
+        if job.status == sync.DONE:
+            info['files'] = [{'name': name, 'bytes': len(data), 'url': f"/reports/{job.id}/{name}"}
+                             for name, data in job.outputs.items()]
+        return info
+
+    def stats(self) -> dict:
+        running = sum(1 for j in self._jobs.values() if j.status == sync.RUNNING)
+        return {'workers': self.workers, 'queued': self._queue.qsize(), 'queue_size': self._queue.maxsize,
+                'running': running, 'jobs_kept': len(self._jobs),
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.counters.items()}}
+
+
+@dataclass(slots=True)
+class Request:
+    """A parsed request head; body_read is set once its body has been consumed."""
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body_read: bool = False
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get('connection', '').lower() != 'close'
+
+    @property
+    def chunked(self) -> bool:
+        return 'chunked' in self.headers.get('transfer-encoding', '').lower()
+
+    @property
+    def content_length(self) -> int:
+        try:
+            return max(0, int(self.headers.get('content-length', '0')))
+        except ValueError:
+            return -1
+
+
+class ReportServer:
+    """Minimal HTTP/1.1 front end (keep-alive, Content-Length bodies) for a ReportService."""
+
+    def __init__(self, service: ReportService, host: str = API_HOST, port: int = API_PORT, token: str = API_TOKEN):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.token = token
+        self._server = None
+
+    async def start(self):
+        self.service.start()
+        self._server = await asyncio.start_server(self._client, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Report API listening on http://%s:%d", self.host, self.port)
+        return self._server
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.service.stop()
+
+    # --- HTTP ---
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ApiError as e:
+                    await self._send_json(writer, e.status, {'error': str(e)}, e.headers, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                try:
+                    self._authorize(request.headers)
+                    status, payload, headers = await self._route(request, reader)
+                    keep_alive = await self._keeps_alive(request, reader)
+                    if isinstance(payload, bytes):
+                        await self._send_file(writer, status, payload, headers, keep_alive)
+                    else:
+                        await self._send_json(writer, status, payload, headers, keep_alive)
+                except ApiError as e:
+                    # Possibly answered before its body was read (auth, routing, limits): the body
+                    # must not be parsed as the next request
+                    keep_alive = await self._keeps_alive(request, reader)
+                    await self._send_json(writer, e.status, {'error': str(e)}, e.headers, keep_alive)
+                except Exception as e:
+                    logger.exception("API request %s %s failed", request.method, request.path)
+                    await self._send_json(writer, 500, {'error': f"{type(e).__name__}: {e}"}, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ApiError(413, "Request headers too large")
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ", 2)
+        except ValueError:
+            raise ApiError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        url = parse.urlsplit(target)
+        return Request(method.upper(), url.path, dict(parse.parse_qsl(url.query)), headers)
+
+    def _authorize(self, headers: dict) -> None:
+        if not self.token:
+            return
+        supplied = headers.get('authorization', '').encode('latin-1')
+        if not hmac.compare_digest(supplied, f"Bearer {self.token}".encode('utf-8')):
+            raise ApiError(401, "Missing or wrong bearer token", {'WWW-Authenticate': 'Bearer'})
+
+    @staticmethod
+    async def _keeps_alive(request: Request, reader) -> bool:
+        """
+        Whether the connection can serve another request once this one is
+        answered. A body the route did not read is skipped when it is small;
+        otherwise (chunked, unknown or large) the connection is closed.
+        """
+        if not request.keep_alive:
+            return False
+        if request.body_read:
+            return True
+        length = request.content_length
+        if request.chunked or length < 0 or length > MAX_DISCARD_BYTES:
+            return False
+        if length:
+            await reader.readexactly(length)
+        request.body_read = True
+        return True
+
+    @staticmethod
+    async def _read_body(request: Request, reader, limit: int) -> bytes:
+        if request.chunked:
+            raise ApiError(411, "Send a Content-Length body (chunked uploads are not supported)")
+        if 'content-length' not in request.headers or request.content_length < 0:
+            raise ApiError(411, "Content-Length is required")
+        length = request.content_length
+        if length > limit:
+            raise ApiError(413, f"Body larger than {limit} bytes")
+        body = await reader.readexactly(length) if length else b''
+        request.body_read = True
+        return body
+
+    async def _route(self, request: Request, reader) -> tuple:
+        """(status, payload, headers) of the answer; payload is bytes for a file, JSON-able otherwise."""
+        service = self.service
+        method, path, query = request.method, request.path, request.query
+        if path == '/health' and method == 'GET':
+            return 200, service.stats(), None
+
+        if path == '/photos' and method in ('PUT', 'POST'):
+            data = await self._read_body(request, reader, MAX_PHOTO_BYTES)
+            if not data:
+                raise ApiError(400, "Empty photo")
+            digest = await asyncio.get_running_loop().run_in_executor(None, service.blobs.put, data)
+            return 201, {'digest': digest, 'bytes': len(data)}, None
+
+        if path == '/reports' and method == 'POST':
+            body = await self._read_body(request, reader, MAX_JSON_BYTES)
+            try:
+                definition = json.loads(body or b'{}')
+            except ValueError as e:
+                raise ApiError(400, f"Invalid JSON: {e}")
+            job = service.submit(definition)
+            return 202, service.describe(job), {'Location': f"/reports/{job.id}"}
+
+        match = _JOB_PATH.match(path)
+        if match and method == 'GET':
+            job = await self._wait(service.get(match.group(1)), query)
+            return 200, service.describe(job), None
+        if match and method == 'DELETE':
+            job = service.cancel(match.group(1))
+            return 200, service.describe(job), None
+
+        match = _FILE_PATH.match(path)
+        if match and method == 'GET':
+            job = await self._wait(service.get(match.group(1)), query)
+            if job.status != sync.DONE:
+                raise ApiError(409, f"Report is {job.status}" + (f": {job.error}" if job.error else ""),
+                               {'Retry-After': '1'} if not job.done.is_set() else None)
+            name = f"{match.group(2)}.{match.group(3)}"
+            data = job.outputs.get(name)
+            if data is None:
+                raise ApiError(404, f"This job did not generate {name}")
+            return 200, data, {'Content-Type': _MIME[match.group(3)],
+                               'Content-Disposition': f'attachment; filename="FieldScribe_{job.id}_{name}"'}
+
+        if path in ('/health', '/photos', '/reports') or _JOB_PATH.match(path) or _FILE_PATH.match(path):
+            raise ApiError(405, f"{method} is not allowed on {path}")
+        raise ApiError(404, f"No route for {path}")
+
+    @staticmethod
+    async def _wait(job: Job, query: dict) -> Job:
+        try:
+            wait = min(float(query.get('wait', 0)), MAX_WAIT_SECONDS)
+        except ValueError:
+            raise ApiError(400, "wait must be a number of seconds")
+        if wait > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    @staticmethod
+    def _head(status: int, headers: dict, keep_alive: bool) -> bytes:
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        headers = {**headers, 'Connection': 'keep-alive' if keep_alive else 'close'}
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _send_json(self, writer, status: int, payload, headers: dict = None, keep_alive: bool = True):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(self._head(status, {'Content-Type': 'application/json; charset=utf-8',
+                                         'Content-Length': len(body), **(headers or {})}, keep_alive) + body)
+        await writer.drain()
+
+    async def _send_file(self, writer, status: int, data: bytes, headers: dict, keep_alive: bool):
+        """Streams a generated file in chunks, waiting for the client to drain each one."""
+        writer.write(self._head(status, {**headers, 'Content-Length': len(data)}, keep_alive))
+        view = memoryview(data)
+        for offset in range(0, len(data), STREAM_CHUNK_BYTES):
+            writer.write(view[offset:offset + STREAM_CHUNK_BYTES])
+            await writer.drain()
+
+
+async def serve(host: str = API_HOST, port: int = API_PORT, workers: int = API_WORKERS,
+                queue_size: int = API_QUEUE_SIZE, token: str = API_TOKEN) -> None:
+    """Runs the report API until cancelled."""
+    server = ReportServer(ReportService(workers, queue_size), host, port, token)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless FieldScribe report generation API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="reports generated at once")
+    parser.add_argument("--queue", type=int, default=API_QUEUE_SIZE, help="jobs waiting before 503")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,56 @@
+import logging
+import os
 import streamlit as st
 import ui_components
 import logic
+import storage
+import checkpoint
+import sync
+import glossary
+import memory
+import report_model
+import versions
+import analytics
+import kpis
+import profiling
 
 # Page Config (Must be the first command)
 st.set_page_config(page_title="Civil+", page_icon="🏗️", layout="wide")
 
 
+def restore_inspection():
+    """
+    Ties the browser session to an inspection id kept in the URL and, after a
+    dropped connection or worker restart, restores its last checkpoint.
+    """
+    checkpoints = checkpoint.get_checkpoint_store()
+    inspection_id = None
+    try:
+        inspection_id = st.query_params.get("inspection")
+    except Exception:
+        pass
+
+    if checkpoint.is_valid_inspection_id(inspection_id) and checkpoints.exists(inspection_id):
+        try:
+            restored = checkpoints.restore(inspection_id)
+            for key, value in restored.items():
+                st.session_state[key] = value
+        except Exception as e:
+            st.warning(f"Could not restore the saved inspection: {e}")
+    else:
+        inspection_id = checkpoint.new_inspection_id()
+        try:
+            st.query_params["inspection"] = inspection_id
+        except Exception:
+            pass
+    st.session_state.inspection_id = inspection_id
+
+
 def main():
+    # --- CHECKPOINT RESTORE (once per browser session, before defaults) ---
+    if 'inspection_id' not in st.session_state:
+        restore_inspection()
+
     # --- SESSION STATE SETUP ---
     if 'page' not in st.session_state:
         st.session_state.page = 'home'
@@ -21,38 +65,11 @@ def main():
         st.session_state.crm_events = {}
     if 'selected_calendar_date' not in st.session_state:
         st.session_state.selected_calendar_date = None
-    if 'customer_count' not in st.session_state:
-        st.session_state.customer_count = 150
-    if 'monthly_revenue' not in st.session_state:
-        st.session_state.monthly_revenue = 45000
-    if 'demo_users' not in st.session_state:
-        # Pre-fill demo users with minimal file data for MVP
-        st.session_state.demo_users = {
-            'user1': {
-                'name': 'John Smith',
-                'email': 'john.smith@example.com',
-                'role': 'Engineer',
-                'files': [
-                    {'name': 'Inspection_Report_2024_01.docx', 'date': '2024-01-15', 'size': '2.3 MB'}
-                ]
-            },
-            'user2': {
-                'name': 'Sarah Johnson',
-                'email': 'sarah.j@example.com',
-                'role': 'Senior Inspector',
-                'files': [
-                    {'name': 'Building_Inspection_2024_02.docx', 'date': '2024-02-20', 'size': '3.1 MB'}
-                ]
-            },
-            'user3': {
-                'name': 'Michael Chen',
-                'email': 'm.chen@example.com',
-                'role': 'Field Engineer',
-                'files': [
-                    {'name': 'Property_Inspection_2024_03.docx', 'date': '2024-03-10', 'size': '2.9 MB'}
-                ]
-            }
-        }
+    # Users & report files live in the persistent registry (seeded with demo users on first run)
+    registry = storage.get_user_registry()
+    if 'current_user' not in st.session_state:
+        first_users, _ = registry.search_users(page_size=1)
+        st.session_state.current_user = first_users[0]['id'] if first_users else None
     if 'selected_user' not in st.session_state:
         st.session_state.selected_user = None
 
@@ -68,32 +85,125 @@ def main():
 
     # PAGE 3: REVIEW
     elif st.session_state.page == 'review':
-        client_name, notes, translate, logo_file = ui_components.render_review_screen()
+        client_name, notes, languages, logo_file = ui_components.render_review_screen()
 
+        archive = storage.get_report_archive()
+        generated = False
         if st.button("🚀 Generate Final Report", type="primary", use_container_width=True):
             if not client_name:
                 st.error("Please enter a Client Name first.")
+            elif not languages:
+                st.error("Please choose at least one report language.")
             else:
-                with st.spinner("Generating Word Document..."):
+                with st.spinner("Generating Report..."):
                     try:
-                        buffer = logic.process_report(
-                            client_name,
-                            notes,
-                            st.session_state.selected_defects,
-                            translate,
-                            st.session_state.report_mode,
-                            logo_file
+                        # Attach tool images downloaded by the sync worker
+                        defects, pending = sync.resolve_pending_photos(
+                            st.session_state.selected_defects, sync.get_work_queue()
                         )
+                        if pending:
+                            st.warning(f"{pending} tool image(s) are still waiting for the network and were left out.")
+                        # One pass: image compression is shared by every language and format,
+                        # translations for all languages run concurrently
+                        formats = ('docx', 'pdf') if st.session_state.get('export_pdf') else ('docx',)
+                        preset = st.session_state.get('output_preset', logic.DEFAULT_PRESET)
+                        report = report_model.build_report(client_name, notes, defects,
+                                                           st.session_state.report_mode, logo_file,
+                                                           engineer=logic.ENGINEER_NAME)
+                        profile_path = None
+                        if st.session_state.get('profile_generation'):
+                            outputs, profile_path = profiling.profile_report(
+                                report, languages, translator=sync.cached_translator(), formats=formats,
+                                preset=preset, cold=True, label=client_name
+                            )
+                        else:
+                            outputs = logic.render_reports(report, languages, translator=sync.cached_translator(),
+                                                           formats=formats, preset=preset)
                         st.success("Report Ready!")
-                        st.download_button(
-                            label="📥 Download .docx",
-                            data=buffer,
-                            file_name=f"FieldScribe_{client_name}.docx",
-                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                        )
+                        # Each generation is the next version of this inspection's report
+                        try:
+                            version = versions.get_report_versions().commit(st.session_state.inspection_id,
+                                                                            report, preset)
+                            st.caption(f"Saved as version {version.number} of this report.")
+                            # Dashboard analytics count the latest version of each inspection
+                            user = (registry.get_user(st.session_state.current_user)
+                                    if st.session_state.current_user else None)
+                            analytics.get_defect_analytics().add_report(
+                                version.id, report, supersedes=[version.parent_id],
+                                engineer=user['name'] if user else None
+                            )
+                            kpis.get_kpi_counters().record_report(version.id, report,
+                                                                  supersedes=[version.parent_id])
+                        except Exception as e:
+                            st.warning(f"Report version could not be saved: {e}")
+                        for language, files in outputs.items():
+                            suffix = '' if language == logic.ORIGINAL_LANGUAGE else f"_{language}"
+                            buffer = files['docx']
+                            file_name = f"FieldScribe_{client_name}{suffix}.docx"
+                            # Archive the report so it can be re-downloaded without regenerating
+                            report_id = None
+                            try:
+                                report_id = archive.archive(buffer, file_name, client=client_name,
+                                                            user_id=st.session_state.current_user)
+                                st.session_state.last_report_id = report_id
+                            except Exception as e:
+                                st.warning(f"Report could not be archived: {e}")
+                            # Link the generated file to the engineer in the CRM registry
+                            if st.session_state.current_user:
+                                registry.add_file(st.session_state.current_user, file_name,
+                                                  buffer.getbuffer().nbytes, client=client_name,
+                                                  report_id=report_id)
+                            language_name = logic.REPORT_LANGUAGES.get(language, language)
+                            st.download_button(
+                                label=f"📥 Download .docx — {language_name} "
+                                      f"({logic.format_file_size(buffer.getbuffer().nbytes)})",
+                                data=buffer,
+                                file_name=file_name,
+                                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                key=f"download_docx_{language}"
+                            )
+                            if 'pdf' in files:
+                                st.download_button(
+                                    label=f"📥 Download .pdf — {language_name}",
+                                    data=files['pdf'],
+                                    file_name=f"FieldScribe_{client_name}{suffix}.pdf",
+                                    mime="application/pdf",
+                                    key=f"download_pdf_{language}"
+                                )
+                        if profile_path:
+                            with open(profile_path, 'rb') as f:
+                                st.download_button("🔬 Download profile bundle", data=f.read(),
+                                                   file_name=os.path.basename(profile_path),
+                                                   mime="application/zip", key="download_profile")
+                        generated = True
+                        # Offline glossary coverage (process-wide, per target language)
+                        for target, stats in glossary.get_glossary().stats().items():
+                            st.caption(
+                                f"Glossary ({target}): {stats['string_coverage']:.0%} of strings and "
+                                f"{stats['word_coverage']:.0%} of words translated offline · "
+                                f"{stats['local_mean_us']:.0f} µs local, {stats['remote_mean_ms']:.0f} ms remote per string"
+                            )
                     except Exception as e:
                         st.error(f"Error generating report: {e}")
 
+        # Re-download the last report straight from the archive (no regeneration); the zip is
+        # rebuilt from its blobs only when asked for, then served from the archive's cache
+        if not generated and st.session_state.get('last_report_id'):
+            report = archive.get_report(st.session_state.last_report_id)
+            if report and st.session_state.get('prepared_report_id') == report['id']:
+                st.download_button(
+                    label=f"📥 Download last report ({report['file_name']})",
+                    data=archive.report_bytes(report['id']),
+                    file_name=report['file_name'],
+                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    key="download_archived_report"
+                )
+            elif report and st.button(f"⬇️ Prepare last report ({report['file_name']})", key="prepare_archived_report"):
+                st.session_state.prepared_report_id = report['id']
+                st.rerun()
+
+        ui_components.render_report_versions(st.session_state.inspection_id)
+
         if st.button("← Back to Deck"):
             st.session_state.page = 'deck'
             st.rerun()
@@ -102,6 +212,22 @@ def main():
     elif st.session_state.page == 'crm':
         ui_components.render_crm_dashboard()
 
+    # PAGE 5: SESSION MEMORY (admin, reached from the CRM dashboard)
+    elif st.session_state.page == 'admin':
+        ui_components.render_memory_admin()
+
+    # --- MEMORY ACCOUNTING (sampled; over the soft limit the largest photos spill to disk) ---
+    try:
+        memory.account_session(st.session_state)
+    except Exception as e:
+        logging.getLogger(__name__).warning("Memory accounting failed: %s", e)
+
+    # --- CHECKPOINT (only changed defects are rewritten) ---
+    try:
+        checkpoint.get_checkpoint_store().save(st.session_state.inspection_id, st.session_state)
+    except Exception as e:
+        logging.getLogger(__name__).warning("Checkpoint failed: %s", e)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
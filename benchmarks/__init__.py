@@ -0,0 +1,4 @@
+"""
+Benchmarks for FieldScribe
+Run from the repository root, e.g. `python -m benchmarks.bench_report_formats`
+"""
@@ -0,0 +1,82 @@
+"""
+Dashboard aggregation cost over years of synthetic defect rows in the
+columnar analytics store: KPIs, defects per category per month and top
+standards, cold (memory-mapped load) and warm.
+
+    python -m benchmarks.bench_analytics --years 5 --reports-per-month 400
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from datetime import date
+
+import analytics
+import report_model
+from benchmarks.common import timed, summary
+
+CODES = ["SI-1142 §4.2", "SI-1205", "SI-1555 §3.1", "SI-1752", "SI-1928", "SI-900 §7", "SI-2100", "-", ""]
+CLIENTS = 3000
+
+
+def synthetic_reports(years, per_month, defects, seed=1):
+    rng = random.Random(seed)
+    start = date.today().year - years + 1
+    version = 0
+    for year in range(start, start + years):
+        for month in range(1, 13):
+            for _ in range(per_month):
+                version += 1
+                report = report_model.Report(
+                    client_name=f"Client {rng.randrange(CLIENTS)}",
+                    date=f"{year}-{month:02d}-{rng.randint(1, 28):02d}",
+                    engineer=f"Engineer {rng.randrange(12)}",
+                    defects=[report_model.Defect(title='', category=rng.choice(report_model.CATEGORIES),
+                                                 code=rng.choice(CODES))
+                             for _ in range(rng.randint(1, defects * 2))],
+                )
+                # Every tenth report is a regeneration of the previous one
+                supersedes = [version - 1] if version % 10 == 0 else []
+                yield version, report, supersedes, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--reports-per-month", type=int, default=400)
+    parser.add_argument("--defects", type=int, default=8, help="mean defects per report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store = analytics.DefectAnalytics(root)
+        start = time.perf_counter()
+        batch = []
+        for item in synthetic_reports(args.years, args.reports_per_month, args.defects):
+            batch.append(item)
+            if len(batch) == args.reports_per_month:  # one segment per month
+                store.add_reports(batch)
+                batch = []
+        store.add_reports(batch)
+        store.compact()
+        print(f"{store.stats()['rows']} rows ({args.years} years) ingested and compacted in "
+              f"{time.perf_counter() - start:.2f}s")
+
+        def cold():
+            return analytics.DefectAnalytics(root).kpis()
+
+        since = date(date.today().year - 1, date.today().month, 1)
+        _, t_cold = timed(cold, 3)
+        kpis, t_kpis = timed(store.kpis, 20)
+        _, t_months = timed(lambda: store.category_by_month(since=since), 20)
+        top, t_top = timed(lambda: store.top_standards(10), 20)
+        print(f"cold load + kpis             {summary(t_cold)}")
+        print(f"kpis                         {summary(t_kpis)}")
+        print(f"category by month (12 mo)    {summary(t_months)}")
+        print(f"top standards                {summary(t_top)}")
+        print(kpis)
+        print(top[:5])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Report throughput of the headless API (api.py) against the Streamlit path:
+the same number of reports (same defects, photos and languages, distinct
+photos per report so neither path is served from the compression cache)
+submitted by concurrent HTTP clients, then generated by concurrent
+inspectors driving app.py (benchmarks.load_sessions), both with the stub
+translator.
+
+    python -m benchmarks.bench_api --reports 8 --clients 4 --workers 2
+    python -m benchmarks.bench_api --reports 8 --skip-streamlit
+
+The Streamlit side times the 🚀 rerun of each session (the deck is filled in
+beforehand and not counted); its throughput is reports / wall time of the
+generation phase. The Streamlit side needs the Streamlit version pinned in requirements.txt.
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from benchmarks.load_sessions import (concurrent_app_test, install_stubs, percentiles,  # sets the data dir
+                                      ProcessSampler, run_session)
+from benchmarks.common import synthetic_photo
+
+import api
+
+
+def start_api(workers: int, queue_size: int):
+    """Runs a ReportServer on a free port in a background event loop; returns (server, loop)."""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+
+        async def boot():
+            holder['server'] = api.ReportServer(api.ReportService(workers, queue_size), "127.0.0.1", 0, token='')
+            await holder['server'].start()
+        loop.run_until_complete(boot())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="bench-api", daemon=True).start()
+    ready.wait()
+    return holder['server'], loop
+
+
+def _request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def api_client(port, jobs, photos, args, timings, failures):
+    """Uploads the photos, submits, waits and downloads each report of jobs (one connection)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.timeout)
+    for index in jobs:
+        start = time.perf_counter()
+        try:
+            defects = []
+            for d in range(args.defects):
+                digests = []
+                for p in range(args.photos):
+                    status, body = _request(conn, "PUT", "/photos", photos[index, d, p])
+                    if status != 201:
+                        raise RuntimeError(f"upload: {status} {body[:200]!r}")
+                    digests.append(json.loads(body)['digest'])
+                defects.append({'title': f"סדק בקיר {index}-{d}", 'photos': digests})
+            definition = {'client_name': f"API Client {index}", 'defects': defects,
+                          'languages': args.languages, 'preset': args.preset}
+            while True:
+                status, body = _request(conn, "POST", "/reports", json.dumps(definition).encode('utf-8'),
+                                        {'Content-Type': 'application/json'})
+                if status != 503:
+                    break
+                time.sleep(0.2)
+            if status != 202:
+                raise RuntimeError(f"submit: {status} {body[:200]!r}")
+            job = json.loads(body)['id']
+            status, body = _request(conn, "GET", f"/reports/{job}?wait={api.MAX_WAIT_SECONDS}")
+            info = json.loads(body)
+            if info['status'] != 'done':
+                raise RuntimeError(f"job {job}: {info}")
+            for language in args.languages:
+                status, body = _request(conn, "GET", f"/reports/{job}/{language}.docx")
+                if status != 200 or not body.startswith(b"PK"):
+                    raise RuntimeError(f"download {language}: {status}")
+            timings.append(time.perf_counter() - start)
+        except Exception as e:
+            failures.append(f"report {index}: {type(e).__name__}: {e}")
+    conn.close()
+
+
+def bench_api(args) -> dict:
+    server, loop = start_api(args.workers, args.queue)
+    timings, failures = [], []
+    clients = max(1, min(args.clients, args.reports))
+    photos = {(i, d, p): synthetic_photo(i * 10_000 + d * 100 + p, (args.width, args.height)).getvalue()
+              for i in range(args.reports) for d in range(args.defects) for p in range(args.photos)}
+    with ProcessSampler() as sampler:
+        threads = [threading.Thread(target=api_client,
+                                    args=(server.port, range(i, args.reports, clients), photos, args, timings, failures))
+                   for i in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    return {'timings': timings, 'failures': failures, 'process': sampler.stats()}
+
+
+def bench_streamlit(args) -> dict:
+    """Fills in every session's deck first, then clicks 🚀 in all of them at once."""
+    app_test = concurrent_app_test()
+    session_args = SimpleNamespace(defects=args.defects, photos=args.photos, width=args.width, height=args.height,
+                                   languages=args.languages, preset=args.preset, tool_search=False,
+                                   think_ms=0, timeout=args.timeout)
+    barrier = threading.Barrier(args.reports + 1)
+    timings, failures, waited = [], [], set()
+    original_run = app_test._run
+
+    def gated_run(self, *a, **kw):
+        # The first rerun on the review page is the 🚀 click: hold it until every session is there
+        if 'page' in self.session_state and self.session_state['page'] == 'review' and id(self) not in waited:
+            waited.add(id(self))
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+        return original_run(self, *a, **kw)
+    app_test._run = gated_run
+
+    def session(index):
+        run_session(app_test, index, session_args, timings, failures)
+        if len(failures):
+            barrier.abort()  # a session that failed on the deck never reaches the barrier
+
+    threads = [threading.Thread(target=session, args=(1_000_000 + i,)) for i in range(args.reports)]
+    for t in threads:
+        t.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    with ProcessSampler() as sampler:
+        for t in threads:
+            t.join()
+    generate = [seconds for page, action, seconds in timings if action == 'generate']
+    return {'timings': generate, 'failures': failures, 'process': sampler.stats()}
+
+
+def _print(name, result, reports):
+    process = result['process']
+    ok = len(result['timings'])
+    rate = ok / process['wall_seconds'] if process['wall_seconds'] else 0.0
+    line = f"{name:10s} {ok:3d}/{reports} reports  wall {process['wall_seconds']:7.2f}s  {rate:6.2f} reports/s"
+    if result['timings']:
+        p = percentiles(result['timings'])
+        line += f"  per report p50 {p['p50_ms']:8.1f} ms  p90 {p['p90_ms']:8.1f} ms"
+    print(line + f"  cpu {process['cpu_percent']}%  rss peak {process['rss_mb_peak']} MB")
+    for failure in result['failures']:
+        print(f"  FAILED {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent HTTP clients")
+    parser.add_argument("--workers", type=int, default=api.API_WORKERS, help="API generation workers")
+    parser.add_argument("--queue", type=int, default=api.API_QUEUE_SIZE)
+    parser.add_argument("--defects", type=int, default=5)
+    parser.add_argument("--photos", type=int, default=3)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--languages", nargs="+", default=["he"])
+    parser.add_argument("--preset", default="standard")
+    parser.add_argument("--translate-ms", type=float, default=50, help="stub translator latency")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--skip-streamlit", action="store_true")
+    args = parser.parse_args()
+
+    stub = install_stubs(args.translate_ms / 1000, 0)
+    print(f"{args.reports} reports x {args.defects} defects x {args.photos} photos ({args.width}x{args.height}), "
+          f"languages {' '.join(args.languages)}, {args.clients} clients, {args.workers} API workers")
+    _print("api", bench_api(args), args.reports)
+    if not args.skip_streamlit:
+        _print("streamlit", bench_streamlit(args), args.reports)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
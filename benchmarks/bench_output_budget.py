@@ -0,0 +1,45 @@
+"""
+Byte-budgeted output: report size and transform time per output preset,
+first with a cold rendition pyramid, then re-encoding at another budget
+(renditions only, the originals are not decoded again).
+
+    python -m benchmarks.bench_output_budget --defects 40 --photos 4
+"""
+
+import argparse
+import tempfile
+
+import imaging
+import logic
+import report_model
+import storage
+from benchmarks.common import synthetic_defects, timed, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--defects", type=int, default=40)
+    parser.add_argument("--photos", type=int, default=4, help="photos per defect")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    defects = synthetic_defects(args.defects, args.photos, (args.width, args.height))
+    blobs = storage.BlobStore()
+    imaging.RENDITION_DIR = tempfile.mkdtemp(prefix="renditions_")  # start cold
+    report = report_model.build_report("Bench", "notes", defects, blobs=blobs)
+    print(f"{args.defects} defects x {args.photos} photos ({args.width}x{args.height})")
+
+    def run(preset):
+        logic.compression_cache().clear()
+        return logic.render_docx(logic.transform_report(report, False, blobs=blobs, preset=preset))
+
+    for preset in ('standard', 'email', 'print'):
+        budget = logic.OUTPUT_PRESETS[preset]['budget_bytes']
+        doc, times = timed(lambda: run(preset), 1)
+        target = f"<= {logic.format_file_size(budget)}" if budget else "no budget"
+        print(f"{preset:9s} {logic.format_file_size(doc.getbuffer().nbytes):>9s} ({target:>11s})  {summary(times)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Capture-time photo analysis cost (perceptual hash + blur score) per shot,
+against a full-resolution decode for comparison, and duplicate lookup cost
+as a defect accumulates shots.
+
+    python -m benchmarks.bench_photo_analysis --photos 10
+"""
+
+import argparse
+
+from PIL import Image
+
+import imaging
+from benchmarks.common import synthetic_photo, timed, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    photos = [synthetic_photo(i, (args.width, args.height)) for i in range(args.photos)]
+    print(f"{args.photos} photos ({args.width}x{args.height})")
+
+    def full_decode():
+        for p in photos:
+            p.seek(0)
+            Image.open(p).convert('L').load()
+
+    def analyze():
+        return [imaging.analyze_photo(p) for p in photos]
+
+    _, t_full = timed(full_decode, 3)
+    sigs, t_analyze = timed(analyze, 3)
+    n = len(photos)
+    print(f"full-size decode only        {summary([t / n for t in t_full])} per photo")
+    print(f"analyze (draft + hash + blur) {summary([t / n for t in t_analyze])} per photo")
+
+    for count in (10, 100, 1000):
+        existing = (sigs * (count // len(sigs) + 1))[:count]
+        _, t_check = timed(lambda: imaging.check_capture(sigs[0], existing), 20)
+        print(f"check_capture vs {count:4d} shots   {summary(t_check)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Times each stage of the report pipeline independently:
+build (UI dicts -> typed Report), transform (translate + compress, serial vs
+parallel, cold vs warm cache) and render (docx).
+
+    python -m benchmarks.bench_pipeline --defects 20 --photos 4
+"""
+
+import argparse
+import tracemalloc
+
+import logic
+import report_model
+import storage
+from benchmarks.common import synthetic_defects, timed, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--defects", type=int, default=20)
+    parser.add_argument("--photos", type=int, default=4, help="photos per defect")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    defects = synthetic_defects(args.defects, args.photos, (args.width, args.height))
+    blobs = storage.BlobStore()
+    print(f"{args.defects} defects x {args.photos} photos ({args.width}x{args.height})")
+
+    report, t_build = timed(lambda: report_model.build_report("Bench", "notes", defects, blobs=blobs), 3)
+    print(f"1. build (first run stores blobs)  {summary(t_build[:1])}")
+    print(f"1. build (photos already stored)   {summary(t_build[1:])}")
+
+    def transform(workers):
+        logic.compression_cache().clear()
+        return logic.transform_report(report, False, blobs=blobs, max_workers=workers)
+
+    _, t_serial = timed(lambda: transform(1), 1)
+    model, t_parallel = timed(lambda: transform(None), 1)
+    _, t_warm = timed(lambda: logic.transform_report(report, False, blobs=blobs), 3)
+    print(f"2. transform, 1 worker (cold)      {summary(t_serial)}")
+    print(f"2. transform, {logic._default_workers()} workers (cold)     {summary(t_parallel)}")
+    print(f"2. transform, cached               {summary(t_warm)}")
+
+    _, t_render = timed(lambda: logic.render_docx(model), 3)
+    print(f"3. render docx                     {summary(t_render)}")
+
+    # Memory of the typed model vs. the UI dicts it replaces (excluding photo bytes)
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    as_dicts = [report_model.normalize_defect(dict(d, photos=[])) for d in defects * 50]
+    dict_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    snapshot = tracemalloc.take_snapshot()
+    as_model = [report_model.defect_from_dict(dict(d, photos=[]), blobs) for d in defects * 50]
+    model_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    tracemalloc.stop()
+    print(f"per-defect memory: dict {dict_bytes / len(as_dicts):.0f} B, "
+          f"Defect {model_bytes / len(as_model):.0f} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Times the docx and PDF renderers against the same report model.
+
+    python -m benchmarks.bench_report_formats --defects 20 --photos 4
+"""
+
+import argparse
+
+import logic
+import pdf_render
+from benchmarks.common import synthetic_defects, timed, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--defects", type=int, default=20)
+    parser.add_argument("--photos", type=int, default=4, help="photos per defect")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    defects = synthetic_defects(args.defects, args.photos, (args.width, args.height))
+    print(f"{args.defects} defects x {args.photos} photos ({args.width}x{args.height})")
+
+    model, t_model = timed(lambda: logic.build_report_model("Bench", "notes", defects, False), args.repeat)
+    docx, t_docx = timed(lambda: logic.render_docx(model), args.repeat)
+    pdf, t_pdf = timed(lambda: pdf_render.render_pdf(model), args.repeat)
+    _, t_both = timed(lambda: logic.generate_report("Bench", "notes", defects, False,
+                                                    formats=('docx', 'pdf')), args.repeat)
+    _, t_docx_only = timed(lambda: logic.process_report("Bench", "notes", defects, False), args.repeat)
+
+    print(f"build model (compress)   {summary(t_model)}")
+    print(f"render docx              {summary(t_docx)}  {len(docx.getvalue()) / 1e6:6.2f} MB")
+    print(f"render pdf               {summary(t_pdf)}  {len(pdf.getvalue()) / 1e6:6.2f} MB")
+    print(f"process_report (docx)    {summary(t_docx_only)}")
+    print(f"generate_report docx+pdf {summary(t_both)}")
+
+
+if __name__ == "__main__":
+    main()
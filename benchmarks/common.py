@@ -0,0 +1,53 @@
+"""
+Shared helpers for the benchmark scripts: synthetic inputs and timing.
+"""
+
+import statistics
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_photo(seed: int, size=(4000, 3000), quality: int = 90) -> BytesIO:
+    """
+    A JPEG that compresses like a real site photo: smooth gradients plus
+    noise (a pure-noise image would be unrealistically large).
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    small = rng.integers(0, 255, (max(h // 64, 2), max(w // 64, 2), 3), dtype=np.uint8)
+    base = Image.fromarray(small).resize(size, Image.Resampling.BICUBIC)
+    noise = rng.normal(0, 8, (h, w, 1)).astype(np.int16)
+    pixels = np.clip(np.asarray(base, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG', quality=quality)
+    buf.seek(0)
+    buf.name = f"photo_{seed}.jpg"
+    return buf
+
+
+def synthetic_defects(count: int, photos_per_defect: int, size=(4000, 3000)):
+    """Defect dicts shaped like the ones render_inspection_deck produces."""
+    return [{
+        "title": f"רטיבות בקיר {i}",
+        "desc": "Moisture >13% measured at floor level.",
+        "code": "SI-1752",
+        "category": "Structural",
+        "photos": [synthetic_photo(i * 100 + j, size) for j in range(photos_per_defect)],
+    } for i in range(count)]
+
+
+def timed(fn, repeat: int = 3):
+    """Runs fn repeat times; returns (last result, list of seconds)."""
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def summary(times) -> str:
+    return f"median {statistics.median(times) * 1000:8.1f} ms  min {min(times) * 1000:8.1f} ms"
@@ -0,0 +1,313 @@
+"""
+Concurrent-session load test: drives simulated inspectors through
+home -> deck (defects with synthetic photos, a tool search) -> review ->
+generate, each session in its own thread running app.py in-process
+(streamlit.testing AppTest), with a stub translator and a stub Wikimedia
+server. Reports latency percentiles per page/action and process CPU/RSS.
+
+    python -m benchmarks.load_sessions --sessions 8 --defects 5 --photos 3
+    python -m benchmarks.load_sessions --sessions 16 --json load_history.jsonl
+
+Needs the Streamlit version pinned in requirements.txt (1.40 or later).
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+# Everything the app writes goes to a throwaway data dir; this must be set
+# before the app modules are imported (they read it at import time).
+os.environ.setdefault("FIELDSCRIBE_DATA_DIR", tempfile.mkdtemp(prefix="fieldscribe_load_"))
+
+from benchmarks.common import synthetic_photo  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# --- STUB SERVICES ---
+class _WikimediaStub(BaseHTTPRequestHandler):
+    """Answers every search with a fixed page of results (thumb/full URLs on the stub)."""
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        pages = {str(i): {"imageinfo": [{"thumburl": f"{host}/t{i}.jpg", "url": f"{host}/f{i}.jpg"}]}
+                 for i in range(8)}
+        body = json.dumps({"query": {"pages": pages}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_wikimedia_stub(latency: float) -> ThreadingHTTPServer:
+    _WikimediaStub.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _WikimediaStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StubTranslator:
+    """Stands in for GoogleTranslator: fixed latency, tags the text with the target."""
+    latency = 0.0
+
+    def __init__(self, target):
+        self.target = target
+
+    def translate(self, text):
+        time.sleep(self.latency)
+        return f"[{self.target}] {text}"
+
+
+def install_stubs(translate_latency: float, http_latency: float):
+    """Registers the stub translator pools and points the Wikimedia URL at a local stub server."""
+    import logic
+    import resources
+    import sync
+
+    StubTranslator.latency = translate_latency
+    for language in logic.REPORT_LANGUAGES:
+        resources.shared(f'translator:auto:{language}',
+                         lambda language=language: resources.ClientPool(lambda: StubTranslator(language)))
+    server = start_wikimedia_stub(http_latency)
+    sync.WIKIMEDIA_API_URL = f"http://127.0.0.1:{server.server_address[1]}/w/api.php"
+    return server
+
+
+# --- PROCESS SAMPLING ---
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, Linux reports KiB
+
+
+class ProcessSampler(threading.Thread):
+    """Samples RSS periodically; CPU time comes from getrusage at start/stop."""
+
+    def __init__(self, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(_rss_bytes())
+            self._stop_event.wait(self.interval)
+
+    def __enter__(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._cpu0, self._wall0 = usage.ru_utime + usage.ru_stime, time.perf_counter()
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop_event.set()
+        self.join()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu_seconds = usage.ru_utime + usage.ru_stime - self._cpu0
+        self.wall_seconds = time.perf_counter() - self._wall0
+
+    def stats(self) -> dict:
+        samples = self.samples or [_rss_bytes()]
+        return {
+            'wall_seconds': round(self.wall_seconds, 2),
+            'cpu_seconds': round(self.cpu_seconds, 2),
+            'cpu_percent': round(100 * self.cpu_seconds / self.wall_seconds, 1) if self.wall_seconds else 0.0,
+            'cpu_count': os.cpu_count(),
+            'rss_mb_mean': round(statistics.fmean(samples) / 2**20, 1),
+            'rss_mb_peak': round(max(samples) / 2**20, 1),
+        }
+
+
+# --- CONCURRENT APP DRIVER ---
+def concurrent_app_test():
+    """
+    AppTest class whose reruns can overlap across threads. AppTest installs a
+    mock Runtime (and the appTest config flag) around every rerun and clears
+    it afterwards, so concurrent instances tear each other's runtime down,
+    and compiles the script again for every rerun. Here one runtime and one
+    script cache serve the whole load run, as on a real server.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+    script_cache = ScriptCache()
+    script_cache.get_bytecode(APP_PATH)
+
+    class ConcurrentAppTest(AppTest):
+        def _run(self, widget_state=None, timeout=None):
+            pages_manager = PagesManager(self._script_path, setup_watcher=False)
+            runner = LocalScriptRunner(self._script_path, self.session_state, pages_manager,
+                                       args=self.args, kwargs=self.kwargs)
+            runner._script_cache = script_cache
+            self._tree = runner.run(widget_state, self.query_params,
+                                    timeout or self.default_timeout, self._page_hash)
+            self._tree._runner = self
+            self.query_params = parse.parse_qs(runner.event_data[-1]["client_state"].query_string)
+            return self
+
+    return ConcurrentAppTest
+
+
+# --- SIMULATED SESSION ---
+class SessionFailed(Exception):
+    pass
+
+
+def _button(at, prefix):
+    for button in at.button:
+        if button.label.startswith(prefix):
+            return button
+    raise SessionFailed(f"No button starting with {prefix!r} on page {at.session_state.page!r}")
+
+
+def _check(at, action):
+    if at.exception:
+        raise SessionFailed(f"{action}: {at.exception[0].value}")
+
+
+def run_session(app_test, index, args, timings, failures):
+    """One inspector's visit; appends (page, action, seconds) to timings."""
+    at = app_test(APP_PATH, default_timeout=args.timeout)
+    current = ['']
+
+    def step(page, action, fn):
+        current[0] = f"{page}/{action}"
+        time.sleep(args.think_ms / 1000)
+        start = time.perf_counter()
+        fn()
+        timings.append((page, action, time.perf_counter() - start))
+        _check(at, action)
+
+    try:
+        step('home', 'load', at.run)
+        step('home', 'start_inspection', lambda: _button(at, "Start Inspection").click().run())
+        if args.tool_search:
+            at.text_input(key="tool_query").set_value("drill")
+            step('deck', 'tool_search', lambda: _button(at, "Search Tool").click().run())
+        for d in range(args.defects):
+            # The title is the autocomplete component: its value is what the browser would send
+            title_key = f"defect_title_{at.session_state.title_input_id}"
+            at.session_state[title_key] = {'text': f"סדק בקיר {index}-{d}", 'seq': d + 1}
+            step('deck', 'type_title', at.run)
+            at.session_state.temp_photos = [
+                synthetic_photo(index * 10_000 + d * 100 + p, (args.width, args.height)) for p in range(args.photos)
+            ]
+            step('deck', 'add_defect', lambda: _button(at, "Add Defect").click().run())
+        step('deck', 'open_review', lambda: _button(at, "Review Checklist").click().run())
+        at.text_input[0].set_value(f"Load Client {index}")
+        at.multiselect(key="report_languages").set_value(args.languages)
+        at.radio(key="output_preset").set_value(args.preset)
+        step('review', 'generate', lambda: _button(at, "🚀").click().run())
+        if at.error:
+            raise SessionFailed(f"generate: {at.error[0].value}")
+    except Exception as e:
+        failures.append(f"session {index} after {current[0]}: {type(e).__name__}: {e}")
+
+
+# --- REPORTING ---
+def percentiles(times) -> dict:
+    ordered = sorted(times)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {'n': len(ordered), 'p50_ms': round(pct(50) * 1000, 1), 'p90_ms': round(pct(90) * 1000, 1),
+            'p99_ms': round(pct(99) * 1000, 1), 'max_ms': round(ordered[-1] * 1000, 1)}
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(APP_PATH),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent inspectors")
+    parser.add_argument("--defects", type=int, default=5, help="defects per session")
+    parser.add_argument("--photos", type=int, default=3, help="photos per defect")
+    parser.add_argument("--width", type=int, default=1600, help="photo width (burst capture sends <= 1600)")
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--languages", nargs="+", default=["he"])
+    parser.add_argument("--preset", default="standard")
+    parser.add_argument("--tool-search", action="store_true", help="also run a tool search per session")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause before each action")
+    parser.add_argument("--translate-ms", type=float, default=50, help="stub translator latency")
+    parser.add_argument("--http-ms", type=float, default=100, help="stub Wikimedia latency")
+    parser.add_argument("--timeout", type=float, default=300, help="per-rerun timeout (s)")
+    parser.add_argument("--json", help="append the results as one JSON line to this file")
+    args = parser.parse_args()
+
+    server = install_stubs(args.translate_ms / 1000, args.http_ms / 1000)
+    app_test = concurrent_app_test()
+    timings, failures = [], []
+    print(f"{args.sessions} sessions x {args.defects} defects x {args.photos} photos "
+          f"({args.width}x{args.height}), languages {' '.join(args.languages)}, preset {args.preset}")
+
+    with ProcessSampler() as sampler:
+        threads = [threading.Thread(target=run_session, args=(app_test, i, args, timings, failures))
+                   for i in range(args.sessions)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    server.shutdown()
+
+    by_action = defaultdict(list)
+    for page, action, seconds in timings:
+        by_action[f"{page}/{action}"].append(seconds)
+    actions = {name: percentiles(times) for name, times in by_action.items()}
+    process = sampler.stats()
+
+    print(f"{'page/action':24s} {'n':>4s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for name, s in actions.items():
+        print(f"{name:24s} {s['n']:4d} {s['p50_ms']:9.1f} {s['p90_ms']:9.1f} {s['p99_ms']:9.1f} {s['max_ms']:9.1f}")
+    print(f"wall {process['wall_seconds']}s  cpu {process['cpu_seconds']}s ({process['cpu_percent']}% "
+          f"of {process['cpu_count']} cores)  rss mean {process['rss_mb_mean']} MB  peak {process['rss_mb_peak']} MB")
+    print(f"sessions ok {args.sessions - len(failures)}/{args.sessions}")
+    for failure in failures:
+        print(f"  FAILED {failure}")
+
+    if args.json:
+        record = {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'git_rev': _git_rev(),
+                  'config': vars(args), 'actions': actions, 'process': process, 'failures': failures}
+        with open(args.json, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Burst Capture for FieldScribe
+Custom Streamlit component that buffers several camera shots in the browser,
+downscales them there and uploads the whole batch in one round-trip, with
+each shot's position and capture time (which the downscale would drop)
+"""
+
+import base64
+import binascii
+import logging
+import os
+from io import BytesIO
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import imaging
+
+logger = logging.getLogger(__name__)
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "burst_capture")
+_component = components.declare_component("burst_capture", path=_FRONTEND_DIR)
+
+# Long edge sent by the browser: the largest width any output preset uses
+DEFAULT_MAX_WIDTH = 1600
+DEFAULT_QUALITY = 0.85
+DEFAULT_MAX_SHOTS = 24
+# Largest original EXIF block kept per shot (GPS and time sit in the first few KB)
+MAX_EXIF_BYTES = 64 * 1024
+
+
+def _decode_shot(shot, index):
+    try:
+        photo = BytesIO(base64.b64decode(shot['data'], validate=True))
+    except (KeyError, TypeError, binascii.Error) as e:
+        logger.warning("Dropped malformed burst shot %d: %s", index, e)
+        return None
+    photo.name = shot.get('name') or f"shot_{index + 1}.jpg"
+    # The browser's re-encode drops EXIF: keep what it sent alongside (see imaging.read_exif)
+    capture = {k: shot[k] for k in ('lat', 'lon', 'taken') if shot.get(k) is not None}
+    if shot.get('exif'):
+        try:
+            exif = base64.b64decode(shot['exif'], validate=True)
+            if len(exif) <= MAX_EXIF_BYTES:
+                capture['exif'] = exif
+        except (TypeError, binascii.Error):
+            pass
+    if capture:
+        setattr(photo, imaging.CAPTURE_ATTR, capture)
+    return photo
+
+
+def burst_capture(key, label="Open camera", max_width=DEFAULT_MAX_WIDTH, quality=DEFAULT_QUALITY,
+                  max_shots=DEFAULT_MAX_SHOTS):
+    """
+    Renders the burst capture widget and returns the photos of a newly
+    uploaded batch as BytesIO objects (named like uploads), or [] when
+    nothing new arrived. Each batch is returned exactly once per session.
+
+    The batch stays in the component's value (and is re-sent by the browser
+    with every rerun) until the widget is replaced: once a batch has been
+    consumed, callers move on to a new key, as with st.camera_input.
+    """
+    value = _component(key=key, label=label, max_width=max_width, quality=quality,
+                       max_shots=max_shots, default=None)
+    if not value or not value.get('batch_id'):
+        return []
+    seen_key = f"_burst_{key}_batch"
+    if st.session_state.get(seen_key) == value['batch_id']:
+        return []
+    st.session_state[seen_key] = value['batch_id']
+    photos = [_decode_shot(shot, i) for i, shot in enumerate(value.get('shots') or [])]
+    return [p for p in photos if p is not None]
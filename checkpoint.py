@@ -0,0 +1,237 @@
+"""
+Session Checkpointing for FieldScribe
+Saves the in-progress inspection to disk so it survives dropped connections
+and worker restarts
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+
+import report_model
+import resources
+import storage
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.path.join(storage.DATA_DIR, "checkpoints")
+
+# Session-state keys that make up an inspection (every temp_* key is saved as well)
+CHECKPOINT_KEYS = (
+    'page', 'report_mode', 'client_name', 'selected_defects', 'crm_events',
+    'tool_name', 'tool_desc', 'selected_tool_url',
+)
+CHECKPOINT_PREFIXES = ('temp_',)
+_DEFECT_FIELDS = {f.name for f in dataclasses.fields(report_model.Defect)}
+# _encode's result for a value that is not saved
+_SKIPPED = object()
+
+def _dumps(obj) -> bytes:
+    if MSGPACK_AVAILABLE:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data: bytes):
+    if MSGPACK_AVAILABLE:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data.decode('utf-8'))
+
+
+def _is_file_like(value) -> bool:
+    return hasattr(value, 'read') and hasattr(value, 'seek')
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SessionCheckpoint:
+    """
+    Incremental on-disk checkpoints of an inspection.
+
+    Layout per inspection:
+        <root>/<inspection_id>/manifest.<ext>      scalars, temp_* fields, defect order
+        <root>/<inspection_id>/defects/<key>.<ext> one record per defect, named by content hash
+    Photos are replaced by references into the shared BlobStore, so image bytes
+    are written once and never re-serialized. A defect file is only written
+    when its content changes; unchanged defects are referenced by key.
+    """
+
+    def __init__(self, root=None, blobs: storage.BlobStore = None):
+        self.root = root or CHECKPOINT_DIR
+        self.blobs = blobs or storage.BlobStore()
+        self.ext = 'msgpack' if MSGPACK_AVAILABLE else 'json'
+        self._last_manifest = {}
+        self._skipped_types = set()
+        self._lock = threading.Lock()
+
+    # --- ENCODING ---
+    def _photo_ref(self, photo) -> dict:
+        """Stores a photo in the blob store (once) and returns its reference."""
+        return {'$blob': self.blobs.put_file(photo), 'name': getattr(photo, 'name', None)}
+
+    def _encode(self, value):
+        if _is_file_like(value):
+            return self._photo_ref(value)
+        if isinstance(value, report_model.PhotoHandle):
+            return {'$blob': value.digest, 'name': value.name, 'handle': True}
+        if isinstance(value, report_model.Defect):
+            return {'$defect': {f.name: self._encode(getattr(value, f.name)) for f in dataclasses.fields(value)}}
+        if isinstance(value, dict):
+            encoded = {str(k): self._encode(v) for k, v in value.items()}
+            return {k: v for k, v in encoded.items() if v is not _SKIPPED}
+        if isinstance(value, (list, tuple)):
+            return [v for v in map(self._encode, value) if v is not _SKIPPED]
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        # Anything else would not come back as itself: leave it out of the checkpoint
+        kind = type(value).__name__
+        if kind not in self._skipped_types:
+            self._skipped_types.add(kind)
+            logger.warning("Not checkpointing a %s value (only JSON types and photos are saved)", kind)
+        return _SKIPPED
+
+    def _decode(self, value):
+        if isinstance(value, dict):
+            if '$blob' in value and value.get('handle'):
+                return report_model.PhotoHandle(value['$blob'], value.get('name') or '')
+            if '$defect' in value:
+                fields = {k: self._decode(v) for k, v in value['$defect'].items() if k in _DEFECT_FIELDS}
+                return report_model.Defect(**{k: tuple(v) if isinstance(v, list) else v for k, v in fields.items()})
+            if '$blob' in value:
+                photo = BytesIO(self.blobs.read(value['$blob']))
+                if value.get('name'):
+                    photo.name = value['name']
+                setattr(photo, storage.BLOB_ATTR, value['$blob'])
+                return photo
+            return {k: self._decode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
+
+    # --- SAVE / RESTORE ---
+    def _dir(self, inspection_id: str) -> str:
+        return os.path.join(self.root, inspection_id)
+
+    def exists(self, inspection_id: str) -> bool:
+        return os.path.exists(os.path.join(self._dir(inspection_id), f"manifest.{self.ext}"))
+
+    def save(self, inspection_id: str, state) -> bool:
+        """
+        Checkpoints the inspection keys of state (a dict or st.session_state).
+        Returns True when anything was written.
+        """
+        with self._lock:
+            base = self._dir(inspection_id)
+            defect_dir = os.path.join(base, "defects")
+            os.makedirs(defect_dir, exist_ok=True)
+
+            defect_keys = []
+            for defect in state.get('selected_defects', []) or []:
+                record = _dumps(self._encode(defect))
+                key = storage.BlobStore.digest(record)[:32]
+                path = os.path.join(defect_dir, f"{key}.{self.ext}")
+                if not os.path.exists(path):
+                    _write_atomic(path, record)
+                defect_keys.append(key)
+
+            fields = {}
+            for key in list(state.keys()):
+                if key == 'selected_defects':
+                    continue
+                if key in CHECKPOINT_KEYS or key.startswith(CHECKPOINT_PREFIXES):
+                    value = self._encode(state[key])
+                    if value is not _SKIPPED:
+                        fields[key] = value
+
+            manifest = _dumps({'version': 1, 'fields': fields, 'defects': defect_keys})
+            if self._last_manifest.get(inspection_id) == manifest:
+                return False
+            manifest_path = os.path.join(base, f"manifest.{self.ext}")
+            _write_atomic(manifest_path, manifest)
+            self._last_manifest[inspection_id] = manifest
+            self._prune_defects(defect_dir, set(defect_keys))
+            return True
+
+    def _prune_defects(self, defect_dir: str, live_keys: set) -> None:
+        """Removes defect records no longer referenced by the manifest."""
+        for name in os.listdir(defect_dir):
+            key, _, ext = name.partition('.')
+            if ext == self.ext and key not in live_keys:
+                try:
+                    os.remove(os.path.join(defect_dir, name))
+                except OSError:
+                    pass
+
+    def restore(self, inspection_id: str):
+        """
+        Loads a checkpoint and returns a dict of session-state values, or
+        None if there is none. selected_defects come back as Defects with
+        photo handles; other photos (temp_*) as BytesIO objects.
+        """
+        start = time.perf_counter()
+        base = self._dir(inspection_id)
+        manifest_path = os.path.join(base, f"manifest.{self.ext}")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'rb') as f:
+            raw = f.read()
+        manifest = _loads(raw)
+
+        state = self._decode(manifest.get('fields', {}))
+        defects = []
+        for key in manifest.get('defects', []):
+            with open(os.path.join(base, "defects", f"{key}.{self.ext}"), 'rb') as f:
+                defect = self._decode(_loads(f.read()))
+            # Checkpoints from before defects were typed hold dicts (their photos are already blobs)
+            defects.append(report_model.defect_from_dict(defect, self.blobs))
+        state['selected_defects'] = defects
+
+        with self._lock:
+            self._last_manifest[inspection_id] = raw
+        logger.info("Restored inspection %s (%d defects) in %.3fs",
+                    inspection_id, len(defects), time.perf_counter() - start)
+        return state
+
+    def delete(self, inspection_id: str) -> None:
+        """Drops an inspection's checkpoint (photo blobs stay in the shared store)."""
+        with self._lock:
+            shutil.rmtree(self._dir(inspection_id), ignore_errors=True)
+            self._last_manifest.pop(inspection_id, None)
+
+
+def new_inspection_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def is_valid_inspection_id(value) -> bool:
+    """Inspection ids come from the URL, so only accept the format we generate."""
+    return isinstance(value, str) and re.fullmatch(r"[0-9a-f]{12}", value) is not None
+
+
+def get_checkpoint_store() -> SessionCheckpoint:
+    """Returns the process-wide checkpoint store."""
+    return resources.shared('checkpoint_store', SessionCheckpoint)
@@ -0,0 +1,41 @@
+"""
+Defect Autocomplete for FieldScribe
+Custom Streamlit component for the defect title: sends what the inspector
+types after a short pause and lists the defect library's suggestions under
+the input, so a previously used defect is one tap away
+"""
+
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "defect_autocomplete")
+_component = components.declare_component("defect_autocomplete", path=_FRONTEND_DIR)
+
+# Pause in typing before the text is sent (each send is one rerun)
+DEFAULT_DEBOUNCE_MS = 150
+
+
+def defect_autocomplete(key, suggest, label, value="", placeholder="", debounce_ms=DEFAULT_DEBOUNCE_MS):
+    """
+    Renders the title input and returns (text, picked): the current text and,
+    on the rerun in which a suggestion was chosen, that suggestion's dict
+    (else None). suggest(text) returns the list of suggestion dicts to show;
+    each needs 'title' and may carry 'desc', 'code', 'category', 'uses' and
+    'translated'. A different key starts a fresh input holding value.
+    """
+    # The component's last value is in session state before it is drawn, so
+    # the suggestions sent with this render already match the text typed.
+    current = st.session_state.get(key) or {}
+    text = current.get('text', value)
+    suggestions = suggest(text) if text and text.strip() else []
+    result = _component(key=key, label=label, value=value, placeholder=placeholder, suggestions=suggestions,
+                        debounce_ms=debounce_ms, default=None) or {}
+    text = result.get('text', value)
+    picked = result.get('pick')
+    seen_key = f"_autocomplete_{key}_seq"
+    if picked and st.session_state.get(seen_key) != result.get('seq'):
+        st.session_state[seen_key] = result.get('seq')
+        return text, picked
+    return text, None
@@ -0,0 +1,299 @@
+"""
+Defect Library for FieldScribe
+Handles the library of defects added in earlier sessions and archived
+reports, and the ranked type-ahead suggestions offered in the inspection deck
+"""
+
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime
+
+import glossary
+import resources
+import storage
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_LIMIT = 8
+# Placeholders the deck and the report use for "no standard"
+_EMPTY_CODES = ('', '-', '____________________')
+
+_WORD_RE = re.compile(r"\w+")
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Fill of the title box render_docx draws above every defect
+_TITLE_FILL = 'FFFF00'
+
+
+def _words(text: str):
+    return _WORD_RE.findall((text or '').casefold())
+
+
+def _clean(text: str) -> str:
+    return " ".join((text or '').split())
+
+
+@dataclass(slots=True)
+class DefectEntry:
+    """One distinct (title, description) pair and how often it has been used."""
+    id: int
+    title: str
+    desc: str
+    code: str
+    category: str
+    uses: int
+    last_used: str
+    # Title words, lowercased and space-joined, for the starts-with ranking
+    key: str = ''
+
+
+# --- PREFIX INDEX ---
+class DefectIndex:
+    """
+    Word-prefix index over entry titles: a sorted list of (word, entry id)
+    pairs, so every query word is a bisect range. Results are ranked
+    titles-starting-with-the-query first, then by uses and recency.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = []
+        self._by_key = {}
+        self._words = []
+        self._lock = threading.Lock()
+        for entry in entries:
+            self._add(entry)
+        self._words.sort()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, entry: DefectEntry, keep_sorted=False):
+        entry.id = len(self.entries)
+        entry.key = " ".join(_words(entry.title))
+        self.entries.append(entry)
+        self._by_key[(entry.title, entry.desc)] = entry
+        for word in set(_words(entry.title)):
+            if keep_sorted:
+                bisect.insort(self._words, (word, entry.id))
+            else:
+                self._words.append((word, entry.id))
+
+    def update(self, title, desc, code, category, used):
+        """Counts one use of (title, desc), adding the entry if it is new."""
+        with self._lock:
+            entry = self._by_key.get((title, desc))
+            if entry is None:
+                self._add(DefectEntry(0, title, desc, code, category, 1, used), keep_sorted=True)
+                return
+            entry.uses += 1
+            entry.last_used = max(entry.last_used, used)
+            if code not in _EMPTY_CODES:
+                entry.code = code
+            if category:
+                entry.category = category
+
+    def _matching(self, word: str) -> set:
+        lo = bisect.bisect_left(self._words, (word,))
+        hi = bisect.bisect_left(self._words, (word + '\U0010ffff',))
+        return {entry_id for _, entry_id in self._words[lo:hi]}
+
+    def suggest(self, text: str, limit: int = SUGGEST_LIMIT):
+        """Entries whose title has a word starting with every word of text."""
+        words = _words(text)
+        if not words:
+            return []
+        query = " ".join(words)
+        with self._lock:
+            # The longest word usually has the narrowest range
+            words.sort(key=len, reverse=True)
+            ids = self._matching(words[0])
+            for word in words[1:]:
+                if not ids:
+                    break
+                ids &= self._matching(word)
+            entries = [self.entries[i] for i in ids]
+        return heapq.nlargest(limit, entries, key=lambda e: (e.key.startswith(query), e.uses, e.last_used))
+
+
+# --- ARCHIVE BACKFILL ---
+def _lines(element) -> list:
+    """Text of an element split at its line breaks (python-docx writes a \n as <w:br/>)."""
+    parts = []
+    for node in element.iter():
+        if node.tag == f'{_W}t':
+            parts.append(node.text or '')
+        elif node.tag in (f'{_W}br', f'{_W}cr') and node.get(f'{_W}type') in (None, 'textWrapping'):
+            parts.append('\n')
+    return [line for line in map(_clean, "".join(parts).split('\n')) if line]
+
+
+def _text(element) -> str:
+    return " ".join(_lines(element))
+
+
+def defects_from_docx_xml(document_xml: bytes):
+    """
+    (title, desc, code) for every defect card in a report's word/document.xml,
+    following render_docx's layout: a yellow title box, the description
+    paragraphs, the evidence table, the standard paragraph and a page break.
+    """
+    body = ET.fromstring(document_xml).find(f'{_W}body')
+    if body is None:
+        return []
+    found, current, after_table = [], None, False
+    for child in body:
+        if child.tag == f'{_W}tbl':
+            fills = {shd.get(f'{_W}fill', '').upper() for shd in child.iter(f'{_W}shd')}
+            if _TITLE_FILL in fills:
+                current, after_table = {'title': _text(child), 'desc': [], 'code': ''}, False
+                found.append(current)
+            elif current is not None:
+                after_table = True
+        elif child.tag == f'{_W}p' and current is not None:
+            lines = _lines(child)
+            if lines and after_table:
+                current['code'] = " ".join(lines)
+            elif lines:
+                current['desc'].extend(lines)
+            if any(br.get(f'{_W}type') == 'page' for br in child.iter(f'{_W}br')):
+                current = None
+    return [(d['title'], "\n".join(d['desc']), '' if d['code'] in _EMPTY_CODES else d['code'])
+            for d in found if d['title']]
+
+
+# --- LIBRARY ---
+class DefectLibrary:
+    """
+    Persistent defect usage counts with the prefix index held in memory.
+
+    Every defect added in the deck is recorded (record); the first time the
+    library is created it is seeded from the reports already archived, so
+    earlier work is suggested from day one.
+    """
+
+    def __init__(self, db_path=None, archive: storage.ReportArchive = None):
+        self._conn = storage.connect(db_path)
+        self._lock = threading.Lock()
+        self._timings = {'queries': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'defect_library'"
+            ).fetchone()
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS defect_library (
+                    title     TEXT NOT NULL,
+                    desc      TEXT NOT NULL DEFAULT '',
+                    code      TEXT NOT NULL DEFAULT '',
+                    category  TEXT NOT NULL DEFAULT '',
+                    uses      INTEGER NOT NULL DEFAULT 0,
+                    last_used TEXT NOT NULL,
+                    PRIMARY KEY (title, desc)
+                ) WITHOUT ROWID
+            """)
+        if not exists and archive is not None:
+            self.import_archive(archive)
+        self.index = self._load()
+
+    def _load(self) -> DefectIndex:
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT title, desc, code, category, uses, last_used FROM defect_library"
+            ).fetchall()
+        index = DefectIndex(DefectEntry(0, *row) for row in rows)
+        logger.info("Loaded %d library defects in %.3fs", len(index), time.perf_counter() - start)
+        return index
+
+    def _upsert(self, rows) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO defect_library (title, desc, code, category, uses, last_used)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (title, desc) DO UPDATE SET
+                    uses = uses + 1,
+                    last_used = MAX(last_used, excluded.last_used),
+                    code = CASE WHEN excluded.code = '' THEN code ELSE excluded.code END,
+                    category = CASE WHEN excluded.category = '' THEN category ELSE excluded.category END
+            """, rows)
+
+    @staticmethod
+    def _row(title, desc='', code='', category='', used=None):
+        code = _clean(code)
+        return (_clean(title), (desc or '').strip(), '' if code in _EMPTY_CODES else code,
+                category or '', used or datetime.now().isoformat(timespec='seconds'))
+
+    def record(self, title: str, desc: str = '', code: str = '', category: str = '') -> None:
+        """Counts one use of a defect (called whenever one is added to a report)."""
+        row = self._row(title, desc, code, category)
+        if not row[0]:
+            return
+        self._upsert([row])
+        self.index.update(*row)
+
+    def import_archive(self, archive: storage.ReportArchive) -> int:
+        """Counts the defects of every archived report; returns how many were found."""
+        rows, page = [], 0
+        while True:
+            reports, total = archive.list_reports(page=page, page_size=200)
+            for report in reports:
+                xml = archive.read_part(report['id'], 'word/document.xml')
+                if not xml:
+                    continue
+                try:
+                    defects = defects_from_docx_xml(xml)
+                except ET.ParseError as e:
+                    logger.warning("Skipped archived report %s: %s", report['id'], e)
+                    continue
+                rows.extend(self._row(title, desc, code, used=report['created']) for title, desc, code in defects)
+            page += 1
+            if page * 200 >= total:
+                break
+        self._upsert(rows)
+        logger.info("Imported %d defects from the report archive", len(rows))
+        return len(rows)
+
+    def suggest(self, text: str, limit: int = SUGGEST_LIMIT):
+        start = time.perf_counter()
+        results = self.index.suggest(text, limit)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._timings['queries'] += 1
+            self._timings['seconds'] += elapsed
+            self._timings['max_seconds'] = max(self._timings['max_seconds'], elapsed)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            t = dict(self._timings)
+        mean = t['seconds'] / t['queries'] if t['queries'] else 0.0
+        return {'entries': len(self.index), 'queries': t['queries'],
+                'mean_ms': round(mean * 1000, 3), 'max_ms': round(t['max_seconds'] * 1000, 3)}
+
+
+def cached_translation(text: str, target: str = 'ar'):
+    """
+    The translation of text built only from the glossary and the translation
+    cache, or None when some fragment would still need the remote service.
+    """
+    if not text:
+        return text
+    cache = storage.get_translation_cache()
+    terms = glossary.get_glossary()
+    match = terms.match(text, target)
+    translations = {}
+    for fragment in dict.fromkeys(match.leftover):
+        translated = cache.get(fragment, target)
+        if translated is None:
+            return None
+        translations[fragment] = translated
+    return match.fill(translations)
+
+
+def get_defect_library() -> DefectLibrary:
+    """Returns the process-wide defect library, seeded from the archive when first created."""
+    return resources.shared('defect_library', lambda: DefectLibrary(archive=storage.get_report_archive()))
@@ -0,0 +1,238 @@
+"""
+Glossary Translation for FieldScribe
+Handles offline translation of fixed construction vocabulary (defect titles,
+SI standard descriptions, report headings) with a phrase trie; only free text
+not covered by the glossary is sent to the remote translator
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import resources
+
+logger = logging.getLogger(__name__)
+
+GLOSSARY_PATH = os.environ.get(
+    "FIELDSCRIBE_GLOSSARY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossary.json")
+)
+
+# Words, including Hebrew acronyms (ת"י) and hyphenated codes (SI-1752)
+_WORD_RE = re.compile(r"[^\W_]+(?:['\"׳״\-][^\W_]+)*")
+_END = object()  # trie key marking the end of a phrase
+
+
+def _normalize(word: str) -> str:
+    return word.casefold()
+
+
+def _is_passthrough(word: str) -> bool:
+    """Codes, measurements and numbers (SI-1752, 105cm, 13) are the same in every language."""
+    return any(ch.isdigit() for ch in word)
+
+
+class PhraseTrie:
+    """Word-level trie mapping source phrases to their translation."""
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, phrase: str, translation: str) -> None:
+        words = [_normalize(w) for w in _WORD_RE.findall(phrase)]
+        if not words:
+            return
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        if _END not in node:
+            self.size += 1
+        node[_END] = translation
+
+    def longest_match(self, words, start: int):
+        """Returns (length in words, translation) of the longest phrase at words[start:], or (0, None)."""
+        node, best = self.root, (0, None)
+        for i in range(start, len(words)):
+            node = node.get(words[i])
+            if node is None:
+                break
+            if _END in node:
+                best = (i - start + 1, node[_END])
+        return best
+
+
+@dataclass(slots=True)
+class GlossaryMatch:
+    """
+    A text split into segments: (translated, text) pairs where untranslated
+    segments are the leftover free text for the remote service.
+    """
+    segments: list
+    words: int
+    covered: int
+
+    @property
+    def complete(self) -> bool:
+        return all(translated for translated, _ in self.segments)
+
+    @property
+    def leftover(self) -> list:
+        return [text for translated, text in self.segments if not translated]
+
+    @property
+    def coverage(self) -> float:
+        return self.covered / self.words if self.words else 1.0
+
+    @property
+    def text(self) -> str:
+        return ''.join(text for _, text in self.segments)
+
+    def fill(self, translations: dict) -> str:
+        """Joins the segments, replacing leftovers with translations[leftover] when present."""
+        return ''.join(text if translated else translations.get(text, text) for translated, text in self.segments)
+
+
+class Glossary:
+    """
+    Multilingual glossary: each entry maps the same term across languages, so
+    every language but the target is a source for that target. One trie per
+    target language is built on first use.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self._tries = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @classmethod
+    def load(cls, path=None) -> 'Glossary':
+        path = path or GLOSSARY_PATH
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls(json.load(f).get('entries', []))
+        except (OSError, ValueError) as e:
+            logger.warning("Glossary not loaded from %s: %s", path, e)
+            return cls()
+
+    def trie(self, target: str) -> PhraseTrie:
+        trie = self._tries.get(target)
+        if trie is None:
+            with self._lock:
+                trie = self._tries.get(target)
+                if trie is None:
+                    trie = PhraseTrie()
+                    for entry in self.entries:
+                        translation = entry.get(target)
+                        if not translation:
+                            continue
+                        for language, phrase in entry.items():
+                            if language != target and phrase:
+                                trie.add(phrase, translation)
+                    self._tries[target] = trie
+        return trie
+
+    # --- MATCHING ---
+    def match(self, text: str, target: str) -> GlossaryMatch:
+        """Longest-match substitution of glossary phrases; uncovered word runs are left as leftovers."""
+        start = time.perf_counter()
+        trie = self.trie(target)
+        spans = [(m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+        words = [_normalize(text[a:b]) for a, b in spans]
+
+        segments, pos, i, covered = [], 0, 0, 0
+        leftover_start = None  # index of the first word of the current uncovered run
+
+        def close_leftover(end_word):
+            nonlocal pos
+            a, b = spans[leftover_start][0], spans[end_word - 1][1]
+            segments.append((True, text[pos:a]))
+            segments.append((False, text[a:b]))
+            pos = b
+
+        while i < len(words):
+            length, translation = trie.longest_match(words, i)
+            if length == 0 and _is_passthrough(words[i]):
+                length, translation = 1, text[spans[i][0]:spans[i][1]]
+            if length:
+                if leftover_start is not None:
+                    close_leftover(i)
+                    leftover_start = None
+                a, b = spans[i][0], spans[i + length - 1][1]
+                segments.append((True, text[pos:a]))
+                segments.append((True, translation))
+                pos = b
+                covered += length
+                i += length
+            else:
+                if leftover_start is None:
+                    leftover_start = i
+                i += 1
+        if leftover_start is not None:
+            close_leftover(len(words))
+        segments.append((True, text[pos:]))
+
+        result = GlossaryMatch([s for s in segments if s[1]], len(words), covered)
+        self._record(target, 'local', time.perf_counter() - start, result)
+        return result
+
+    def translate(self, text: str, target: str, remote=None, match: GlossaryMatch = None) -> str:
+        """
+        Translates text: glossary phrases locally, leftover free text through
+        remote(fragment, target) when given (its exceptions propagate), else
+        left in the source language.
+        """
+        match = match or self.match(text, target)
+        if match.complete or remote is None:
+            return match.fill({})
+        start = time.perf_counter()
+        translations = {}
+        for fragment in dict.fromkeys(match.leftover):
+            translations[fragment] = remote(fragment, target) or fragment
+        self._record(target, 'remote', time.perf_counter() - start, match)
+        return match.fill(translations)
+
+    # --- STATS ---
+    def _record(self, target, kind, seconds, match):
+        with self._lock:
+            s = self._stats.setdefault(target, {
+                'strings': 0, 'complete': 0, 'words': 0, 'covered_words': 0,
+                'local_seconds': 0.0, 'remote_calls': 0, 'remote_fragments': 0, 'remote_seconds': 0.0,
+            })
+            if kind == 'local':
+                s['strings'] += 1
+                s['complete'] += match.complete
+                s['words'] += match.words
+                s['covered_words'] += match.covered
+                s['local_seconds'] += seconds
+            else:
+                s['remote_calls'] += 1
+                s['remote_fragments'] += len(match.leftover)
+                s['remote_seconds'] += seconds
+
+    def stats(self) -> dict:
+        """Per target language: coverage of strings and words, and mean local/remote latency."""
+        with self._lock:
+            out = {}
+            for target, s in self._stats.items():
+                out[target] = {
+                    **s,
+                    'string_coverage': s['complete'] / s['strings'] if s['strings'] else 0.0,
+                    'word_coverage': s['covered_words'] / s['words'] if s['words'] else 0.0,
+                    'local_mean_us': 1e6 * s['local_seconds'] / s['strings'] if s['strings'] else 0.0,
+                    'remote_mean_ms': 1e3 * s['remote_seconds'] / s['remote_calls'] if s['remote_calls'] else 0.0,
+                }
+            return out
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+def get_glossary() -> Glossary:
+    """Returns the process-wide glossary (loaded from GLOSSARY_PATH on first use)."""
+    return resources.shared('glossary', Glossary.load)
@@ -0,0 +1,568 @@
+"""
+Image Analysis for FieldScribe
+Handles perceptual hashing and sharpness scoring of captured photos so
+near-duplicates and blurry frames can be flagged at capture time, the EXIF
+location and capture time read from photo headers, the contact sheets used
+for on-screen previews, the multi-resolution rendition pyramid used for
+byte-budgeted report output and the company logo pipeline
+"""
+
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import resources
+import storage
+
+# All analysis runs on a small grayscale copy; JPEGs are DCT-downscaled while
+# decoding (Image.draft), so a 12MP photo is never decoded at full size.
+ANALYSIS_SIZE = 512
+HASH_SIZE = 8            # 8x8 low-frequency DCT block -> 64-bit hash
+_DCT_SIZE = 32
+
+# Hamming distance (out of 64 bits) at or below which two shots are near-duplicates
+DUPLICATE_DISTANCE = 6
+# Variance of the Laplacian (on the ANALYSIS_SIZE copy) below which a shot is blurry
+BLUR_THRESHOLD = 100.0
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so dct2(x) == D @ x @ D.T."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d.astype(np.float32)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+@dataclass(slots=True, frozen=True)
+class PhotoSignature:
+    """Perceptual hash and sharpness of one photo (stored per defect)."""
+    phash: int
+    sharpness: float
+
+    def to_list(self):
+        return [self.phash, round(self.sharpness, 2)]
+
+    @classmethod
+    def from_list(cls, value):
+        return cls(int(value[0]), float(value[1]))
+
+
+@dataclass(slots=True, frozen=True)
+class CaptureCheck:
+    """Verdict for a new shot compared with the shots already on the defect."""
+    is_duplicate: bool
+    duplicate_of: int      # index of the closest earlier shot, -1 if none
+    distance: int          # Hamming distance to that shot (64 when none)
+    is_blurry: bool
+
+    @property
+    def flagged(self):
+        return self.is_duplicate or self.is_blurry
+
+
+def load_gray(image_file, max_side=ANALYSIS_SIZE):
+    """Decodes a photo to a grayscale PIL image no larger than max_side."""
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image.draft('L', (max_side, max_side))  # JPEG: decode at 1/2..1/8 scale
+    image = image.convert('L')
+    image.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    image_file.seek(0)
+    return image
+
+
+def perceptual_hash(gray):
+    """64-bit DCT hash: low-frequency 8x8 coefficients thresholded at their median."""
+    small = np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BOX), dtype=np.float32)
+    coeffs = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = coeffs > np.median(coeffs[1:])  # skip the DC term when picking the median
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def laplacian_variance(gray):
+    """Sharpness score: variance of the 4-neighbour Laplacian (vectorized)."""
+    a = np.asarray(gray, dtype=np.float32)
+    if a.shape[0] < 3 or a.shape[1] < 3:
+        return 0.0
+    lap = (a[:-2, 1:-1] + a[2:, 1:-1] + a[1:-1, :-2] + a[1:-1, 2:]) - 4.0 * a[1:-1, 1:-1]
+    return float(lap.var())
+
+
+def analyze_photo(image_file):
+    """Returns the PhotoSignature of a photo, or None if it cannot be decoded."""
+    try:
+        gray = load_gray(image_file)
+    except Exception:
+        return None
+    return PhotoSignature(perceptual_hash(gray), laplacian_variance(gray))
+
+
+def hamming_distances(phash, hashes):
+    """Hamming distance from phash to each of hashes, in one vectorized pass."""
+    if not len(hashes):
+        return np.zeros(0, dtype=np.int64)
+    arr = np.asarray(hashes, dtype=np.uint64) ^ np.uint64(phash)
+    return np.unpackbits(arr.view(np.uint8)).reshape(len(arr), 64).sum(axis=1)
+
+
+def check_capture(signature, existing, duplicate_distance=DUPLICATE_DISTANCE, blur_threshold=BLUR_THRESHOLD):
+    """
+    Compares a new shot with the signatures already stored on the defect.
+    O(n) in the number of earlier shots of that defect.
+    """
+    is_blurry = signature.sharpness < blur_threshold
+    indexed = [(i, s.phash) for i, s in enumerate(existing) if s is not None]
+    if not indexed:
+        return CaptureCheck(False, -1, 64, is_blurry)
+    distances = hamming_distances(signature.phash, [h for _, h in indexed])
+    best = int(np.argmin(distances))
+    distance = int(distances[best])
+    return CaptureCheck(distance <= duplicate_distance, indexed[best][0], distance, is_blurry)
+
+
+# --- EXIF ---
+# Read from the file header only: Image.open parses the header and the EXIF
+# block lazily, so no pixel data is decoded.
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_DATETIME_ORIGINAL = 36867
+_DATETIME = 306
+_ORIENTATION = 274
+# Attribute of a browser-downscaled photo holding what the canvas re-encode dropped:
+# {'lat', 'lon', 'taken'} from the device at capture and/or 'exif', the original's EXIF block
+CAPTURE_ATTR = '_fieldscribe_capture'
+
+
+@dataclass(slots=True, frozen=True)
+class PhotoExif:
+    """Where and when a photo was taken (stored per photo next to its signature)."""
+    lat: float = None
+    lon: float = None
+    taken: str = ''        # ISO 'YYYY-MM-DDTHH:MM:SS' in camera local time, '' if unknown
+    width: int = 0
+    height: int = 0
+
+    @property
+    def has_location(self):
+        return self.lat is not None and self.lon is not None
+
+    def to_list(self):
+        return [self.lat, self.lon, self.taken, self.width, self.height]
+
+    @classmethod
+    def from_list(cls, value):
+        lat, lon, taken, width, height = value
+        return cls(lat, lon, taken or '', int(width), int(height))
+
+
+def _gps_degrees(dms, ref):
+    """Decimal degrees from an EXIF (degrees, minutes, seconds) triple and its N/S/E/W ref."""
+    try:
+        degrees, minutes, seconds = (float(v) for v in dms)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60.0 + seconds / 3600.0
+    return -value if str(ref).upper() in ('S', 'W') else value
+
+
+def _exif_time(value) -> str:
+    """'YYYY:MM:DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SS' ('' if malformed)."""
+    text = str(value or '').strip().rstrip('\x00')
+    if len(text) < 19 or not text[:4].isdigit():
+        return ''
+    return f"{text[:4]}-{text[5:7]}-{text[8:10]}T{text[11:19]}"
+
+
+def _valid_position(lat, lon) -> bool:
+    return (lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+            and not (lat == 0 and lon == 0))
+
+
+def _place_and_time(exif) -> tuple:
+    """(lat, lon, taken) from a PIL Exif; None/'' where missing or implausible."""
+    lat = lon = None
+    gps = exif.get_ifd(_GPS_IFD)
+    if gps.get(2) and gps.get(4):
+        lat, lon = _gps_degrees(gps[2], gps.get(1, 'N')), _gps_degrees(gps[4], gps.get(3, 'E'))
+        if not _valid_position(lat, lon):
+            lat = lon = None
+    taken = _exif_time(exif.get_ifd(_EXIF_IFD).get(_DATETIME_ORIGINAL) or exif.get(_DATETIME))
+    return lat, lon, taken
+
+
+def _captured_place_and_time(capture: dict) -> tuple:
+    """
+    (lat, lon, taken) recorded for a browser-downscaled photo: the original's
+    EXIF block first, the device position and clock at capture otherwise.
+    """
+    lat = lon = None
+    taken = ''
+    if capture.get('exif'):
+        try:
+            exif = Image.Exif()
+            exif.load(capture['exif'])
+            lat, lon, taken = _place_and_time(exif)
+        except Exception:
+            pass
+    if lat is None:
+        try:
+            lat, lon = float(capture['lat']), float(capture['lon'])
+        except (KeyError, TypeError, ValueError):
+            lat = lon = None
+        if not _valid_position(lat, lon):
+            lat = lon = None
+    if not taken:
+        try:
+            taken = datetime.fromisoformat(str(capture.get('taken') or '')[:19]).strftime("%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            taken = ''
+    return lat, lon, taken
+
+
+def read_exif(image_file):
+    """
+    Returns the PhotoExif of a photo (GPS position, capture time, size as
+    displayed), or None if it is not an image. Missing fields stay empty.
+    Photos downscaled in the browser carry their position and time in
+    CAPTURE_ATTR, since re-encoding strips the EXIF block.
+    """
+    try:
+        image_file.seek(0)
+        image = Image.open(image_file)
+        exif = image.getexif()
+        width, height = image.size
+    except Exception:
+        return None
+    finally:
+        image_file.seek(0)
+    if exif.get(_ORIENTATION) in (5, 6, 7, 8):
+        width, height = height, width
+    lat, lon, taken = _place_and_time(exif)
+    capture = getattr(image_file, CAPTURE_ATTR, None)
+    if capture and lat is None and not taken:
+        lat, lon, taken = _captured_place_and_time(capture)
+    return PhotoExif(lat, lon, taken, width, height)
+
+
+# --- RENDITION PYRAMID ---
+# Downscaled copies of each photo, built from one decode of the original.
+# Re-encoding a report at another width/quality starts from the smallest
+# rendition that is at least as wide, never from the 12MP original.
+RENDITION_DIR = os.path.join(storage.DATA_DIR, "renditions")
+RENDITION_WIDTHS = (1600, 800, 400)
+RENDITION_QUALITY = 95
+THUMB_SIZE = 240
+THUMB_CACHE_ENTRIES = 512
+
+
+def _write_file_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _flatten(image):
+    """RGB/L copy of an image (alpha and palettes dropped, as compress_image does)."""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image
+
+
+class RenditionPyramid:
+    """
+    On-disk rendition cache keyed by the photo's BlobStore digest:
+        <root>/<digest[:2]>/<digest[2:]>_<width>.jpg
+    Renditions are never wider than the original (no upscaling).
+    """
+
+    def __init__(self, root=None, blobs: storage.BlobStore = None):
+        self.root = root or RENDITION_DIR
+        self.blobs = blobs or storage.BlobStore()
+
+    def path(self, digest: str, width: int) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest[2:]}_{width}.jpg")
+
+    def _level(self, width: int):
+        """Smallest pyramid width >= width (None: only the original will do)."""
+        fitting = [w for w in RENDITION_WIDTHS if w >= width]
+        return min(fitting) if fitting else None
+
+    def build(self, digest: str) -> None:
+        """Writes every missing level from a single (draft-scaled) decode of the original."""
+        missing = [w for w in RENDITION_WIDTHS if not os.path.exists(self.path(digest, w))]
+        if not missing:
+            return
+        with self.blobs.open(digest) as f:
+            image = Image.open(f)
+            image.draft('RGB', (max(missing), max(missing)))
+            image = _flatten(image)
+            image.load()
+        for width in sorted(RENDITION_WIDTHS, reverse=True):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                     Image.Resampling.LANCZOS)
+            if width not in missing:
+                continue
+            path = self.path(digest, width)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = BytesIO()
+            image.save(out, format='JPEG', quality=RENDITION_QUALITY, subsampling=0)
+            _write_file_atomic(path, out.getvalue())
+
+    def open(self, digest: str, width: int):
+        """Decoded PIL image to downscale to width (a rendition, or the original if wider than the pyramid)."""
+        level = self._level(width)
+        if level is None:
+            with self.blobs.open(digest) as f:
+                image = _flatten(Image.open(f))
+                image.load()
+            return image
+        path = self.path(digest, level)
+        if not os.path.exists(path):
+            self.build(digest)
+        image = Image.open(path)
+        image.load()
+        return image
+
+
+    def thumbnail(self, digest: str, size: int = None) -> bytes:
+        """
+        JPEG thumbnail (at most size x size) for previews, cached next to the
+        renditions and in memory. Built from the smallest rendition when it
+        exists, otherwise from a draft-scaled decode of the original.
+        """
+        size = size or THUMB_SIZE
+        key = (digest, size)
+        cache = resources.cache('thumbnails', max_entries=THUMB_CACHE_ENTRIES)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        path = os.path.join(self.root, digest[:2], f"{digest[2:]}_t{size}.jpg")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            smallest = self.path(digest, min(RENDITION_WIDTHS))
+            with open(smallest, 'rb') if os.path.exists(smallest) else self.blobs.open(digest) as f:
+                image = Image.open(f)
+                image.draft('RGB', (size, size))
+                image = _flatten(image)
+                image.thumbnail((size, size), Image.Resampling.BILINEAR)
+            out = BytesIO()
+            image.save(out, format='JPEG', quality=80)
+            data = out.getvalue()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_file_atomic(path, data)
+
+        cache.put(key, data)
+        return data
+
+
+def photo_thumbnail(photo, size: int = None, pyramid: RenditionPyramid = None):
+    """
+    Thumbnail bytes for a photo file object (UploadedFile, BytesIO); the
+    photo is stored in the BlobStore once and looked up by digest after that.
+    Returns None if the photo cannot be decoded.
+    """
+    pyramid = pyramid or RenditionPyramid()
+    try:
+        return pyramid.thumbnail(pyramid.blobs.put_file(photo), size)
+    except Exception:
+        return None
+
+
+# --- CONTACT SHEETS ---
+# All the previews of a defect (or a list) as one JPEG, so a rerun sends the
+# browser one image instead of one per photo. Keyed by the photos' digests:
+# the sheet is only rebuilt when the photo set changes.
+SHEET_CELL = 100
+SHEET_COLUMNS = 4
+SHEET_GAP = 4
+SHEET_CACHE_ENTRIES = 128
+_SHEET_BACKGROUND = 255
+
+
+def _tile(thumb: bytes, cell: int) -> np.ndarray:
+    """A thumbnail centred on a cell x cell background (RGB array)."""
+    tile = np.full((cell, cell, 3), _SHEET_BACKGROUND, np.uint8)
+    try:
+        image = Image.open(BytesIO(thumb)).convert('RGB')
+    except Exception:
+        return tile
+    image.thumbnail((cell, cell), Image.Resampling.BILINEAR)
+    y, x = (cell - image.height) // 2, (cell - image.width) // 2
+    tile[y:y + image.height, x:x + image.width] = np.asarray(image)
+    return tile
+
+
+def _label_tiles(sheet, count: int, columns: int, pitch: int) -> None:
+    """Numbers each tile (1-based, matching 'Photo n' captions) in its top-left corner."""
+    draw = ImageDraw.Draw(sheet)
+    for i in range(count):
+        x, y = (i % columns) * pitch, (i // columns) * pitch
+        text = str(i + 1)
+        width = draw.textlength(text)
+        draw.rectangle((x, y, x + width + 5, y + 13), fill=(0, 0, 0))
+        draw.text((x + 3, y + 1), text, fill=(255, 255, 255))
+
+
+def contact_sheet(digests, cell: int = SHEET_CELL, columns: int = SHEET_COLUMNS, labels: bool = True,
+                  pyramid: RenditionPyramid = None):
+    """
+    JPEG of the photos' thumbnails tiled columns wide (cached by digests and
+    layout). Tiles are stacked into one array and laid out with a single
+    reshape, so the sheet costs one JPEG encode whatever the photo count.
+    Returns None for an empty list.
+    """
+    digests = tuple(digests)
+    if not digests:
+        return None
+    key = (digests, cell, columns, labels)
+    cache = resources.cache('contact_sheets', max_entries=SHEET_CACHE_ENTRIES)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    pyramid = pyramid or RenditionPyramid()
+    columns = min(columns, len(digests))
+    rows = -(-len(digests) // columns)
+    pitch = cell + SHEET_GAP
+    tiles = np.full((rows * columns, pitch, pitch, 3), _SHEET_BACKGROUND, np.uint8)
+    for i, digest in enumerate(digests):
+        try:
+            tiles[i, :cell, :cell] = _tile(pyramid.thumbnail(digest, cell), cell)
+        except Exception:
+            pass
+    grid = tiles.reshape(rows, columns, pitch, pitch, 3).swapaxes(1, 2).reshape(rows * pitch, columns * pitch, 3)
+    # Drop the gap after the last row and column
+    sheet = Image.fromarray(np.ascontiguousarray(grid[:-SHEET_GAP, :-SHEET_GAP]))
+    if labels and len(digests) > 1:
+        _label_tiles(sheet, len(digests), columns, pitch)
+    out = BytesIO()
+    sheet.save(out, format='JPEG', quality=80)
+    data = out.getvalue()
+    cache.put(key, data)
+    return data
+
+
+def photo_contact_sheet(photos, cell: int = SHEET_CELL, columns: int = SHEET_COLUMNS, labels: bool = True,
+                        pyramid: RenditionPyramid = None):
+    """contact_sheet for photo file objects (stored in the BlobStore once). None if there are none."""
+    pyramid = pyramid or RenditionPyramid()
+    digests = []
+    for photo in photos or []:
+        try:
+            digests.append(pyramid.blobs.put_file(photo))
+        except Exception:
+            continue
+    return contact_sheet(digests, cell, columns, labels, pyramid)
+
+
+def encode_jpeg(image, width: int, quality: int) -> bytes:
+    """Downscales image to at most width pixels wide and encodes it as JPEG."""
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))),
+                             Image.Resampling.LANCZOS)
+    out = BytesIO()
+    image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+# --- LOGO PIPELINE ---
+# A company logo is prepared once per (logo, target width): scaled to the
+# report's content width at the preset's DPI, then encoded as a palette PNG
+# (keeps transparency; flat artwork compresses far better than JPEG) unless a
+# JPEG on a white background is smaller. Results are cached on disk next to
+# the other derived images, keyed by the logo's BlobStore digest, and in memory.
+LOGO_DIR = os.path.join(storage.DATA_DIR, "logos")
+LOGO_CONTENT_INCHES = 6.27   # widest content width of the renderers (A4 PDF with 1in margins)
+LOGO_JPEG_QUALITY = 75
+LOGO_CACHE_ENTRIES = 64
+
+
+def logo_width_px(dpi: int) -> int:
+    """Pixel width of a full-content-width logo at dpi."""
+    return round(LOGO_CONTENT_INCHES * dpi)
+
+
+def _has_alpha(image) -> bool:
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def encode_logo(image, width: int, dpi: int = None) -> bytes:
+    """
+    Encodes a logo at most width pixels wide (never upscaled): a 256-colour
+    palette PNG with its transparency, or a JPEG flattened onto white when
+    that is smaller.
+    """
+    alpha = _has_alpha(image)
+    image = image.convert('RGBA' if alpha else 'RGB')
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))),
+                             Image.Resampling.LANCZOS)
+    info = {'dpi': (dpi, dpi)} if dpi else {}
+
+    # Octree is the quantizer that keeps the alpha channel in the palette
+    method = Image.Quantize.FASTOCTREE if alpha else Image.Quantize.MEDIANCUT
+    png = BytesIO()
+    image.quantize(colors=256, method=method).save(png, format='PNG', optimize=True, **info)
+
+    flat = image
+    if alpha:
+        flat = Image.new('RGB', image.size, 'white')
+        flat.paste(image, mask=image.getchannel('A'))
+    jpeg = BytesIO()
+    flat.save(jpeg, format='JPEG', quality=LOGO_JPEG_QUALITY, optimize=True, **info)
+
+    return min(png.getvalue(), jpeg.getvalue(), key=len)
+
+
+def prepare_logo(digest: str, dpi: int, blobs: storage.BlobStore = None):
+    """
+    Ready-to-embed logo bytes (PNG or JPEG) at dpi for the logo stored under
+    digest, built on first use and cached: <LOGO_DIR>/<digest[:2]>/<digest[2:]>_<dpi>dpi.logo
+    Returns None if the logo cannot be decoded.
+    """
+    key = (digest, dpi)
+    cache = resources.cache('logos', max_entries=LOGO_CACHE_ENTRIES)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    path = os.path.join(LOGO_DIR, digest[:2], f"{digest[2:]}_{dpi}dpi.logo")
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+    else:
+        width = logo_width_px(dpi)
+        blobs = blobs or storage.BlobStore()
+        try:
+            with blobs.open(digest) as f:
+                image = Image.open(f)
+                image.draft('RGB', (width, width))  # JPEG logos: decode near the target size
+                image.load()
+            data = encode_logo(image, width, dpi)
+        except Exception:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_file_atomic(path, data)
+
+    cache.put(key, data)
+    return data
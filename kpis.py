@@ -0,0 +1,257 @@
+"""
+Dashboard KPIs for FieldScribe
+Handles the materialized counters behind the CRM dashboard cards: each
+generated report, calendar event and new user adjusts them as it happens,
+so the dashboard reads a handful of rows instead of scanning the history
+"""
+
+import logging
+import os
+import threading
+from datetime import date
+
+import resources
+import storage
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Pending deltas are folded into the counters once there are this many
+COMPACT_DELTAS = int(os.environ.get("FIELDSCRIBE_KPI_COMPACT_DELTAS", "256"))
+
+# Period of the all-time counters; monthly counters use 'YYYY-MM'
+ALL_TIME = ''
+
+
+def _month(day) -> str:
+    """'YYYY-MM' of a date or a 'YYYY-MM-DD...' string (today's month if unparsable)."""
+    text = day.isoformat() if isinstance(day, date) else str(day or '')
+    try:
+        return date.fromisoformat(text[:10]).isoformat()[:7]
+    except ValueError:
+        return date.today().isoformat()[:7]
+
+
+class KpiCounters:
+    """
+    Counters per (period, metric), kept in SQLite next to the user registry.
+
+    Writers never update a counter in place: they append to kpi_deltas, and
+    compact folds the deltas into kpi_counters every COMPACT_DELTAS writes,
+    so a read is the counter row plus at most that many deltas whatever the
+    history size. Report versions remember what they contributed
+    (kpi_sources), so a regenerated report retracts its previous version
+    exactly; customers are reference counted (kpi_members) so a client only
+    counts while one of its reports does. New users are counted by a
+    trigger on the users table, whatever code path inserts them.
+
+    Metrics: 'reports', 'defects' and 'customers' (latest version of each
+    inspection, by report date), 'events' (calendar events, by event date)
+    and 'users'.
+    """
+
+    def __init__(self, db_path=None):
+        self._conn = storage.connect(db_path)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kpi_counters'"
+            ).fetchone()
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS kpi_counters (
+                    period TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    value  INTEGER NOT NULL,
+                    PRIMARY KEY (period, metric)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS kpi_deltas (
+                    id     INTEGER PRIMARY KEY AUTOINCREMENT,
+                    period TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    delta  INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_kpi_deltas_period ON kpi_deltas(period);
+
+                CREATE TABLE IF NOT EXISTS kpi_sources (
+                    source TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    member TEXT NOT NULL DEFAULT '',
+                    value  INTEGER NOT NULL,
+                    PRIMARY KEY (source, period, metric, member)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS kpi_members (
+                    period TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    member TEXT NOT NULL,
+                    refs   INTEGER NOT NULL,
+                    PRIMARY KEY (period, metric, member)
+                ) WITHOUT ROWID;
+            """)
+            self._count_users(seed=not exists)
+            self._pending = self._conn.execute("SELECT COUNT(*) FROM kpi_deltas").fetchone()[0]
+        self.is_new = not exists
+
+    def _count_users(self, seed: bool) -> None:
+        """Counts new and removed users with triggers (seeded from the users already there)."""
+        has_users = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+        ).fetchone()
+        if not has_users:
+            return
+        self._conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS kpi_user_created AFTER INSERT ON users BEGIN
+                INSERT INTO kpi_deltas (period, metric, delta) VALUES ('', 'users', 1);
+            END;
+            CREATE TRIGGER IF NOT EXISTS kpi_user_deleted AFTER DELETE ON users BEGIN
+                INSERT INTO kpi_deltas (period, metric, delta) VALUES ('', 'users', -1);
+            END;
+        """)
+        if seed:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kpi_counters (period, metric, value) SELECT '', 'users', COUNT(*) FROM users"
+            )
+
+    # --- WRITES ---
+    def _add(self, period: str, metric: str, delta: int) -> None:
+        if delta:
+            self._conn.execute("INSERT INTO kpi_deltas (period, metric, delta) VALUES (?, ?, ?)",
+                               (period, metric, delta))
+            self._pending += 1
+
+    def _add_member(self, period: str, metric: str, member: str, delta: int) -> None:
+        """Adjusts a member's reference count; the metric changes when it starts or stops counting."""
+        row = self._conn.execute("SELECT refs FROM kpi_members WHERE period = ? AND metric = ? AND member = ?",
+                                 (period, metric, member)).fetchone()
+        refs = (row[0] if row else 0) + delta
+        if refs > 0:
+            self._conn.execute("INSERT OR REPLACE INTO kpi_members (period, metric, member, refs) VALUES (?, ?, ?, ?)",
+                               (period, metric, member, refs))
+        elif row:
+            self._conn.execute("DELETE FROM kpi_members WHERE period = ? AND metric = ? AND member = ?",
+                               (period, metric, member))
+        if (refs > 0) != bool(row and row[0] > 0):
+            self._add(period, metric, 1 if refs > 0 else -1)
+
+    def _retract(self, source: str) -> None:
+        rows = self._conn.execute("SELECT period, metric, member, value FROM kpi_sources WHERE source = ?",
+                                  (source,)).fetchall()
+        for period, metric, member, value in rows:
+            if member:
+                self._add_member(period, metric, member, -value)
+            else:
+                self._add(period, metric, -value)
+        self._conn.execute("DELETE FROM kpi_sources WHERE source = ?", (source,))
+
+    def _write(self, fn, *args):
+        with self._lock, self._conn:
+            result = fn(*args)
+            needs_compaction = self._pending >= COMPACT_DELTAS
+        if needs_compaction:
+            self.compact()
+        return result
+
+    def record_report(self, version_id: int, report, supersedes=()) -> bool:
+        """
+        Counts a generated report version (see versions.py) and retracts the
+        versions it supersedes. A version already counted is skipped; returns
+        whether this one was new.
+        """
+        def apply():
+            source = f"version:{version_id}"
+            if self._conn.execute("SELECT 1 FROM kpi_sources WHERE source = ? LIMIT 1", (source,)).fetchone():
+                return False
+            for old in supersedes:
+                if old is not None:
+                    self._retract(f"version:{old}")
+            month = _month(report.date)
+            rows = [(period, metric, '', value)
+                    for period in (ALL_TIME, month)
+                    for metric, value in (('reports', 1), ('defects', len(report.defects)))]
+            if report.client_name:
+                rows.append((ALL_TIME, 'customers', report.client_name, 1))
+            # Always at least the 'reports' rows, which mark the version as counted
+            self._conn.executemany(
+                "INSERT INTO kpi_sources (source, period, metric, member, value) VALUES (?, ?, ?, ?, ?)",
+                [(source, *row) for row in rows]
+            )
+            for period, metric, member, value in rows:
+                if member:
+                    self._add_member(period, metric, member, value)
+                else:
+                    self._add(period, metric, value)
+            return True
+        return self._write(apply)
+
+    def record_event(self, day, delta: int = 1) -> None:
+        """Counts a calendar event added (delta 1) or deleted (delta -1) on day."""
+        self._write(self._add, _month(day), 'events', delta)
+
+    def compact(self) -> int:
+        """Folds the pending deltas into the counters; returns how many were folded."""
+        with self._lock, self._conn:
+            last = self._conn.execute("SELECT MAX(id) FROM kpi_deltas").fetchone()[0]
+            if last is None:
+                self._pending = 0
+                return 0
+            self._conn.execute("""
+                INSERT INTO kpi_counters (period, metric, value)
+                SELECT period, metric, SUM(delta) FROM kpi_deltas WHERE id <= ? GROUP BY period, metric
+                ON CONFLICT (period, metric) DO UPDATE SET value = value + excluded.value
+            """, (last,))
+            folded = self._conn.execute("DELETE FROM kpi_deltas WHERE id <= ?", (last,)).rowcount
+            self._conn.execute("DELETE FROM kpi_counters WHERE value = 0")
+            self._pending = 0
+        logger.info("Compacted %d KPI deltas", folded)
+        return folded
+
+    # --- READS ---
+    def snapshot(self, today: date = None) -> dict:
+        """All-time and this month's counters, keyed 'reports', 'reports_this_month', ..."""
+        month = _month(today or date.today())
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT period, metric, value FROM kpi_counters WHERE period IN ('', ?1)
+                UNION ALL
+                SELECT period, metric, delta FROM kpi_deltas WHERE period IN ('', ?1)
+            """, (month,)).fetchall()
+        values = dict.fromkeys(('reports', 'defects', 'customers', 'events', 'users',
+                                'reports_this_month', 'defects_this_month', 'events_this_month'), 0)
+        for period, metric, value in rows:
+            key = metric if period == ALL_TIME else f"{metric}_this_month"
+            values[key] = values.get(key, 0) + value
+        return values
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = self._conn.execute("SELECT COUNT(*) FROM kpi_counters").fetchone()[0]
+            sources = self._conn.execute("SELECT COUNT(DISTINCT source) FROM kpi_sources").fetchone()[0]
+        return {'counters': counters, 'pending_deltas': self._pending, 'versions': sources}
+
+
+def backfill(counters: KpiCounters, report_versions: versions.ReportVersions = None) -> int:
+    """Counts the latest version of every inspection not counted yet; returns how many were added."""
+    report_versions = report_versions or versions.get_report_versions()
+    added = 0
+    for info in report_versions.latest_versions():
+        chain = [v.id for v in report_versions.list_versions(info.series) if v.id != info.id]
+        added += counters.record_report(info.id, report_versions.load(info.id), supersedes=chain)
+    return added
+
+
+def _open_counters() -> KpiCounters:
+    # The users table must exist first so the user triggers can be attached
+    storage.get_user_registry()
+    counters = KpiCounters()
+    if counters.is_new:
+        added = backfill(counters)
+        if added:
+            logger.info("Backfilled the KPI counters from %d report versions", added)
+    return counters
+
+
+def get_kpi_counters() -> KpiCounters:
+    """Returns the process-wide KPI counters, backfilled from the report versions when first created."""
+    return resources.shared('kpi_counters', _open_counters)
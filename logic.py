@@ -1,8 +1,10 @@
 """
 Backend Logic for FieldScribe
-Handles translation, image compression, and Word document generation
+Handles translation, image compression, the report pipeline
+(build model -> transform -> render) and Word document generation
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from docx import Document
 from docx.shared import Pt, Inches
@@ -10,10 +12,19 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.section import WD_SECTION
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
-from deep_translator import GoogleTranslator
 from datetime import datetime, date
 from calendar import monthrange
 from PIL import Image
+import glossary
+import imaging
+import logging
+import pdf_render
+import resources
+import report_model
+import storage
+from report_model import RenderModel, RenderedDefect
+
+logger = logging.getLogger(__name__)
 
 
 def compress_image(image_file, max_width=800):
@@ -59,35 +70,304 @@ def set_paragraph_rtl_bidi(paragraph):
     pPr.append(bidi)
 
 
-def process_report(client_name, general_notes, defect_list, should_translate, report_mode='standard', logo_file=None):
+ENGINEER_NAME = "איסמאיל ראבי"
+
+
+# --- COMPRESSION CACHE ---
+# Compressed JPEGs keyed by (photo digest, width[, quality]), shared by every
+# session; a regenerated report (or a second format) reuses them instead of
+# decoding the originals again.
+COMPRESSION_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def compression_cache() -> resources.LRUCache:
+    return resources.cache('compression', max_bytes=COMPRESSION_CACHE_BYTES)
+
+
+def compress_photo(handle, max_width=800, blobs=None, use_cache=True):
     """
-    Generates the Word Doc with professional card-based layout.
+    Compresses the photo behind a PhotoHandle, memoized by content digest
+    (use_cache=False always compresses, e.g. to profile it).
+    Returns JPEG bytes, or None if the image could not be decoded.
+    """
+    cache = compression_cache()
+    key = (handle.digest, max_width)
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    with handle.open(blobs or storage.BlobStore()) as f:
+        compressed = compress_image(f, max_width=max_width)
+    if compressed is None:
+        return None
+    data = compressed.getvalue()
+    cache.put(key, data)
+    return data
+
+
+# --- OUTPUT PRESETS ---
+# 'standard' keeps the fixed 800px / q70 photos. Budgeted presets pick width
+# and quality per photo from QUALITY_LADDER so the whole report stays under
+# budget_bytes; they encode from the rendition pyramid. The logo is prepared
+# once per preset DPI by imaging.prepare_logo.
+OUTPUT_PRESETS = {
+    'standard': {'label': "Standard", 'budget_bytes': None, 'max_width': 800, 'logo_dpi': 96},
+    'email': {'label': "Email (under 10 MB)", 'budget_bytes': 10 * 1024 * 1024, 'max_width': 1024,
+              'logo_dpi': 96},
+    'print': {'label': "Print (high quality)", 'budget_bytes': 60 * 1024 * 1024, 'max_width': 1600,
+              'logo_dpi': 200},
+}
+DEFAULT_PRESET = 'standard'
+
+# (width, JPEG quality), best first
+QUALITY_LADDER = [(1600, 85), (1280, 82), (1024, 78), (800, 72), (640, 65), (512, 58), (400, 50), (320, 40)]
+
+# Document XML, styles and zip overhead not taken by images
+REPORT_OVERHEAD_BYTES = 64 * 1024
+
+
+def encode_photo(handle, width, quality, pyramid=None, use_cache=True):
+    """
+    JPEG bytes of a photo at (width, quality), encoded from its rendition
+    pyramid and memoized in the compression cache. None if undecodable.
+    """
+    cache = compression_cache()
+    key = (handle.digest, width, quality)
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    pyramid = pyramid or imaging.RenditionPyramid()
+    try:
+        data = imaging.encode_jpeg(pyramid.open(handle.digest, width), width, quality)
+    except Exception as e:
+        logger.warning("Image compression error (%s): %s", handle.digest[:12], e)
+        return None
+    cache.put(key, data)
+    return data
+
+
+def fit_photo_budget(handles, budget_bytes, ladder, encode, pool):
+    """
+    Chooses a ladder level per photo so the encoded photos total at most
+    budget_bytes. Finds the best uniform level that fits (binary search; each
+    probe encodes every photo in parallel), then upgrades individual photos
+    one level, cheapest first, while the leftover allows.
+    Returns {handle: (width, quality)}.
+    """
+    if not handles:
+        return {}
+    sizes = {}
+
+    def measure(level):
+        todo = [h for h in handles if (h, level) not in sizes]
+        for h, data in zip(todo, pool.map(lambda h: encode(h, *ladder[level]), todo)):
+            sizes[(h, level)] = len(data) if data else 0
+        return sum(sizes[(h, level)] for h in handles)
+
+    lo, hi = 0, len(ladder) - 1
+    if measure(hi) > budget_bytes:
+        logger.warning("Photos exceed the %d byte budget even at %s", budget_bytes, ladder[hi])
+        return {h: ladder[hi] for h in handles}
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if measure(mid) <= budget_bytes:
+            hi = mid
+        else:
+            lo = mid + 1
+    level = {h: lo for h in handles}
+
+    if lo > 0:
+        measure(lo - 1)
+        leftover = budget_bytes - sum(sizes[(h, lo)] for h in handles)
+        for h in sorted(handles, key=lambda h: sizes[(h, lo - 1)] - sizes[(h, lo)]):
+            extra = sizes[(h, lo - 1)] - sizes[(h, lo)]
+            if extra > leftover:
+                break
+            level[h] = lo - 1
+            leftover -= extra
+    return {h: ladder[i] for h, i in level.items()}
+
+
+# Name prefix of the threads of a private transform pool (the profiler samples them)
+REPORT_THREAD_PREFIX = 'report'
+
+
+def _default_workers():
+    return resources.CPU_WORKERS
+
+
+# Report languages; anything but ORIGINAL_LANGUAGE is a translation target
+# passed to the translator
+ORIGINAL_LANGUAGE = 'he'
+REPORT_LANGUAGES = {ORIGINAL_LANGUAGE: "Hebrew (original)", 'ar': "Arabic", 'en': "English"}
+
+
+def transform_report_languages(report, languages, translator=None, blobs=None, max_workers=None,
+                               preset=DEFAULT_PRESET, observer=None):
+    """
+    Stage 2 of the report pipeline for several languages at once.
+
+    Photos are compressed once and the same JPEG bytes are shared by every
+    language's model; every distinct string is translated once per target
+    language, with all targets in flight together (Pillow releases the GIL
+    while resizing and encoding, so compression overlaps the translation
+    requests). By default the process-wide pools are used: image work on the
+    'cpu' executor, translation requests on the 'io' executor; an explicit
+    max_workers runs both on a private pool of that size. preset is a key of
+    OUTPUT_PRESETS; budgeted presets size the photos to fit the report's byte
+    target. observer (see profiling.GenerationProfile) times each photo step
+    and translation and gets a private pool, so a profile only shows this
+    report.
+    Returns {language: RenderModel} holding only text and JPEG bytes.
+    """
+    blobs = blobs or storage.BlobStore()
+    use_cache = observer is None or not observer.cold
+    compress, encode_one = compress_photo, encode_photo
+    if observer is not None:
+        compress, encode_one = observer.wrap('compress', compress_photo), observer.wrap('encode', encode_photo)
+        max_workers = max_workers or resources.CPU_WORKERS
+    options = OUTPUT_PRESETS[preset]
+    languages = list(dict.fromkeys(languages))
+
+    # --- HELPER: Translator ---
+    def google(fragment, target):
+        with resources.translators('auto', target).lease() as client:
+            return client.translate(fragment)
+
+    def translate_one(text, target):
+        if translator is not None:
+            return translator(text, target)
+        # Glossary terms locally, only the leftover free text goes to Google
+        try:
+            return glossary.get_glossary().translate(text, target, remote=google)
+        except Exception as e:
+            logger.warning("Translation to %s failed, keeping source text: %s", target, e)
+            return text
+
+    if observer is not None:
+        translate_one = observer.wrap('translate', translate_one)
+
+    title_text = (f"DEFENSIVE OPINION: {report.client_name.upper()}" if report.report_mode == 'defensive'
+                  else f" : להלן חוות דעתי")
+    labels = {
+        'client': "שם הלקוח: ",
+        'title': title_text,
+        'findings': " ממצאים מפורטים",
+        'no_items': '' if report.defects else "No items recorded.",
+        'notes': " הערות : ",
+        'signoff': "המהנדס העורך והחותם: ",
+        'signature': "חתימה: ___________________________",
+    }
+    notes = report.general_notes or "No specific general notes provided."
+
+    texts = list(labels.values()) + [notes]
+    for defect in report.defects:
+        texts.extend((defect.title, defect.desc, defect.code))
+    unique_texts = list(dict.fromkeys(t for t in texts if t))
+
+    unique_photos = list(dict.fromkeys(h for d in report.defects for h in d.photos))
+
+    private = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=REPORT_THREAD_PREFIX) if max_workers else None
+    cpu = private or resources.executor('cpu')
+    io = private or resources.executor('io')
+    try:
+        translate_futures = {
+            (target, text): io.submit(translate_one, text, target)
+            for target in languages if target != ORIGINAL_LANGUAGE
+            for text in unique_texts
+        }
+        # Prepared once per company logo and DPI, then served from the cache
+        logo = None
+        if report.logo is not None:
+            logo = imaging.prepare_logo(report.logo.digest, options['logo_dpi'], blobs) or b''
+        if options['budget_bytes'] is None:
+            photo_futures = {h: cpu.submit(compress, h, options['max_width'], blobs, use_cache) for h in unique_photos}
+        else:
+            pyramid = imaging.RenditionPyramid(blobs=blobs)
+            encode = lambda h, width, quality: encode_one(h, width, quality, pyramid, use_cache)
+            build = lambda h: pyramid.build(h.digest)
+            if observer is not None:
+                build = observer.wrap('build', build)
+            list(cpu.map(build, unique_photos))  # one decode per original
+            budget = options['budget_bytes'] - REPORT_OVERHEAD_BYTES - len(logo or b'')
+            ladder = [step for step in QUALITY_LADDER if step[0] <= options['max_width']]
+            chosen = fit_photo_budget(unique_photos, budget, ladder, encode, cpu)
+            photo_futures = {h: cpu.submit(encode, h, *chosen[h]) for h in unique_photos}
+        compressed = {h: future.result() for h, future in photo_futures.items()}
+        translated = {key: future.result() for key, future in translate_futures.items()}
+    finally:
+        if private is not None:
+            private.shutdown()
+
+    photo_lists = [[b for b in (compressed[h] for h in d.photos) if b] for d in report.defects]
+    models = {}
+    for target in languages:
+        def t(text):
+            return translated.get((target, text), text) if text else text
+
+        defects = [
+            RenderedDefect(title=t(d.title), desc=t(d.desc), code=t(d.code), photos=photos)
+            for d, photos in zip(report.defects, photo_lists)
+        ]
+        models[target] = RenderModel(
+            client_name=report.client_name,
+            report_mode=report.report_mode,
+            date=report.date,
+            engineer=report.engineer,
+            logo=logo,
+            labels={**{k: t(v) for k, v in labels.items()}, 'photo_placeholder': 'הדבק תמונה כאן'},
+            defects=defects,
+            notes=t(notes),
+        )
+    return models
+
+
+def transform_report(report, should_translate, translator=None, blobs=None, max_workers=None,
+                     preset=DEFAULT_PRESET):
+    """
+    Stage 2 of the report pipeline: translate (to Arabic when should_translate)
+    and compress a typed Report. Returns a RenderModel ready for render_docx /
+    pdf_render.render_pdf. See transform_report_languages.
+    """
+    target = 'ar' if should_translate else ORIGINAL_LANGUAGE
+    return transform_report_languages(report, [target], translator, blobs, max_workers, preset)[target]
+
+
+def build_report_model(client_name, general_notes, defect_list, should_translate, report_mode='standard',
+                       logo_file=None, translator=None, preset=DEFAULT_PRESET):
+    """
+    Builds the RenderModel shared by every output format: the UI input is
+    converted to a typed Report (stage 1) and then translated and compressed
+    (stage 2). The renderers only lay out the result.
+    """
+    report = report_model.build_report(client_name, general_notes, defect_list, report_mode, logo_file,
+                                       engineer=ENGINEER_NAME)
+    return transform_report(report, should_translate, translator, preset=preset)
+
+
+def render_docx(model):
+    """
+    Stage 3 of the report pipeline: renders a RenderModel to a Word document
+    with the card-based layout.
+    Returns a BytesIO positioned at the start.
     """
     doc = Document()
+    labels = model.labels
 
     # Get page dimensions for full-width logo
     section = doc.sections[0]
     content_width = section.page_width - section.left_margin - section.right_margin
 
     # Add logo at the top of the document if provided
-    if logo_file:
+    if model.logo is not None:
         logo_paragraph = doc.add_paragraph()
         set_paragraph_rtl_bidi(logo_paragraph)
-        compressed_logo = compress_image(logo_file, max_width=600)  # Higher quality for full width
-        if compressed_logo:
+        if model.logo:
             run = logo_paragraph.add_run()
-            run.add_picture(compressed_logo, width=content_width)  # Full content width
+            run.add_picture(BytesIO(model.logo), width=content_width)  # Full content width
         doc.add_paragraph()  # Add space after logo
 
-    # --- HELPER: Translator ---
-    def t(text):
-        if should_translate and text:
-            try:
-                return GoogleTranslator(source='auto', target='ar').translate(text)
-            except:
-                return text
-        return text
-
     # --- STYLE SETUP ---
     try:
         style = doc.styles['Normal']
@@ -103,8 +383,8 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
     htable.autofit = False
     htable.columns[0].width = Inches(4)
     htable.columns[1].width = Inches(2)
-    htable.cell(0, 0).text = f"Project ID: {client_name} | Engineer: איסמאיל ראבי"
-    htable.cell(0, 1).text = datetime.now().strftime("%Y-%m-%d")
+    htable.cell(0, 0).text = f"Project ID: {model.client_name} | Engineer: {model.engineer}"
+    htable.cell(0, 1).text = model.date
 
     footer = section.footer
     ftable = footer.add_table(1, 1, width=Inches(6))
@@ -150,16 +430,15 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
     meta_table = doc.add_table(rows=1, cols=2)
     meta_cell = meta_table.rows[0].cells[0]
     # Special design for client name
-    run1 = meta_cell.paragraphs[0].add_run(t("שם הלקוח: "))
+    run1 = meta_cell.paragraphs[0].add_run(labels['client'])
     run1.bold = True
     run1.font.size = Pt(12)
-    run2 = meta_cell.paragraphs[0].add_run(client_name)
+    run2 = meta_cell.paragraphs[0].add_run(model.client_name)
     run2.font.size = Pt(12)
     set_paragraph_rtl_bidi(meta_cell.paragraphs[0])
     doc.add_paragraph()
-    title_text = f"DEFENSIVE OPINION: {client_name.upper()}" if report_mode == 'defensive' else f" : להלן חוות דעתי"
     title_paragraph = doc.add_paragraph()
-    title_run = title_paragraph.add_run(t(title_text))
+    title_run = title_paragraph.add_run(labels['title'])
     title_run.bold = True
     title_run.underline = True
     title_run.font.size = Pt(16)  # Larger size for title appearance
@@ -172,19 +451,19 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
   
 
     # --- 2. DETAILED FINDINGS ---
-    heading2 = doc.add_heading(t(" ממצאים מפורטים"), level=1)
+    heading2 = doc.add_heading(labels['findings'], level=1)
     set_paragraph_rtl_bidi(heading2)
 
     image_counter = 1
 
-    if defect_list:
-        for defect in defect_list:
+    if model.defects:
+        for defect in model.defects:
             # 1. Yellow Highlight Box
             yellow_table = doc.add_table(rows=1, cols=1)
             yellow_table.autofit = False
             yellow_table.columns[0].width = Inches(6)
             cell = yellow_table.cell(0, 0)
-            cell.text = t(defect.get('title', 'Defect'))
+            cell.text = defect.title
             # Yellow background
             shading = OxmlElement('w:shd')
             shading.set(qn('w:fill'), 'FFFF00')
@@ -196,9 +475,9 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
             set_paragraph_rtl_bidi(cell.paragraphs[0])
 
             # 2. Problem Definition
-            desc = defect.get('desc', '')
+            desc = defect.desc
             if desc:
-                p = doc.add_paragraph(t(desc))
+                p = doc.add_paragraph(desc)
                 set_paragraph_rtl_bidi(p)
             else:
                 for _ in range(3):
@@ -206,30 +485,26 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
                     set_paragraph_rtl_bidi(p)
 
             # 3. Evidence Grid
-            photos = defect.get('photos', [])
-            if not photos and 'photo' in defect:
-                photos = [defect['photo']]
+            photos = defect.photos
             if photos:
                 # Create table with 2 columns
                 num_rows = (len(photos) + 1) // 2
                 evidence_table = doc.add_table(rows=num_rows, cols=2)
                 evidence_table.style = 'Table Grid'  # Invisible borders? Actually, set to none
                 # To make invisible, perhaps no style or custom
-                for i, photo_file in enumerate(photos):
+                for i, photo_bytes in enumerate(photos):
                     row = i // 2
                     col = 1 - (i % 2)  # RTL: Photo 1 right, Photo 2 left
                     cell = evidence_table.cell(row, col)
-                    compressed = compress_image(photo_file)
-                    if compressed:
-                        run = cell.paragraphs[0].add_run()
-                        run.add_picture(compressed, width=Inches(3))  # Half page width approx
+                    run = cell.paragraphs[0].add_run()
+                    run.add_picture(BytesIO(photo_bytes), width=Inches(3))  # Half page width approx
             else:
                 # Fallback: gray dashed box
                 fallback_table = doc.add_table(rows=1, cols=1)
                 fallback_table.autofit = False
                 fallback_table.columns[0].width = Inches(6)
                 cell = fallback_table.cell(0, 0)
-                cell.text = 'הדבק תמונה כאן'
+                cell.text = labels['photo_placeholder']
                 set_paragraph_rtl_bidi(cell.paragraphs[0])
                 # Gray background, dashed border
                 shading = OxmlElement('w:shd')
@@ -249,9 +524,9 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
 
             # 4. Standard Field
             p = doc.add_paragraph()
-            standard = defect.get('code', '')
+            standard = defect.code
             if standard:
-                p.add_run(t(standard))
+                p.add_run(standard)
             else:
                 p.add_run('____________________')
             set_paragraph_rtl_bidi(p)
@@ -260,23 +535,19 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
             doc.add_page_break()
 
     else:
-        p = doc.add_paragraph(t("No items recorded."))
+        p = doc.add_paragraph(labels['no_items'])
         set_paragraph_rtl_bidi(p)
 
     
    # --- 1. EXECUTIVE SUMMARY ---
-    heading1 = doc.add_heading(t(" הערות : "), level=3)
+    heading1 = doc.add_heading(labels['notes'], level=3)
     set_paragraph_rtl_bidi(heading1)
-    if general_notes:
-        p = doc.add_paragraph(t(general_notes))
-        set_paragraph_rtl_bidi(p)
-    else:
-        p = doc.add_paragraph(t("No specific general notes provided."))
-        set_paragraph_rtl_bidi(p)
+    p = doc.add_paragraph(model.notes)
+    set_paragraph_rtl_bidi(p)
     # --- ENGINEER’S SIGN-OFF ---
-    heading3 = doc.add_heading(t("המהנדס העורך והחותם: "), level=2)
+    heading3 = doc.add_heading(labels['signoff'], level=2)
     set_paragraph_rtl_bidi(heading3)
-    p = doc.add_paragraph(t("חתימה: ___________________________"))
+    p = doc.add_paragraph(labels['signature'])
     set_paragraph_rtl_bidi(p)
     
 
@@ -286,6 +557,76 @@ def process_report(client_name, general_notes, defect_list, should_translate, re
     return buffer
 
 
+def process_report(client_name, general_notes, defect_list, should_translate, report_mode='standard', logo_file=None,
+                   translator=None):
+    """
+    Generates the Word Doc with professional card-based layout.
+    translator is an optional translate(text, target) callable (e.g. a cached,
+    offline-aware one); by default Google Translate is called directly.
+    """
+    model = build_report_model(client_name, general_notes, defect_list, should_translate, report_mode,
+                               logo_file, translator)
+    return render_docx(model)
+
+
+def render_formats(model, formats=('docx',)):
+    """Renders one RenderModel to each requested format; returns {format: BytesIO}."""
+    outputs = {}
+    for fmt in formats:
+        if fmt == 'docx':
+            outputs['docx'] = render_docx(model)
+        elif fmt == 'pdf':
+            outputs['pdf'] = pdf_render.render_pdf(model)
+        else:
+            raise ValueError(f"Unsupported report format: {fmt}")
+    return outputs
+
+
+def generate_report(client_name, general_notes, defect_list, should_translate, report_mode='standard',
+                    logo_file=None, translator=None, formats=('docx',), preset=DEFAULT_PRESET):
+    """
+    Generates several output formats in one pass: the model (translation and
+    image compression) is built once and handed to each renderer.
+    preset selects the image sizing (see OUTPUT_PRESETS).
+    Returns a dict mapping format ('docx', 'pdf') to a BytesIO.
+    """
+    model = build_report_model(client_name, general_notes, defect_list, should_translate, report_mode,
+                               logo_file, translator, preset)
+    return render_formats(model, formats)
+
+
+def generate_reports(client_name, general_notes, defect_list, languages, report_mode='standard',
+                     logo_file=None, translator=None, formats=('docx',), preset=DEFAULT_PRESET):
+    """
+    Generates the report in several languages (keys of REPORT_LANGUAGES) in
+    one pass: media is stored, compressed and budgeted once, and the
+    translations for every target run concurrently.
+    Returns {language: {format: BytesIO}}.
+    """
+    report = report_model.build_report(client_name, general_notes, defect_list, report_mode, logo_file,
+                                       engineer=ENGINEER_NAME)
+    return render_reports(report, languages, translator, formats, preset)
+
+
+def render_reports(report, languages, translator=None, formats=('docx',), preset=DEFAULT_PRESET, observer=None):
+    """
+    Stages 2 and 3 for an already built Report; returns {language: {format: BytesIO}}.
+    observer (see profiling.py) also times each stage and rendered format.
+    """
+    if observer is None:
+        models = transform_report_languages(report, languages, translator, preset=preset)
+        return {language: render_formats(model, formats) for language, model in models.items()}
+    with observer.stage('transform'):
+        models = transform_report_languages(report, languages, translator, preset=preset, observer=observer)
+    outputs = {}
+    for language, model in models.items():
+        outputs[language] = {}
+        for fmt in formats:
+            with observer.stage(f'render_{fmt}_{language}'):
+                outputs[language].update(render_formats(model, (fmt,)))
+    return outputs
+
+
 def get_calendar_month_data(year=None, month=None):
     """Returns calendar data for the CRM."""
     today = date.today()
@@ -333,4 +674,15 @@ def format_event_time(time_str):
             return f"{hour - 12}:{minute:02d} PM"
     except Exception:
         # Return original string if parsing fails
-        return time_str
\ No newline at end of file
+        return time_str
+
+def format_file_size(num_bytes):
+    """Formats a byte count as a human readable size (e.g. 2.3 MB)."""
+    try:
+        size = float(num_bytes)
+    except (TypeError, ValueError):
+        return str(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{int(size)} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,405 @@
+"""
+Session Memory Accounting for FieldScribe
+Measures how much memory each browser session's state holds (per key),
+keeps the process-wide picture for the admin panel and enforces soft limits
+by spilling the largest photos to the BlobStore and evicting rebuildable keys
+"""
+
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from dataclasses import dataclass, field
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+from PIL import Image
+
+try:
+    import resource  # POSIX only
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+import checkpoint
+import resources
+import storage
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Soft limits: a session above SESSION_SOFT_LIMIT (or above its fair share when
+# the tracked total passes PROCESS_SOFT_LIMIT) is trimmed down to LOW_WATER of it
+SESSION_SOFT_LIMIT = int(float(os.environ.get("FIELDSCRIBE_SESSION_SOFT_LIMIT_MB", "256")) * MB)
+PROCESS_SOFT_LIMIT = int(float(os.environ.get("FIELDSCRIBE_PROCESS_SOFT_LIMIT_MB", "0")) * MB)  # 0 = off
+LOW_WATER = 0.75
+# A session is re-measured at most this often (seconds); the admin panel can force it
+MEASURE_INTERVAL = float(os.environ.get("FIELDSCRIBE_MEMORY_INTERVAL", "5"))
+# Sessions not seen for this long are dropped from the tracker (browser closed)
+SESSION_TTL = 30 * 60
+
+# Keys that are cheap to rebuild and may simply be reset under memory pressure
+EVICTABLE_KEYS = {'tool_results': list}
+
+_MEASURED_AT_KEY = '_memory_measured_at'
+_SKIP_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+# --- DEEP SIZE ---
+def deep_size(obj, seen: set = None) -> int:
+    """
+    Bytes held by obj and everything it references (containers, instance
+    attributes, BytesIO buffers, PIL pixel data). Objects already in seen are
+    not counted again, so sizes of several keys can share one seen set.
+    """
+    seen = set() if seen is None else seen
+    total, stack = 0, [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIP_TYPES):
+            continue
+        seen.add(id(o))
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        if isinstance(o, SpilledPhoto):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, Image.Image):
+            total += o.width * o.height * len(o.getbands())
+        if hasattr(o, '__dict__'):
+            stack.append(vars(o))
+        for slot in getattr(type(o), '__slots__', ()):
+            if hasattr(o, slot):
+                stack.append(getattr(o, slot))
+    return total
+
+
+def process_rss() -> int:
+    """
+    Resident set size of this process in bytes (peak RSS where /proc is
+    unavailable, 0 where neither is, e.g. on Windows).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if not RESOURCE_AVAILABLE:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports ru_maxrss in bytes, Linux and the BSDs in kilobytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# --- SPILLING ---
+class SpilledPhoto(io.BytesIO):
+    """
+    A photo whose bytes were moved to the BlobStore. It is a BytesIO (so
+    st.image, PIL and the report pipeline accept it unchanged) with an empty
+    in-memory buffer; every read goes to the blob file on disk.
+    """
+
+    def __init__(self, digest: str, name=None, blobs: storage.BlobStore = None):
+        super().__init__()
+        self.digest = digest
+        self.name = name
+        self._blobs = blobs or storage.BlobStore()
+        self._pos = 0
+        setattr(self, storage.BLOB_ATTR, digest)
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self._blobs.path(self.digest))
+
+    def getvalue(self) -> bytes:
+        return self._blobs.read(self.digest)
+
+    def getbuffer(self):
+        return memoryview(self.getvalue())
+
+    def read(self, size=-1) -> bytes:
+        with self._blobs.open(self.digest) as f:
+            f.seek(self._pos)
+            data = f.read() if size is None or size < 0 else f.read(size)
+        self._pos += len(data)
+        return data
+
+    read1 = read
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def write(self, data):
+        raise io.UnsupportedOperation("Spilled photos are read-only")
+
+    def __reduce__(self):
+        return (SpilledPhoto, (self.digest, self.name))
+
+
+def _spill_candidates(state, seen: set):
+    """
+    (bytes, places, photo_ref) of every in-memory photo in the keys
+    checkpoints persist, where places lists every (container, index) that
+    holds that same photo object and photo_ref is a weak reference to it.
+    """
+    found = {}
+    for key in list(state.keys()):
+        if key not in checkpoint.CHECKPOINT_KEYS and not key.startswith(checkpoint.CHECKPOINT_PREFIXES):
+            continue
+        stack = [state[key]]
+        while stack:
+            container = stack.pop()
+            if isinstance(container, dict):
+                items = list(container.items())
+            elif isinstance(container, list):
+                items = list(enumerate(container))
+            else:
+                continue
+            for index, value in items:
+                if isinstance(value, io.BytesIO) and not isinstance(value, SpilledPhoto):
+                    if id(value) not in found:
+                        found[id(value)] = (deep_size(value, seen), [], weakref.ref(value))
+                    found[id(value)][1].append((container, index))
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+    return list(found.values())
+
+
+def trim_session(state, target_bytes: int, current_bytes: int, blobs: storage.BlobStore = None) -> dict:
+    """
+    Brings a session's state down towards target_bytes, largest item first:
+    photos are spilled to the BlobStore (every reference to the photo in the
+    persisted keys is replaced by one SpilledPhoto) and EVICTABLE_KEYS are
+    reset. A photo still referenced from elsewhere (a widget value, a cache)
+    is not freed, so it is counted under 'retained' instead of spilled.
+    Returns what was done.
+    """
+    blobs = blobs or storage.BlobStore()
+    seen = set()
+    candidates = [(size, 'spill', places, ref) for size, places, ref in _spill_candidates(state, seen)]
+    for key, default in EVICTABLE_KEYS.items():
+        if key in state and state[key]:
+            candidates.append((deep_size(state[key], seen), 'evict', key, default))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    result = {'spilled': 0, 'spilled_bytes': 0, 'retained': 0, 'evicted': [], 'evicted_bytes': 0}
+    for size, action, where, what in candidates:
+        if current_bytes <= target_bytes:
+            break
+        if action == 'spill':
+            photo = what()
+            if photo is None:
+                continue
+            spilled = SpilledPhoto(blobs.put_file(photo), getattr(photo, 'name', None), blobs)
+            for container, index in where:
+                container[index] = spilled
+            del photo
+            if what() is not None:
+                result['retained'] += 1
+                continue
+            result['spilled'] += 1
+            result['spilled_bytes'] += size
+        else:
+            state[where] = what()
+            result['evicted'].append(where)
+            result['evicted_bytes'] += size
+        current_bytes -= size
+    return result
+
+
+# --- TRACKING ---
+@dataclass(slots=True)
+class SessionUsage:
+    """One measurement of a session's state."""
+    session_id: str
+    user: str
+    page: str
+    keys: dict                 # session-state key -> bytes
+    measured_at: float
+    measure_ms: float
+    spilled_bytes: int = 0     # freed by the soft limit at this measurement
+    evicted: list = field(default_factory=list)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.keys.values())
+
+    def top_keys(self, n: int = 5):
+        return sorted(self.keys.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+class SessionMemoryTracker:
+    """Latest usage of every live session in this process (sessions never report closing, so they expire)."""
+
+    def __init__(self, ttl: float = SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.measurements = self.spills = self.spilled_bytes = self.evictions = 0
+        self._snapshot = None
+
+    def record(self, usage: SessionUsage) -> None:
+        with self._lock:
+            self._sessions[usage.session_id] = usage
+            self.measurements += 1
+            if usage.spilled_bytes or usage.evicted:
+                self.spills += 1
+                self.spilled_bytes += usage.spilled_bytes
+                self.evictions += len(usage.evicted)
+            cutoff = time.time() - self.ttl
+            for session_id in [s for s, u in self._sessions.items() if u.measured_at < cutoff]:
+                del self._sessions[session_id]
+
+    def sessions(self):
+        """Live sessions, largest first."""
+        with self._lock:
+            return sorted(self._sessions.values(), key=lambda u: u.total_bytes, reverse=True)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(u.total_bytes for u in self._sessions.values())
+
+    def top_keys(self, n: int = 10):
+        """Session-state keys summed over all live sessions, largest first."""
+        totals = {}
+        for usage in self.sessions():
+            for key, size in usage.keys.items():
+                totals[key] = totals.get(key, 0) + size
+        return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+    def session_target(self, session_id: str, total_bytes: int):
+        """Soft-limit target for a session, or None when it is within its limits."""
+        target = None
+        if SESSION_SOFT_LIMIT and total_bytes > SESSION_SOFT_LIMIT:
+            target = int(SESSION_SOFT_LIMIT * LOW_WATER)
+        if PROCESS_SOFT_LIMIT:
+            with self._lock:
+                others = [u.total_bytes for s, u in self._sessions.items() if s != session_id]
+            if sum(others) + total_bytes > PROCESS_SOFT_LIMIT:
+                share = PROCESS_SOFT_LIMIT // (len(others) + 1)
+                if total_bytes > share:
+                    fair = int(share * LOW_WATER)
+                    target = fair if target is None else min(target, fair)
+        return target
+
+    # --- TRACEMALLOC ---
+    def allocation_sites(self, limit: int = 15):
+        """
+        Top allocation sites (file:line) from a tracemalloc snapshot, with the
+        change since the previous call. Empty unless tracing was started.
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        with self._lock:
+            previous, self._snapshot = self._snapshot, snapshot
+        if previous is not None:
+            stats = snapshot.compare_to(previous, 'lineno')
+            rows = [(s.traceback[0], s.size, s.size_diff, s.count) for s in stats]
+        else:
+            rows = [(s.traceback[0], s.size, 0, s.count) for s in snapshot.statistics('lineno')]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return [{'site': f"{os.path.basename(frame.filename)}:{frame.lineno}", 'bytes': size,
+                 'change_bytes': diff, 'blocks': count} for frame, size, diff, count in rows[:limit]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'tracked_bytes': sum(u.total_bytes for u in self._sessions.values()),
+                    'measurements': self.measurements, 'spills': self.spills,
+                    'spilled_bytes': self.spilled_bytes, 'evictions': self.evictions,
+                    'tracemalloc': tracemalloc.is_tracing()}
+
+
+def get_tracker() -> SessionMemoryTracker:
+    """Returns the process-wide session memory tracker."""
+    return resources.shared('session_memory', SessionMemoryTracker)
+
+
+def start_tracing(frames: int = 1) -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing() -> None:
+    tracemalloc.stop()
+
+
+if os.environ.get("FIELDSCRIBE_TRACEMALLOC"):
+    start_tracing()
+
+
+# --- PER-RERUN HOOK ---
+def measure_state(state) -> dict:
+    """Deep size per session-state key; objects shared between keys count once."""
+    seen = set()
+    sizes = {}
+    for key in list(state.keys()):
+        if key == _MEASURED_AT_KEY:
+            continue
+        try:
+            sizes[key] = deep_size(state[key], seen)
+        except Exception as e:
+            logger.debug("Could not size session key %s: %s", key, e)
+    return sizes
+
+
+def account_session(state, force: bool = False, tracker: SessionMemoryTracker = None):
+    """
+    Measures the session (at most every MEASURE_INTERVAL seconds unless
+    forced), records it with the tracker and applies the soft limits.
+    Returns the SessionUsage, or None when the measurement was skipped.
+    """
+    now = time.time()
+    if not force and now - state.get(_MEASURED_AT_KEY, 0) < MEASURE_INTERVAL:
+        return None
+    state[_MEASURED_AT_KEY] = now
+    tracker = tracker or get_tracker()
+    session_id = state.get('inspection_id') or 'unknown'
+
+    start = time.perf_counter()
+    sizes = measure_state(state)
+    total = sum(sizes.values())
+    spilled, evicted = 0, []
+    target = tracker.session_target(session_id, total)
+    if target is not None:
+        done = trim_session(state, target, total)
+        spilled, evicted = done['spilled_bytes'], done['evicted']
+        if spilled or evicted:
+            logger.info("Session %s over its soft limit (%.1f MB): spilled %d photos (%.1f MB), evicted %s",
+                        session_id, total / MB, done['spilled'], spilled / MB, evicted or 'nothing')
+            sizes = measure_state(state)
+
+    usage = SessionUsage(
+        session_id=session_id, user=str(state.get('current_user') or ''), page=str(state.get('page') or ''),
+        keys=sizes, measured_at=now, measure_ms=(time.perf_counter() - start) * 1000,
+        spilled_bytes=spilled, evicted=evicted,
+    )
+    tracker.record(usage)
+    return usage
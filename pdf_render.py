@@ -0,0 +1,320 @@
+"""
+PDF Rendering for FieldScribe
+Renders the intermediate report model (see logic.build_report_model) to PDF
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas as pdf_canvas
+    from reportlab import rl_config
+    REPORTLAB_AVAILABLE = True
+except ImportError:
+    REPORTLAB_AVAILABLE = False
+
+# RTL support: bidi reorders Hebrew/Arabic into visual order, the reshaper
+# joins Arabic letters into their contextual forms. Both are optional.
+try:
+    from bidi.algorithm import get_display
+    BIDI_AVAILABLE = True
+except ImportError:
+    BIDI_AVAILABLE = False
+try:
+    import arabic_reshaper
+    RESHAPER_AVAILABLE = True
+except ImportError:
+    RESHAPER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# A TrueType font with Hebrew and Arabic glyphs is required for RTL text;
+# FIELDSCRIBE_PDF_FONT (and FIELDSCRIBE_PDF_FONT_BOLD) override the search.
+FONT_CANDIDATES = [
+    os.environ.get("FIELDSCRIBE_PDF_FONT", ""),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+BOLD_FONT_CANDIDATES = [
+    os.environ.get("FIELDSCRIBE_PDF_FONT_BOLD", ""),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+]
+
+_fonts = None
+
+
+def _register_fonts():
+    """Registers the report fonts once per process; returns (regular, bold) names."""
+    global _fonts
+    if _fonts is not None:
+        return _fonts
+
+    def register(name, candidates):
+        for path in candidates:
+            if path and os.path.exists(path):
+                try:
+                    pdfmetrics.registerFont(TTFont(name, path))
+                    return name
+                except Exception as e:
+                    logger.warning("Could not load PDF font %s: %s", path, e)
+        return None
+
+    regular = register("FieldScribe", FONT_CANDIDATES)
+    bold = register("FieldScribe-Bold", BOLD_FONT_CANDIDATES)
+    if regular is None:
+        logger.warning("No Unicode font found for PDF export; Hebrew/Arabic text will not render. "
+                       "Set FIELDSCRIBE_PDF_FONT to a .ttf file.")
+        regular, bold = "Helvetica", "Helvetica-Bold"
+    _fonts = (regular, bold or regular)
+    return _fonts
+
+
+def _shape(text):
+    """Joins Arabic letters into contextual forms (logical order is kept)."""
+    if RESHAPER_AVAILABLE and text:
+        return arabic_reshaper.reshape(text)
+    return text
+
+
+def _visual(line, base_dir='R'):
+    """Reorders one already-wrapped line into visual (left-to-right drawing) order."""
+    if BIDI_AVAILABLE and line:
+        return get_display(line, base_dir=base_dir)
+    return line
+
+
+class _PdfReport:
+    """
+    Cursor-based page writer: starts a new page when the next block does not
+    fit. reportlab's Canvas keeps every finished page (and each embedded
+    JPEG) until save(), so memory grows with the report.
+    """
+
+    PAGE_W, PAGE_H = A4 if REPORTLAB_AVAILABLE else (595.27, 841.89)
+    MARGIN = 72
+    CONTENT_W = PAGE_W - 2 * MARGIN
+
+    def __init__(self, out, model):
+        self.model = model
+        self.c = pdf_canvas.Canvas(out, pagesize=(self.PAGE_W, self.PAGE_H), pageCompression=1)
+        self.regular, self.bold = _register_fonts()
+        self.page = 0
+        self._start_page()
+
+    # --- PAGES ---
+    def _start_page(self):
+        self.page += 1
+        self.y = self.PAGE_H - self.MARGIN
+        c = self.c
+        c.setFont(self.regular, 9)
+        c.setFillGray(0.35)
+        header = f"Project ID: {self.model.client_name} | Engineer: {self.model.engineer}"
+        c.drawString(self.MARGIN, self.PAGE_H - self.MARGIN / 2, _visual(_shape(header), base_dir='L'))
+        c.drawRightString(self.PAGE_W - self.MARGIN, self.PAGE_H - self.MARGIN / 2, self.model.date)
+        c.setFillGray(0)
+
+    def _end_page(self):
+        c = self.c
+        c.setFont(self.regular, 9)
+        c.setFillGray(0.35)
+        c.drawRightString(self.PAGE_W - self.MARGIN, self.MARGIN / 2, f"Page {self.page}")
+        c.setFillGray(0)
+        c.showPage()
+
+    def new_page(self):
+        self._end_page()
+        self._start_page()
+
+    def ensure(self, height):
+        if self.y - height < self.MARGIN:
+            self.new_page()
+
+    def finish(self):
+        self._end_page()
+        self.c.save()
+
+    # --- TEXT ---
+    def _wrap(self, text, font, size, width):
+        """Greedy word wrap in logical order; returns visual-order lines."""
+        lines = []
+        for paragraph in (text or '').split('\n'):
+            words = _shape(paragraph).split(' ')
+            current = ''
+            for word in words:
+                candidate = f"{current} {word}" if current else word
+                if current and pdfmetrics.stringWidth(candidate, font, size) > width:
+                    lines.append(current)
+                    current = word
+                else:
+                    current = candidate
+            lines.append(current)
+        return [_visual(line) for line in lines]
+
+    def text(self, text, size=11, bold=False, underline=False, space_after=6):
+        font = self.bold if bold else self.regular
+        leading = size * 1.3
+        for line in self._wrap(text, font, size, self.CONTENT_W):
+            self.ensure(leading)
+            self.y -= leading
+            x_right = self.PAGE_W - self.MARGIN
+            self.c.setFont(font, size)
+            self.c.drawRightString(x_right, self.y, line)
+            if underline and line.strip():
+                w = pdfmetrics.stringWidth(line, font, size)
+                self.c.line(x_right - w, self.y - 2, x_right, self.y - 2)
+        self.y -= space_after
+
+    def box(self, text, fill_rgb, size=11, bold=False, dashed=False, min_height=0):
+        """Full-width shaded box with right-aligned text (defect title / photo placeholder)."""
+        font = self.bold if bold else self.regular
+        leading = size * 1.3
+        pad = 6
+        lines = self._wrap(text, font, size, self.CONTENT_W - 2 * pad)
+        height = max(min_height, len(lines) * leading + 2 * pad)
+        self.ensure(height)
+        c = self.c
+        c.saveState()
+        c.setFillColorRGB(*fill_rgb)
+        if dashed:
+            c.setDash(3, 3)
+        c.rect(self.MARGIN, self.y - height, self.CONTENT_W, height, stroke=1 if dashed else 0, fill=1)
+        c.restoreState()
+        c.setFont(font, size)
+        y = self.y - pad
+        for line in lines:
+            y -= leading
+            c.drawRightString(self.PAGE_W - self.MARGIN - pad, y + size * 0.3, line)
+        self.y -= height + 6
+
+    # --- IMAGES ---
+    def image(self, data, width):
+        """Draws image bytes (JPEG, or PNG with transparency) at full content width (logo)."""
+        reader = ImageReader(BytesIO(data))
+        iw, ih = reader.getSize()
+        height = width * ih / float(iw)
+        self.ensure(height)
+        self.y -= height
+        self.c.drawImage(reader, self.MARGIN, self.y, width=width, height=height, mask='auto')
+        self.y -= 6
+
+    def photo_grid(self, photos):
+        """Two-column evidence grid, first photo on the right (RTL), max 4in tall per cell."""
+        col_w = self.CONTENT_W / 2
+        cell_w = col_w - 8
+        max_h = 4 * inch
+        for start in range(0, len(photos), 2):
+            row = []
+            for i, data in enumerate(photos[start:start + 2]):
+                # ImageReader only reads the JPEG header here; the bytes are embedded as-is (DCTDecode)
+                reader = ImageReader(BytesIO(data))
+                iw, ih = reader.getSize()
+                w = cell_w
+                h = w * ih / float(iw)
+                if h > max_h:
+                    w, h = w * max_h / h, max_h
+                row.append((i, reader, w, h))
+            row_h = max(h for _, _, _, h in row)
+            self.ensure(row_h + 8)
+            for i, reader, w, h in row:
+                col_x = self.MARGIN + (col_w if i == 0 else 0)  # RTL: Photo 1 right, Photo 2 left
+                x = col_x + (col_w - w) / 2
+                self.c.drawImage(reader, x, self.y - h - 4, width=w, height=h)
+            self.y -= row_h + 8
+
+
+# rl_config is process-wide; renders running together share one override
+_a85_lock = threading.Lock()
+_a85_renders = 0
+_a85_saved = None
+
+
+@contextmanager
+def _binary_streams():
+    """
+    Embeds JPEG and page streams as raw binary instead of ASCII85 text (25%
+    smaller) while a render runs. reportlab reads rl_config.useA85 when it
+    builds each stream, so the setting is restored once the last concurrent
+    render has saved.
+    """
+    global _a85_renders, _a85_saved
+    with _a85_lock:
+        if _a85_renders == 0:
+            _a85_saved = rl_config.useA85
+            rl_config.useA85 = 0
+        _a85_renders += 1
+    try:
+        yield
+    finally:
+        with _a85_lock:
+            _a85_renders -= 1
+            if _a85_renders == 0:
+                rl_config.useA85 = _a85_saved
+
+
+def render_pdf(model, out=None):
+    """
+    Renders a report model to PDF with the same layout as the Word document.
+
+    out may be a path or a binary file object; when omitted a BytesIO is
+    created and returned positioned at the start. Photos are the compressed
+    JPEG bytes from the model and are embedded without re-encoding (never as
+    decoded bitmaps). The document is not streamed: the whole PDF is built in
+    memory and written on save, on top of the model's own photo bytes.
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("PDF export requires reportlab (pip install reportlab)")
+    if not BIDI_AVAILABLE:
+        logger.warning("python-bidi is not installed; RTL text in the PDF will be in logical order")
+
+    buffer = out if out is not None else BytesIO()
+    labels = model.labels
+    with _binary_streams():
+        pdf = _PdfReport(buffer, model)
+
+        if model.logo:
+            pdf.image(model.logo, pdf.CONTENT_W)
+
+        # --- TITLE PAGE ---
+        pdf.text(f"{labels['client']}{model.client_name}", size=12, bold=True, space_after=14)
+        pdf.text(labels['title'], size=16, bold=True, underline=True, space_after=14)
+
+        # --- DETAILED FINDINGS ---
+        pdf.text(labels['findings'], size=14, bold=True, space_after=10)
+        if model.defects:
+            for defect in model.defects:
+                pdf.box(defect.title, (1, 1, 0), size=14, bold=True)
+                if defect.desc:
+                    pdf.text(defect.desc)
+                else:
+                    pdf.y -= 3 * 14
+                if defect.photos:
+                    pdf.photo_grid(defect.photos)
+                else:
+                    pdf.box(labels['photo_placeholder'], (0.83, 0.83, 0.83), dashed=True, min_height=inch)
+                pdf.text(defect.code or '____________________')
+                pdf.new_page()
+        else:
+            pdf.text(labels['no_items'])
+
+        # --- NOTES & SIGN-OFF ---
+        pdf.text(labels['notes'], size=12, bold=True)
+        pdf.text(model.notes, space_after=14)
+        pdf.text(labels['signoff'], size=13, bold=True)
+        pdf.text(labels['signature'])
+        pdf.finish()
+
+    if out is None:
+        buffer.seek(0)
+    return buffer
@@ -0,0 +1,215 @@
+"""
+Photo Locations for FieldScribe
+Handles the spatial index of defect photos (EXIF GPS position and capture
+time) behind "earlier defects near here" on a returning site visit and the
+reuse of floor plans already attached at the same location
+"""
+
+import json
+import logging
+import math
+import threading
+from dataclasses import dataclass
+
+import imaging
+import report_model
+import resources
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Grid cell edge; a radius query reads the few cells its circle overlaps
+CELL_METERS = 25.0
+NEARBY_METERS = 20.0
+EARTH_RADIUS_M = 6371008.8
+_METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+_CELL_DEGREES = CELL_METERS / _METERS_PER_DEGREE
+# Column index offset so cell keys stay non-negative (row * _COLUMNS + column)
+_COLUMNS = 1 << 32
+
+
+def _row(lat: float) -> int:
+    return math.floor((lat + 90.0) / _CELL_DEGREES)
+
+
+# Row of the North Pole itself (lat == 90)
+_LAST_ROW = _row(90.0)
+
+
+def _column_degrees(row: int) -> float:
+    """Longitude span of the cells in a grid row (cells stay ~CELL_METERS wide towards the poles)."""
+    lat = row * _CELL_DEGREES - 90.0 + _CELL_DEGREES / 2
+    return _CELL_DEGREES / max(math.cos(math.radians(lat)), 1e-6)
+
+
+def _column_count(row: int) -> int:
+    """Cells in a grid row; the last one is narrower and ends at +180."""
+    return max(1, math.ceil(360.0 / _column_degrees(row)))
+
+
+def _column(row: int, lon: float) -> int:
+    # -180 and +180 are the same meridian: both land in column 0
+    lon = (lon + 180.0) % 360.0
+    return min(math.floor(lon / _column_degrees(row)), _column_count(row) - 1)
+
+
+def cell_of(lat: float, lon: float) -> int:
+    row = _row(lat)
+    return row * _COLUMNS + _column(row, lon)
+
+
+def cells_within(lat: float, lon: float, radius_m: float) -> list:
+    """
+    Keys of every grid cell a circle of radius_m around (lat, lon) may overlap,
+    wrapping across the ±180° meridian and taking whole rows around a pole.
+    """
+    dlat = radius_m / _METERS_PER_DEGREE
+    # Widest longitude span of the circle, at its most poleward latitude
+    edge = abs(lat) + dlat
+    dlon = 180.0 if edge >= 90.0 else min(dlat / math.cos(math.radians(edge)), 180.0)
+    cells = []
+    for row in range(max(_row(lat - dlat), 0), min(_row(lat + dlat), _LAST_ROW) + 1):
+        count = _column_count(row)
+        if 2 * dlon + _column_degrees(row) >= 360.0:
+            columns = range(count)
+        else:
+            first, last = _column(row, lon - dlon), _column(row, lon + dlon)
+            columns = range(first, last + 1) if first <= last else [*range(first, count), *range(last + 1)]
+        cells.extend(row * _COLUMNS + column for column in columns)
+    return cells
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+@dataclass(slots=True)
+class NearbyDefect:
+    """A defect photographed near a point (one per indexed photo)."""
+    inspection_id: str
+    title: str
+    code: str
+    category: str
+    taken: str
+    distance: float
+    photo: str                # BlobStore digest of the photo
+    map_photos: list          # BlobStore digests of the defect's floor plans
+
+
+class PhotoLocationIndex:
+    """
+    Located defect photos in SQLite, keyed by a fixed metric grid.
+
+    Each photo with an EXIF position is one row under the key of its
+    CELL_METERS grid cell; the (cell, taken) index turns a radius query into
+    a handful of index range scans, newest first, followed by an exact
+    distance check. Photos without a position are not indexed.
+    """
+
+    def __init__(self, db_path=None, blobs: storage.BlobStore = None):
+        self._conn = storage.connect(db_path)
+        self._lock = threading.Lock()
+        self.blobs = blobs or storage.BlobStore()
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS photo_locations (
+                    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cell          INTEGER NOT NULL,
+                    taken         TEXT NOT NULL DEFAULT '',
+                    lat           REAL NOT NULL,
+                    lon           REAL NOT NULL,
+                    photo         TEXT NOT NULL,
+                    inspection_id TEXT NOT NULL DEFAULT '',
+                    title         TEXT NOT NULL DEFAULT '',
+                    code          TEXT NOT NULL DEFAULT '',
+                    category      TEXT NOT NULL DEFAULT '',
+                    map_photos    TEXT NOT NULL DEFAULT '[]',
+                    UNIQUE (photo, inspection_id, title)
+                );
+                CREATE INDEX IF NOT EXISTS idx_photo_locations_cell ON photo_locations(cell, taken DESC);
+            """)
+
+    def add_defect(self, inspection_id: str, defect: report_model.Defect) -> int:
+        """
+        Indexes the located photos of a captured Defect (photo_exif holds a
+        PhotoExif.to_list() value per photo). Returns how many were indexed.
+        """
+        located = [(handle, imaging.PhotoExif.from_list(e))
+                   for handle, e in zip(defect.photos, defect.photo_exif) if e]
+        located = [(handle, e) for handle, e in located if e.has_location]
+        if not located:
+            return 0
+        map_digests = json.dumps([h.digest for h in defect.map_photos])
+        rows = [(cell_of(e.lat, e.lon), e.taken, e.lat, e.lon, handle.digest, inspection_id or '',
+                 defect.title, defect.code, defect.category, map_digests)
+                for handle, e in located]
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT OR IGNORE INTO photo_locations
+                    (cell, taken, lat, lon, photo, inspection_id, title, code, category, map_photos)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        return len(rows)
+
+    def nearby(self, lat: float, lon: float, radius_m: float = NEARBY_METERS, exclude_inspection: str = None,
+               before: str = None, limit: int = 50) -> list:
+        """
+        Defects photographed within radius_m of (lat, lon), newest first, one
+        entry per defect (its closest photo). exclude_inspection leaves out
+        the current visit; before ('YYYY-MM-DD...') keeps earlier photos only.
+        """
+        cells = cells_within(lat, lon, radius_m)
+        clauses, params = [f"cell IN ({','.join('?' * len(cells))})"], list(cells)
+        if exclude_inspection:
+            clauses.append("inspection_id != ?")
+            params.append(exclude_inspection)
+        if before:
+            clauses.append("taken < ?")
+            params.append(before)
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT inspection_id, title, code, category, taken, lat, lon, photo, map_photos
+                FROM photo_locations WHERE {' AND '.join(clauses)}
+            """, params).fetchall()
+        found = {}
+        for row in rows:
+            distance = distance_m(lat, lon, row['lat'], row['lon'])
+            if distance > radius_m:
+                continue
+            key = (row['inspection_id'], row['title'])
+            if key not in found or distance < found[key].distance:
+                found[key] = NearbyDefect(row['inspection_id'], row['title'], row['code'], row['category'],
+                                          row['taken'], distance, row['photo'], json.loads(row['map_photos']))
+        return sorted(found.values(), key=lambda d: (d.taken, -d.distance), reverse=True)[:limit]
+
+    def nearby_map_photos(self, lat: float, lon: float, radius_m: float = NEARBY_METERS,
+                          exclude_inspection: str = None) -> list:
+        """Floor plan digests attached to the closest earlier defect near (lat, lon) that has any."""
+        with_maps = [d for d in self.nearby(lat, lon, radius_m, exclude_inspection) if d.map_photos]
+        return min(with_maps, key=lambda d: d.distance).map_photos if with_maps else []
+
+    def stats(self) -> dict:
+        with self._lock:
+            photos, cells = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT cell) FROM photo_locations"
+            ).fetchone()
+        return {'photos': photos, 'cells': cells}
+
+
+def locate(exif_list) -> tuple:
+    """(lat, lon) of the last located photo in a list of PhotoExif.to_list() values, or None."""
+    for value in reversed(exif_list or []):
+        if value:
+            exif = imaging.PhotoExif.from_list(value)
+            if exif.has_location:
+                return exif.lat, exif.lon
+    return None
+
+
+def get_photo_index() -> PhotoLocationIndex:
+    """Returns the process-wide photo location index."""
+    return resources.shared('photo_index', PhotoLocationIndex)
@@ -0,0 +1,321 @@
+"""
+Report Profiling for FieldScribe
+Handles on-demand profiling of a single report generation: a cProfile of
+the generating thread, a sampling profile of every thread working on the
+report, per-photo timings with each original's size and mode, all saved as
+one downloadable zip bundle. Nothing here runs unless a profile is asked for
+"""
+
+import argparse
+import cProfile
+import csv
+import io
+import json
+import logging
+import marshal
+import os
+import platform
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+import PIL
+from PIL import Image
+
+import logic
+import report_model
+import resources
+import storage
+import versions
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(storage.DATA_DIR, "profiles")
+# Bundles kept on disk (oldest removed first)
+PROFILE_KEEP = 20
+# Seconds between stack samples of the report's threads
+SAMPLE_INTERVAL = 0.005
+# Functions listed in the text summary of the cProfile
+PSTATS_LINES = 60
+
+
+@dataclass(slots=True)
+class PhotoTiming:
+    """One timed photo step ('compress', 'build' or 'encode')."""
+    digest: str
+    stage: str
+    seconds: float
+    out_bytes: int
+    thread: str
+
+
+class GenerationProfile:
+    """
+    Observer for logic.render_reports / transform_report_languages: wraps the
+    photo and translation steps to time them, and times named stages.
+    cold=True bypasses the compression cache so every photo is re-encoded.
+    """
+
+    def __init__(self, cold: bool = False):
+        self.cold = cold
+        self.photos = []
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, step: str, fn):
+        """fn, timed per call; calls on a PhotoHandle (or its digest) are recorded per photo."""
+        def timed(first, *args, **kwargs):
+            start = time.perf_counter()
+            result = fn(first, *args, **kwargs)
+            seconds = time.perf_counter() - start
+            digest = getattr(first, 'digest', None)
+            with self._lock:
+                self.calls[step] += 1
+                self.call_seconds[step] += seconds
+                if digest is not None:
+                    self.photos.append(PhotoTiming(digest, step, seconds,
+                                                   len(result) if isinstance(result, bytes) else 0,
+                                                   threading.current_thread().name))
+            return result
+        return timed
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+class StackSampler:
+    """
+    Samples the stacks of the generating thread and the report pool's
+    threads (logic.REPORT_THREAD_PREFIX) every interval seconds. Stacks are
+    counted in collapsed form ('thread;outer;...;inner'), which flame graph
+    tools (flamegraph.pl, speedscope) read directly.
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _watched(self) -> dict:
+        names = {t.ident: t.name for t in threading.enumerate()
+                 if t.ident == self.thread_id or t.name.startswith(logic.REPORT_THREAD_PREFIX)}
+        names[self.thread_id] = 'main'
+        return names
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = self._watched()
+            for ident, frame in sys._current_frames().items():
+                if ident not in names:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names[ident])
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _photo_details(report, blobs: storage.BlobStore) -> dict:
+    """digest -> name, stored bytes and the original's format, size and mode (header only)."""
+    details = {}
+    for defect in report.defects:
+        for handle in defect.photos:
+            if handle.digest in details:
+                continue
+            info = {'name': handle.name, 'bytes': blobs.size(handle.digest),
+                    'format': '', 'width': 0, 'height': 0, 'mode': ''}
+            try:
+                with blobs.open(handle.digest) as f:
+                    image = Image.open(f)
+                    info.update(format=image.format or '', width=image.width, height=image.height, mode=image.mode)
+            except Exception as e:
+                info['format'] = f"unreadable: {e}"
+            details[handle.digest] = info
+    return details
+
+
+def _photos_csv(profile: GenerationProfile, details: dict) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['digest', 'name', 'format', 'width', 'height', 'mode', 'stored_bytes',
+                     'step', 'seconds', 'output_bytes', 'thread'])
+    for t in sorted(profile.photos, key=lambda t: -t.seconds):
+        d = details.get(t.digest, {})
+        writer.writerow([t.digest, d.get('name', ''), d.get('format', ''), d.get('width', 0), d.get('height', 0),
+                         d.get('mode', ''), d.get('bytes', 0), t.stage, f"{t.seconds:.6f}", t.out_bytes, t.thread])
+    return out.getvalue()
+
+
+def _write_bundle(path: str, files: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            for name, data in files.items():
+                bundle.writestr(name, data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _prune(directory: str, keep: int) -> None:
+    bundles = sorted(f for f in os.listdir(directory) if f.endswith('.zip'))
+    for name in bundles[:-keep] if keep else bundles:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def profile_report(report, languages, translator=None, formats=('docx',), preset=logic.DEFAULT_PRESET,
+                   cold: bool = False, label: str = '', blobs: storage.BlobStore = None, directory: str = None):
+    """
+    Generates a report as logic.render_reports does, under cProfile and the
+    stack sampler, and saves the profile bundle. Returns (outputs, bundle
+    path); outputs are the same {language: {format: BytesIO}}.
+
+    Bundle contents: summary.json (report shape, stage and step timings,
+    environment), photos.csv (one row per timed photo step, slowest first,
+    with the original's format, size and mode), profile.pstats (load with
+    pstats.Stats), profile.txt (top functions by cumulative time) and
+    samples.folded (collapsed stacks of every thread working on the report).
+    """
+    blobs = blobs or storage.BlobStore()
+    directory = directory or PROFILE_DIR
+    observer = GenerationProfile(cold=cold)
+    profiler = cProfile.Profile()
+    started = datetime.now()
+    with StackSampler(threading.get_ident()) as sampler:
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            outputs = logic.render_reports(report, languages, translator, formats, preset, observer=observer)
+        finally:
+            profiler.disable()
+            wall = time.perf_counter() - start
+
+    stats = pstats.Stats(profiler)
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PSTATS_LINES)
+    details = _photo_details(report, blobs)
+    summary = {
+        'label': label,
+        'started': started.isoformat(timespec='seconds'),
+        'wall_seconds': round(wall, 4),
+        'client_name': report.client_name,
+        'defects': len(report.defects),
+        'photos': len(details),
+        'photo_bytes': sum(d['bytes'] for d in details.values()),
+        'languages': list(languages),
+        'formats': list(formats),
+        'preset': preset,
+        'cold': cold,
+        'stages': {name: round(seconds, 4) for name, seconds in observer.stages.items()},
+        'steps': {step: {'calls': observer.calls[step], 'seconds': round(observer.call_seconds[step], 4)}
+                  for step in observer.calls},
+        'output_bytes': {f"{language}.{fmt}": buffer.getbuffer().nbytes
+                         for language, files in outputs.items() for fmt, buffer in files.items()},
+        'samples': sampler.samples,
+        'sample_interval': sampler.interval,
+        'environment': {'python': platform.python_version(), 'pillow': PIL.__version__,
+                        'platform': platform.platform(), 'cpu_workers': resources.CPU_WORKERS},
+    }
+    slug = ''.join(c if c.isalnum() else '_' for c in (label or report.client_name or 'report'))[:40]
+    path = os.path.join(directory, f"{started:%Y%m%d-%H%M%S}_{slug}.zip")
+    _write_bundle(path, {
+        'summary.json': json.dumps(summary, ensure_ascii=False, indent=2),
+        'photos.csv': _photos_csv(observer, details),
+        'profile.pstats': marshal.dumps(stats.stats),
+        'profile.txt': text.getvalue(),
+        'samples.folded': sampler.collapsed(),
+    })
+    _prune(directory, PROFILE_KEEP)
+    logger.info("Profiled report generation in %.2fs: %s", wall, path)
+    return outputs, path
+
+
+def _report_from_photos(paths, client_name: str, blobs: storage.BlobStore) -> report_model.Report:
+    """A report with one defect per image file (to profile problem photos without the app)."""
+    defects = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            photo = io.BytesIO(f.read())
+        photo.name = os.path.basename(path)
+        defects.append({'title': photo.name, 'photos': [photo]})
+    return report_model.build_report(client_name, '', defects, engineer=logic.ENGINEER_NAME, blobs=blobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile one FieldScribe report generation")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--series", help="inspection id: profile the latest saved version of its report")
+    source.add_argument("--version", type=int, help="report version id")
+    source.add_argument("--photos", nargs="+", help="image files, one defect each")
+    parser.add_argument("--client", default="Profile", help="client name for --photos")
+    parser.add_argument("--languages", default=logic.ORIGINAL_LANGUAGE, help="comma-separated, e.g. he,ar")
+    parser.add_argument("--formats", default="docx", help="comma-separated: docx,pdf")
+    parser.add_argument("--preset", default=logic.DEFAULT_PRESET, choices=list(logic.OUTPUT_PRESETS))
+    parser.add_argument("--cold", action="store_true", help="bypass the compression cache")
+    parser.add_argument("--offline", action="store_true", help="keep the source text (no translation requests)")
+    parser.add_argument("--out", default=PROFILE_DIR, help="folder for the bundle")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    blobs = storage.BlobStore()
+    if args.photos:
+        report, label = _report_from_photos(args.photos, args.client, blobs), args.client
+    else:
+        store = versions.get_report_versions()
+        if args.series:
+            latest = store.list_versions(args.series)
+            if not latest:
+                parser.error(f"no saved versions for inspection {args.series}")
+            args.version = latest[0].id
+        report, label = store.load(args.version), f"version_{args.version}"
+
+    translator = (lambda text, target: text) if args.offline else None
+    _, path = profile_report(report, args.languages.split(','), translator, tuple(args.formats.split(',')),
+                             args.preset, args.cold, label, blobs, args.out)
+    with zipfile.ZipFile(path) as bundle:
+        summary = json.loads(bundle.read('summary.json'))
+    print(f"{summary['defects']} defects, {summary['photos']} photos in {summary['wall_seconds']}s "
+          f"({summary['samples']} samples): {path}")
+    for name, seconds in summary['stages'].items():
+        print(f"  {name:<24} {seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
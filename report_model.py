@@ -0,0 +1,166 @@
+"""
+Report Model for FieldScribe
+Typed intermediate representation between the UI's defect dicts and the
+document renderers
+"""
+
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import storage
+
+CATEGORIES = ["Structural", "Electrical", "Plumbing", "Finishing", "Safety", "General"]
+DEFAULT_CATEGORY = "General"
+
+# Interned up front so every defect shares one string object per category
+_CATEGORY_LOOKUP = {sys.intern(c).lower(): sys.intern(c) for c in CATEGORIES}
+
+
+def intern_category(value) -> str:
+    """Canonical, interned category string ('cat', 'category' or missing -> General)."""
+    if not value:
+        return _CATEGORY_LOOKUP[DEFAULT_CATEGORY.lower()]
+    value = str(value).strip()
+    return _CATEGORY_LOOKUP.get(value.lower()) or sys.intern(value)
+
+
+def intern_code(value) -> str:
+    """Standard codes repeat across almost every defect; intern them."""
+    return sys.intern(str(value).strip()) if value else ''
+
+
+@dataclass(slots=True, frozen=True)
+class PhotoHandle:
+    """Reference to a photo in the content-addressed BlobStore (not the bytes)."""
+    digest: str
+    name: str = ''
+
+    @classmethod
+    def from_file(cls, file_obj, blobs: storage.BlobStore) -> 'PhotoHandle':
+        return cls(blobs.put_file(file_obj), getattr(file_obj, 'name', '') or '')
+
+    def open(self, blobs: storage.BlobStore):
+        return blobs.open(self.digest)
+
+
+@dataclass(slots=True)
+class Defect:
+    title: str
+    desc: str = ''
+    code: str = ''
+    category: str = DEFAULT_CATEGORY
+    mode: str = 'standard'
+    photos: tuple = ()
+    map_photos: tuple = ()
+    tool_photos: tuple = ()
+    tool_name: str = ''
+    tool_desc: str = ''
+    # Capture-time data (parallel to photos / pending tool downloads); not rendered or versioned
+    photo_signatures: tuple = ()
+    photo_exif: tuple = ()
+    tool_photo_jobs: tuple = ()
+
+
+@dataclass(slots=True)
+class Report:
+    """Everything needed to produce a report, before translation and compression."""
+    client_name: str
+    general_notes: str = ''
+    report_mode: str = 'standard'
+    defects: list = field(default_factory=list)
+    logo: Optional[PhotoHandle] = None
+    date: str = ''
+    engineer: str = ''
+
+
+@dataclass(slots=True)
+class RenderedDefect:
+    """A defect after the transform stage: translated text, compressed JPEG bytes."""
+    title: str
+    desc: str
+    code: str
+    photos: list
+
+
+@dataclass(slots=True)
+class RenderModel:
+    """Input of the renderers (docx, PDF); holds no file objects."""
+    client_name: str
+    report_mode: str
+    date: str
+    engineer: str
+    logo: Optional[bytes]
+    labels: dict
+    defects: list
+    notes: str
+
+
+def _photo_list(value):
+    if not value:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def normalize_defect(defect: dict) -> dict:
+    """
+    Gives a UI defect dict the canonical keys: 'category' (from 'cat' for the
+    built-in cards), 'photos' (from the legacy single 'photo') and interned
+    category/code strings. Returns a new dict; the input is not modified.
+    """
+    normalized = dict(defect)
+    normalized['category'] = intern_category(defect.get('category') or defect.get('cat'))
+    normalized['code'] = intern_code(defect.get('code'))
+    photos = _photo_list(defect.get('photos'))
+    if not photos and defect.get('photo') is not None:
+        photos = [defect['photo']]
+    normalized['photos'] = photos
+    normalized.setdefault('desc', '')
+    return normalized
+
+
+def defect_from_dict(defect: dict, blobs: storage.BlobStore) -> Defect:
+    """
+    Converts a UI defect dict into a typed Defect with photo handles (the
+    photos are stored in the BlobStore). A Defect is returned as it is.
+    """
+    if isinstance(defect, Defect):
+        return defect
+    d = normalize_defect(defect)
+    handles = lambda files: tuple(PhotoHandle.from_file(f, blobs) for f in _photo_list(files))
+    return Defect(
+        title=d.get('title', 'Defect'),
+        desc=d.get('desc', '') or '',
+        code=d['code'],
+        category=d['category'],
+        mode=sys.intern(d.get('mode') or 'standard'),
+        photos=handles(d['photos']),
+        map_photos=handles(d.get('map_photos')),
+        tool_photos=handles(d.get('tool_photos')),
+        tool_name=d.get('tool_name', '') or '',
+        tool_desc=d.get('tool_desc', '') or '',
+        photo_signatures=tuple(d.get('photo_signatures') or ()),
+        photo_exif=tuple(d.get('photo_exif') or ()),
+        tool_photo_jobs=tuple(d.get('tool_photo_jobs') or ()),
+    )
+
+
+def build_report(client_name, general_notes, defect_list, report_mode='standard', logo_file=None,
+                 engineer='', blobs: storage.BlobStore = None) -> Report:
+    """
+    Stage 1 of the report pipeline: UI input -> typed Report.
+    The deck stores its defects as Defects at capture; dicts (benchmarks,
+    older callers) have their photos stored in the BlobStore here, once
+    (already-checkpointed photos are not re-read).
+    """
+    blobs = blobs or storage.BlobStore()
+    return Report(
+        client_name=client_name,
+        general_notes=general_notes or '',
+        report_mode=report_mode,
+        defects=[defect_from_dict(d, blobs) for d in defect_list or []],
+        logo=PhotoHandle.from_file(logo_file, blobs) if logo_file else None,
+        date=datetime.now().strftime("%Y-%m-%d"),
+        engineer=engineer,
+    )
@@ -0,0 +1,288 @@
+"""
+Shared Resources for FieldScribe
+Process-wide registry of the HTTP connection pools, translator clients,
+worker pools, caches and stores that every Streamlit session on a server
+shares, so sessions start warm instead of each building their own
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.environ.get("FIELDSCRIBE_HTTP_POOL_SIZE", "32"))
+TRANSLATOR_CLIENTS = int(os.environ.get("FIELDSCRIBE_TRANSLATOR_CLIENTS", "16"))
+CPU_WORKERS = int(os.environ.get("FIELDSCRIBE_CPU_WORKERS", str(min(8, os.cpu_count() or 2))))
+IO_WORKERS = int(os.environ.get("FIELDSCRIBE_IO_WORKERS", "32"))
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or total bytes (len of values)."""
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def _size(value):
+        try:
+            return len(value)
+        except TypeError:
+            return 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._data[key] = value
+            self._bytes += self._size(value)
+            while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data), 'bytes': self._bytes,
+                'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ClientPool:
+    """
+    Bounded pool of reusable clients that are not safe to share between
+    threads (e.g. GoogleTranslator keeps per-request state on the instance).
+    At most max_idle clients are kept; extra leases create throwaway clients.
+    """
+
+    def __init__(self, factory, max_idle=TRANSLATOR_CLIENTS):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = self.leases = self.in_use = 0
+
+    @contextmanager
+    def lease(self):
+        with self._lock:
+            client = self._idle.pop() if self._idle else None
+            self.leases += 1
+            self.in_use += 1
+        if client is None:
+            client = self.factory()
+            with self._lock:
+                self.created += 1
+        try:
+            yield client
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(client)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'created': self.created, 'leases': self.leases, 'in_use': self.in_use,
+                    'idle': len(self._idle), 'max_idle': self.max_idle}
+
+
+class HttpPool:
+    """One requests.Session with keep-alive connection pools, shared by every session."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self.requests = self.errors = 0
+        self.seconds = 0.0
+
+    def get(self, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.session.get(url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.requests += 1
+                self.seconds += time.perf_counter() - start
+
+    def close(self):
+        self.session.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': self.requests, 'errors': self.errors, 'pool_size': self.pool_size,
+                    'mean_ms': 1e3 * self.seconds / self.requests if self.requests else 0.0}
+
+
+class SharedExecutor:
+    """Bounded thread pool shared by all sessions; never shut down by callers."""
+
+    def __init__(self, max_workers, name):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"fieldscribe-{name}")
+        self._lock = threading.Lock()
+        self.submitted = self.completed = 0
+
+    def _done(self, _future):
+        with self._lock:
+            self.completed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.submitted += 1
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def map(self, fn, *iterables):
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return (f.result() for f in futures)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'max_workers': self.max_workers, 'submitted': self.submitted,
+                    'pending': self.submitted - self.completed}
+
+
+class ResourceRegistry:
+    """
+    Lazily created, process-wide resources by name. Creation runs once per
+    name (other threads asking for the same name wait for it; different
+    names never block each other).
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._created = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, factory):
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+        with self._lock:
+            name_lock = self._locks.setdefault(name, threading.Lock())
+        with name_lock:
+            resource = self._resources.get(name)
+            if resource is None:
+                start = time.perf_counter()
+                resource = factory()
+                self._created[name] = time.perf_counter() - start
+                self._resources[name] = resource
+                logger.info("Created shared resource %s in %.3fs", name, self._created[name])
+        return resource
+
+    def peek(self, name):
+        return self._resources.get(name)
+
+    def names(self):
+        return sorted(self._resources)
+
+    def stats(self) -> dict:
+        """Per resource: creation time plus the resource's own stats() when it has one."""
+        out = {}
+        for name in self.names():
+            resource = self._resources[name]
+            entry = {'type': type(resource).__name__, 'init_seconds': round(self._created.get(name, 0.0), 4)}
+            if hasattr(resource, 'stats'):
+                try:
+                    entry.update(resource.stats())
+                except Exception as e:
+                    entry['error'] = str(e)
+            out[name] = entry
+        return out
+
+    def close(self) -> None:
+        """Shuts down pools and connections (process exit / tests)."""
+        for name in self.names():
+            resource = self._resources.pop(name, None)
+            for method in ('shutdown', 'close'):
+                if hasattr(resource, method):
+                    try:
+                        getattr(resource, method)()
+                    except Exception as e:
+                        logger.warning("Closing %s failed: %s", name, e)
+                    break
+
+
+_registry = ResourceRegistry()
+
+
+def get_registry() -> ResourceRegistry:
+    return _registry
+
+
+def shared(name, factory):
+    """Returns the process-wide resource name, creating it with factory() on first use."""
+    return _registry.get(name, factory)
+
+
+# --- WELL-KNOWN RESOURCES ---
+def http() -> HttpPool:
+    return shared('http', HttpPool)
+
+
+def executor(kind: str) -> SharedExecutor:
+    """'cpu' for image work (sized to the cores), 'io' for network-bound calls."""
+    workers = CPU_WORKERS if kind == 'cpu' else IO_WORKERS
+    return shared(f'executor:{kind}', lambda: SharedExecutor(workers, kind))
+
+
+def cache(name: str, max_entries=None, max_bytes=None) -> LRUCache:
+    return shared(f'cache:{name}', lambda: LRUCache(max_entries=max_entries, max_bytes=max_bytes))
+
+
+def translators(source: str, target: str) -> ClientPool:
+    def factory():
+        from deep_translator import GoogleTranslator
+        return GoogleTranslator(source=source, target=target)
+    return shared(f'translator:{source}:{target}', lambda: ClientPool(factory))
@@ -0,0 +1,297 @@
+"""
+Standards Catalogue for FieldScribe
+Handles ingestion of SI (Israeli Standards) PDFs into a compact on-disk
+catalogue of clause ids, titles and text, and the standards search used by
+the inspection deck
+
+    python -m standards data/standards_pdfs --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import resources
+import storage
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+STANDARDS_DIR = os.environ.get("FIELDSCRIBE_STANDARDS_DIR", os.path.join(storage.DATA_DIR, "standards_pdfs"))
+CATALOGUE_PATH = os.environ.get("FIELDSCRIBE_STANDARDS_CATALOGUE",
+                                os.path.join(storage.DATA_DIR, "standards_catalogue.bin"))
+CATALOGUE_VERSION = 1
+MAX_CLAUSE_CHARS = 4000
+SEARCH_LIMIT = 50
+
+# Used until a catalogue has been ingested
+BUILTIN_STANDARDS = [
+    ("SI-1142", "Guardrails", "Height requirements for guardrails"),
+    ("SI-1205", "Plumbing", "Pipe fitting leakage standards"),
+    ("SI-1555", "Tiling", "Cracked tile detection"),
+    ("SI-1752", "Partition Walls", "Moisture levels"),
+    ("SI-1928", "Painting", "Paint adhesion standards"),
+    ("SI-900", "Electrical", "Exposed wiring regulations"),
+    ("SI-2100", "Structural", "Load bearing requirements"),
+    ("SI-3050", "Safety", "Emergency exit standards"),
+    ("SI-4100", "Finishing", "Surface finish quality"),
+    ("SI-5200", "HVAC", "Ventilation requirements"),
+]
+
+# "SI 1142", "SI-1142 part 2", "ת"י 1142 חלק 2"
+_STANDARD_RE = re.compile(r"(?:\bSI|ת[\"״']י)\s*[-–]?\s*(\d{2,5})(?:\s*(?:[Pp]art|חלק)\s*(\d{1,2}))?")
+# A clause heading: "4.2.1 Height of guardrails" (a number, then a short title that starts with a letter)
+_CLAUSE_RE = re.compile(r"^\s*(\d{1,2}(?:\.\d{1,3}){0,4})\.?\s+([^\W\d_][^\n]{1,119})$")
+
+
+# --- EXTRACTION (runs in worker processes) ---
+def standard_id(text: str):
+    """'SI-1142' / 'SI-1142-2' for the first standard number in text, or None."""
+    m = _STANDARD_RE.search(text or '')
+    if not m:
+        return None
+    return f"SI-{m.group(1)}" + (f"-{m.group(2)}" if m.group(2) else "")
+
+
+def split_clauses(text: str):
+    """[clause id, title, text] for every clause heading in the text, in order."""
+    clauses, current, body = [], None, []
+
+    def close():
+        if current is not None:
+            current.append(re.sub(r"\s+", " ", " ".join(body)).strip()[:MAX_CLAUSE_CHARS])
+            clauses.append(current)
+
+    for line in text.splitlines():
+        m = _CLAUSE_RE.match(line)
+        if m and not m.group(2).rstrip().endswith(('.', ',', ';')):
+            close()
+            current, body = [m.group(1), m.group(2).strip()], []
+        elif current is not None:
+            body.append(line)
+    close()
+    return clauses
+
+
+def parse_pdf(path: str) -> dict:
+    """Extracts a standard's id, title and clauses from one PDF."""
+    reader = PdfReader(path)
+    text = "\n".join(page.extract_text() or '' for page in reader.pages)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    name = os.path.splitext(os.path.basename(path))[0]
+    sid = standard_id(name) or standard_id("\n".join(lines[:20])) or name
+
+    title = (reader.metadata.title if reader.metadata and reader.metadata.title else '') or ''
+    if title.strip().lower() == 'untitled':  # reportlab's default
+        title = ''
+    if not title:
+        # First line after the one naming the standard that is not itself a clause
+        for i, line in enumerate(lines[:20]):
+            if standard_id(line):
+                title = next((l for l in lines[i + 1:i + 4] if not _CLAUSE_RE.match(l)), '')
+                break
+    return {'standard': sid, 'title': title[:200], 'pages': len(reader.pages), 'clauses': split_clauses(text)}
+
+
+def _parse_job(path):
+    start = time.perf_counter()
+    try:
+        return path, parse_pdf(path), None, time.perf_counter() - start
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+
+# --- CATALOGUE FILE ---
+def _dumps(obj) -> bytes:
+    if MSGPACK_AVAILABLE:
+        return b'M' + zlib.compress(msgpack.packb(obj, use_bin_type=True), 9)
+    return b'J' + zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _loads(data: bytes):
+    payload = zlib.decompress(data[1:])
+    if data[:1] == b'M':
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload.decode('utf-8'))
+
+
+def read_catalogue(path=None) -> dict:
+    """{'version', 'documents': {file name: {sha256, standard, title, pages, clauses}}}; empty if missing."""
+    path = path or CATALOGUE_PATH
+    try:
+        with open(path, 'rb') as f:
+            catalogue = _loads(f.read())
+        if catalogue.get('version') == CATALOGUE_VERSION:
+            return catalogue
+        logger.info("Standards catalogue %s has an old version; rebuilding", path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Standards catalogue %s unreadable (%s); rebuilding", path, e)
+    return {'version': CATALOGUE_VERSION, 'documents': {}}
+
+
+def write_catalogue(catalogue: dict, path=None) -> None:
+    path = path or CATALOGUE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_dumps(catalogue))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ingest(folder=None, catalogue_path=None, workers=None) -> dict:
+    """
+    Brings the catalogue in line with the PDFs in folder: new or changed files
+    (by content hash) are parsed in parallel worker processes, unchanged ones
+    are kept as they are and deleted ones are dropped. Returns a summary.
+    """
+    if not PYPDF_AVAILABLE:
+        raise RuntimeError("Standards ingestion requires pypdf (pip install pypdf)")
+    folder = folder or STANDARDS_DIR
+    catalogue = read_catalogue(catalogue_path)
+    documents = catalogue['documents']
+
+    pdfs = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                path = os.path.join(root, name)
+                pdfs[os.path.relpath(path, folder)] = path
+    hashes = {rel: _file_sha256(path) for rel, path in pdfs.items()}
+
+    changed = [rel for rel in sorted(pdfs) if documents.get(rel, {}).get('sha256') != hashes[rel]]
+    removed = [rel for rel in documents if rel not in pdfs]
+    for rel in removed:
+        del documents[rel]
+
+    summary = {'files': len(pdfs), 'parsed': 0, 'unchanged': len(pdfs) - len(changed), 'removed': len(removed),
+               'failed': [], 'clauses': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    if changed:
+        by_path = {pdfs[rel]: rel for rel in changed}
+        with ProcessPoolExecutor(max_workers=workers or resources.CPU_WORKERS) as pool:
+            for path, record, error, seconds in pool.map(_parse_job, list(by_path)):
+                rel = by_path[path]
+                if error:
+                    logger.warning("Could not parse %s: %s", rel, error)
+                    summary['failed'].append(rel)
+                    documents.pop(rel, None)
+                    continue
+                record['sha256'] = hashes[rel]
+                documents[rel] = record
+                summary['parsed'] += 1
+                logger.info("Parsed %s (%s, %d clauses) in %.2fs", rel, record['standard'],
+                            len(record['clauses']), seconds)
+    if changed or removed or not os.path.exists(catalogue_path or CATALOGUE_PATH):
+        write_catalogue(catalogue, catalogue_path)
+    summary['clauses'] = sum(len(d['clauses']) for d in documents.values())
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+# --- SEARCH ---
+@dataclass(slots=True, frozen=True)
+class StandardEntry:
+    """One searchable line: a whole standard (clause '') or one of its clauses."""
+    code: str
+    clause: str
+    title: str
+    text: str = ''
+
+    @property
+    def label(self) -> str:
+        if self.clause:
+            return f"{self.code} §{self.clause} - {self.title}"
+        return f"{self.code} - {self.title}"
+
+
+class StandardsCatalogue:
+    """In-memory search index over the catalogue (lowercased haystacks built once)."""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._haystacks = [f"{e.code} {e.clause} {e.title} {e.text}".casefold() for e in self.entries]
+
+    @classmethod
+    def load(cls, path=None) -> 'StandardsCatalogue':
+        start = time.perf_counter()
+        documents = read_catalogue(path)['documents']
+        if not documents:
+            return cls(StandardEntry(code, '', f"({topic}) {title}") for code, topic, title in BUILTIN_STANDARDS)
+        entries = []
+        for doc in sorted(documents.values(), key=lambda d: d['standard']):
+            entries.append(StandardEntry(doc['standard'], '', doc['title'] or doc['standard']))
+            entries.extend(StandardEntry(doc['standard'], cid, title, text) for cid, title, text in doc['clauses'])
+        logger.info("Loaded %d standards entries in %.3fs", len(entries), time.perf_counter() - start)
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT):
+        """Entries containing every word of the query; code/title matches first."""
+        words = query.casefold().split()
+        if not words:
+            return []
+        hits = []
+        for entry, haystack in zip(self.entries, self._haystacks):
+            if all(w in haystack for w in words):
+                head = f"{entry.code} {entry.clause} {entry.title}".casefold()
+                hits.append((not all(w in head for w in words), entry))
+        hits.sort(key=lambda h: h[0])
+        return [entry for _, entry in hits[:limit]]
+
+
+def get_catalogue() -> StandardsCatalogue:
+    """Returns the process-wide catalogue, loaded on first use."""
+    return resources.shared('standards_catalogue', StandardsCatalogue.load)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest SI standards PDFs into the FieldScribe catalogue")
+    parser.add_argument("folder", nargs="?", default=STANDARDS_DIR)
+    parser.add_argument("--catalogue", default=CATALOGUE_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    summary = ingest(args.folder, args.catalogue, args.workers)
+    print(f"{summary['files']} PDFs: {summary['parsed']} parsed, {summary['unchanged']} unchanged, "
+          f"{summary['removed']} removed, {len(summary['failed'])} failed; "
+          f"{summary['clauses']} clauses in {args.catalogue} ({summary['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
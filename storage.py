@@ -0,0 +1,520 @@
+"""
+Persistent Storage for FieldScribe
+Handles the user registry, the generated report files linked to each user
+and the deduplicated archive of generated reports
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from datetime import date
+
+import resources
+
+logger = logging.getLogger(__name__)
+
+# All on-disk state lives under one folder so it can be backed up or wiped in one go.
+DATA_DIR = os.environ.get(
+    "FIELDSCRIBE_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+DB_PATH = os.path.join(DATA_DIR, "fieldscribe.db")
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+
+# Attribute used to remember a file object's blob digest so it is only hashed once
+BLOB_ATTR = '_fieldscribe_blob'
+
+# Zip members that are already compressed are stored as-is when a report is rebuilt
+_PRECOMPRESSED_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.gif', '.emf', '.wmf')
+# Rebuilt reports kept in memory for repeated downloads (bytes, across sessions)
+REPORT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Demo roster used to seed an empty registry (sizes are real byte counts now)
+DEMO_USERS = [
+    {
+        'id': 'user1', 'name': 'John Smith', 'email': 'john.smith@example.com', 'role': 'Engineer',
+        'files': [{'name': 'Inspection_Report_2024_01.docx', 'date': '2024-01-15', 'size_bytes': 2411724}]
+    },
+    {
+        'id': 'user2', 'name': 'Sarah Johnson', 'email': 'sarah.j@example.com', 'role': 'Senior Inspector',
+        'files': [{'name': 'Building_Inspection_2024_02.docx', 'date': '2024-02-20', 'size_bytes': 3250586}]
+    },
+    {
+        'id': 'user3', 'name': 'Michael Chen', 'email': 'm.chen@example.com', 'role': 'Field Engineer',
+        'files': [{'name': 'Property_Inspection_2024_03.docx', 'date': '2024-03-10', 'size_bytes': 3040870}]
+    },
+]
+
+
+def connect(db_path=None):
+    """
+    Opens a SQLite connection shared between Streamlit script threads.
+    WAL mode lets the dashboard read while a report is being recorded;
+    foreign keys are enforced (SQLite leaves them off per connection), so
+    ON DELETE CASCADE really removes child rows.
+    """
+    db_path = db_path or DB_PATH
+    if db_path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys=ON")
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.DatabaseError:
+        pass
+    return conn
+
+
+class UserRegistry:
+    """
+    Users and their generated report files, backed by SQLite.
+
+    Name, email and role are indexed case-insensitively so prefix search stays
+    fast with hundreds of users, and file listings are paginated per user so the
+    dashboard only ever loads the rows it renders.
+    """
+
+    def __init__(self, db_path=None):
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id      TEXT PRIMARY KEY,
+                    name    TEXT NOT NULL COLLATE NOCASE,
+                    email   TEXT NOT NULL COLLATE NOCASE,
+                    role    TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+                    created TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_users_name  ON users(name);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email);
+                CREATE INDEX IF NOT EXISTS idx_users_role  ON users(role);
+
+                CREATE TABLE IF NOT EXISTS files (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id    TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    name       TEXT NOT NULL,
+                    created    TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    client     TEXT NOT NULL DEFAULT '',
+                    report_id  INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_user ON files(user_id, created DESC, id DESC);
+            """)
+            columns = {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}
+            if 'report_id' not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN report_id INTEGER")
+
+    # --- USERS ---
+    def add_user(self, user_id: str, name: str, email: str, role: str = '') -> None:
+        """Inserts or updates a user."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO users (id, name, email, role, created) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name=excluded.name, email=excluded.email, role=excluded.role",
+                (user_id, name, email, role, date.today().isoformat())
+            )
+
+    def get_user(self, user_id: str):
+        """Returns the user as a dict, or None if it does not exist."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_email(self, email: str):
+        """Exact (case-insensitive) lookup by email."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return dict(row) if row else None
+
+    def count_users(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def list_roles(self) -> list:
+        """Distinct roles, read straight from the role index."""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT role FROM users ORDER BY role").fetchall()
+        return [r[0] for r in rows if r[0]]
+
+    def search_users(self, query: str = '', role: str = None, page: int = 0, page_size: int = 20):
+        """
+        Prefix search over name, email and role.
+
+        Returns (users, total) where users holds at most page_size dicts for the
+        requested zero-based page and total is the number of matches.
+        """
+        clauses, params = [], []
+        query = (query or '').strip()
+        if query:
+            # Escape LIKE wildcards so user input is always a literal prefix
+            prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append("(name LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\' OR role LIKE ? ESCAPE '\\')")
+            params.extend([prefix, prefix, prefix])
+        if role:
+            clauses.append("role = ?")
+            params.append(role)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT u.*, (SELECT COUNT(*) FROM files f WHERE f.user_id = u.id) AS file_count "
+                f"FROM users u {where} ORDER BY name, id LIMIT ? OFFSET ?",
+                params + [page_size, max(page, 0) * page_size]
+            ).fetchall()
+        return [dict(r) for r in rows], total
+
+    # --- FILES ---
+    def add_file(self, user_id: str, name: str, size_bytes: int, created: str = None, client: str = '',
+                 report_id: int = None) -> int:
+        """
+        Links a generated report file to a user and returns the new file id.
+        report_id points into the ReportArchive when the file can be re-downloaded.
+        """
+        created = created or date.today().isoformat()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO files (user_id, name, created, size_bytes, client, report_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, name, created, int(size_bytes), client or '', report_id)
+            )
+        return cur.lastrowid
+
+    def list_files(self, user_id: str, page: int = 0, page_size: int = 20):
+        """Returns (files, total) for one user, newest first."""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM files WHERE user_id = ?", (user_id,)).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT * FROM files WHERE user_id = ? ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                (user_id, page_size, max(page, 0) * page_size)
+            ).fetchall()
+        return [dict(r) for r in rows], total
+
+    def seed_demo_users(self) -> None:
+        """Fills an empty registry with the demo roster."""
+        if self.count_users():
+            return
+        for user in DEMO_USERS:
+            self.add_user(user['id'], user['name'], user['email'], user['role'])
+            for f in user['files']:
+                self.add_file(user['id'], f['name'], f['size_bytes'], created=f['date'])
+
+
+class BlobStore:
+    """
+    Content-addressed file store: every blob is saved once under its SHA-256.
+
+    Blobs are sharded into sub-folders by the first two hex digits so no single
+    directory grows too large. Writes go through a temp file and an atomic
+    rename, so a crash never leaves a half-written blob behind.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or BLOB_DIR
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, data: bytes) -> str:
+        """Stores data (if not already present) and returns its digest."""
+        digest = self.digest(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return digest
+
+    def put_file(self, file_obj) -> str:
+        """
+        Stores the contents of a file-like object (UploadedFile, BytesIO) and
+        returns its digest. The digest is remembered on the object, so the same
+        photo is only read and hashed once however often it is stored.
+        """
+        digest = getattr(file_obj, BLOB_ATTR, None)
+        if digest is not None and self.exists(digest):
+            return digest
+        if hasattr(file_obj, 'getvalue'):
+            data = file_obj.getvalue()
+        else:
+            file_obj.seek(0)
+            data = file_obj.read()
+        digest = self.put(data)
+        try:
+            setattr(file_obj, BLOB_ATTR, digest)
+        except AttributeError:
+            pass
+        return digest
+
+    def open(self, digest: str):
+        """Opens a blob for streaming reads."""
+        return open(self.path(digest), 'rb')
+
+    def read(self, digest: str) -> bytes:
+        with self.open(digest) as f:
+            return f.read()
+
+    def size(self, digest: str) -> int:
+        """Stored size of a blob in bytes (0 if it is missing)."""
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError:
+            return 0
+
+
+class ReportArchive:
+    """
+    Archive of every generated .docx report.
+
+    A .docx is a zip; each member is stored in the BlobStore under its content
+    hash, so logos and photos that reappear across reports are kept only once.
+    Reports are indexed by client and date and rebuilt on demand from disk.
+    """
+
+    def __init__(self, db_path=None, blobs: BlobStore = None):
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._db_path = db_path or DB_PATH
+        self.blobs = blobs or BlobStore()
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id    TEXT,
+                    client     TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+                    created    TEXT NOT NULL,
+                    file_name  TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_reports_client  ON reports(client, created);
+                CREATE INDEX IF NOT EXISTS idx_reports_created ON reports(created);
+
+                CREATE TABLE IF NOT EXISTS report_parts (
+                    report_id     INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+                    seq           INTEGER NOT NULL,
+                    name          TEXT NOT NULL,
+                    digest        TEXT NOT NULL,
+                    compress_type INTEGER NOT NULL,
+                    PRIMARY KEY (report_id, seq)
+                );
+                CREATE INDEX IF NOT EXISTS idx_report_parts_digest ON report_parts(digest);
+            """)
+
+    def archive(self, buffer, file_name: str, client: str = '', user_id: str = None, created: str = None) -> int:
+        """
+        Splits a generated report into content-addressed parts and records it.
+
+        buffer is any seekable file-like object holding the .docx (the BytesIO
+        returned by process_report). Its position is restored afterwards so the
+        same buffer can still be handed to st.download_button.
+        """
+        created = created or date.today().isoformat()
+        start = buffer.tell()
+        buffer.seek(0, os.SEEK_END)
+        size_bytes = buffer.tell()
+        buffer.seek(0)
+
+        parts = []
+        with zipfile.ZipFile(buffer) as zf:
+            for seq, info in enumerate(zf.infolist()):
+                digest = self.blobs.put(zf.read(info))
+                parts.append((seq, info.filename, digest, info.compress_type))
+        buffer.seek(start)
+
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO reports (user_id, client, created, file_name, size_bytes) VALUES (?, ?, ?, ?, ?)",
+                (user_id, client or '', created, file_name, size_bytes)
+            )
+            report_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO report_parts (report_id, seq, name, digest, compress_type) VALUES (?, ?, ?, ?, ?)",
+                [(report_id,) + part for part in parts]
+            )
+        logger.info("Archived report %s (%s, %d parts)", report_id, file_name, len(parts))
+        return report_id
+
+    def get_report(self, report_id: int):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_reports(self, client: str = None, since: str = None, until: str = None,
+                     page: int = 0, page_size: int = 20):
+        """
+        Returns (reports, total) filtered by client and an inclusive
+        YYYY-MM-DD date range, newest first.
+        """
+        clauses, params = [], []
+        if client:
+            clauses.append("client = ?")
+            params.append(client)
+        if since:
+            clauses.append("created >= ?")
+            params.append(since)
+        if until:
+            clauses.append("created <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM reports {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM reports {where} ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                params + [page_size, max(page, 0) * page_size]
+            ).fetchall()
+        return [dict(r) for r in rows], total
+
+    def open_report(self, report_id: int):
+        """
+        Rebuilds an archived report from its blobs and returns a file object
+        positioned at the start. Small reports stay in memory, large ones spill
+        to a temporary file, so the whole report is never held twice.
+        """
+        with self._lock:
+            parts = self._conn.execute(
+                "SELECT name, digest, compress_type FROM report_parts WHERE report_id = ? ORDER BY seq",
+                (report_id,)
+            ).fetchall()
+        if not parts:
+            raise KeyError(f"Report {report_id} is not in the archive")
+
+        out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        with zipfile.ZipFile(out, 'w') as zf:
+            for name, digest, compress_type in parts:
+                info = zipfile.ZipInfo(name)
+                info.compress_type = (zipfile.ZIP_STORED if name.lower().endswith(_PRECOMPRESSED_EXTENSIONS)
+                                      else compress_type)
+                with self.blobs.open(digest) as src, zf.open(info, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        out.seek(0)
+        return out
+
+    def report_bytes(self, report_id: int) -> bytes:
+        """
+        The archived report as bytes, for st.download_button (which does not
+        accept file objects). Rebuilt once per report and cached by id, since
+        archived reports never change.
+        """
+        cache = resources.cache('archived_reports', max_bytes=REPORT_CACHE_BYTES)
+        key = (self._db_path, report_id)
+        data = cache.get(key)
+        if data is None:
+            with self.open_report(report_id) as f:
+                data = f.read()
+            cache.put(key, data)
+        return data
+
+    def read_part(self, report_id: int, name: str):
+        """Bytes of one member of an archived report (e.g. 'word/document.xml'), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM report_parts WHERE report_id = ? AND name = ?", (report_id, name)
+            ).fetchone()
+        if row is None or not self.blobs.exists(row[0]):
+            return None
+        return self.blobs.read(row[0])
+
+    def storage_stats(self) -> dict:
+        """Logical vs. deduplicated size of the archive, in bytes."""
+        with self._lock:
+            logical = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM reports").fetchone()[0]
+            digests = [r[0] for r in self._conn.execute("SELECT DISTINCT digest FROM report_parts")]
+        stored = sum(os.path.getsize(self.blobs.path(d)) for d in digests if self.blobs.exists(d))
+        return {'reports_bytes': logical, 'blob_bytes': stored, 'blob_count': len(digests)}
+
+
+class TranslationCache:
+    """
+    Persistent (source text, target language) -> translation lookups, with a
+    bounded in-memory LRU in front so hot strings skip SQLite.
+    """
+
+    MEMORY_ENTRIES = 20000
+
+    def __init__(self, db_path=None):
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._memory = resources.LRUCache(max_entries=self.MEMORY_ENTRIES)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    source     TEXT NOT NULL,
+                    target     TEXT NOT NULL,
+                    translated TEXT NOT NULL,
+                    PRIMARY KEY (source, target)
+                ) WITHOUT ROWID
+            """)
+
+    def get(self, text: str, target: str):
+        cached = self._memory.get((text, target))
+        if cached is not None:
+            return cached
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translated FROM translations WHERE source = ? AND target = ?", (text, target)
+            ).fetchone()
+        if row is None:
+            return None
+        self._memory.put((text, target), row[0])
+        return row[0]
+
+    def put(self, text: str, target: str, translated: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (source, target, translated) VALUES (?, ?, ?)",
+                (text, target, translated)
+            )
+        self._memory.put((text, target), translated)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {'rows': rows, **{f'memory_{k}': v for k, v in self._memory.stats().items()}}
+
+
+def _seeded_registry() -> UserRegistry:
+    registry = UserRegistry()
+    registry.seed_demo_users()
+    return registry
+
+
+def get_user_registry() -> UserRegistry:
+    """Returns the process-wide registry, creating and seeding it on first use."""
+    return resources.shared('user_registry', _seeded_registry)
+
+
+def get_report_archive() -> ReportArchive:
+    """Returns the process-wide report archive."""
+    return resources.shared('report_archive', ReportArchive)
+
+
+def get_translation_cache() -> TranslationCache:
+    """Returns the process-wide translation cache."""
+    return resources.shared('translation_cache', TranslationCache)
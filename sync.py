@@ -0,0 +1,454 @@
+"""
+Background Sync for FieldScribe
+Handles the offline work queue for operations that need the network and the
+worker thread that drains it once connectivity returns
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from deep_translator.exceptions import RequestError, TooManyRequests
+
+import glossary
+import report_model
+import resources
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Endpoints are configurable so the worker can be pointed at a local stand-in server
+WIKIMEDIA_API_URL = os.environ.get("FIELDSCRIBE_WIKIMEDIA_URL", "https://commons.wikimedia.org/w/api.php")
+HTTP_TIMEOUT = float(os.environ.get("FIELDSCRIBE_HTTP_TIMEOUT", "10"))
+
+# Job states
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class TransientError(Exception):
+    """A failure worth retrying later (no connectivity, timeout, server error)."""
+
+
+class PermanentError(Exception):
+    """A failure that retrying will not fix (bad request, missing resource)."""
+
+
+def _raise_for_status(response):
+    if response.status_code >= 500 or response.status_code == 429:
+        raise TransientError(f"HTTP {response.status_code}")
+    if response.status_code >= 400:
+        raise PermanentError(f"HTTP {response.status_code}")
+
+
+# --- NETWORK OPERATIONS ---
+def search_wikimedia_images(query: str, limit: int = 8, api_url: str = None):
+    """
+    Searches Wikimedia Commons for images.
+    Returns a list of {'thumb', 'full'} dicts; raises TransientError when offline.
+    """
+    if not query or not query.strip():
+        return []
+    params = {
+        "action": "query", "format": "json", "generator": "search",
+        "gsrsearch": query, "gsrlimit": str(limit), "gsrnamespace": "6",
+        "prop": "imageinfo", "iiprop": "url", "iiurlwidth": "400"
+    }
+    try:
+        r = resources.http().get(api_url or WIKIMEDIA_API_URL, params=params, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise TransientError(str(e)) from e
+    _raise_for_status(r)
+    try:
+        data = r.json()
+    except ValueError as e:
+        raise TransientError(f"Invalid response: {e}") from e
+
+    pages = data.get("query", {}).get("pages", {})
+    results = []
+    for _, p in pages.items():
+        infos = p.get("imageinfo", [])
+        if not infos: continue
+        info = infos[0]
+        thumb = info.get("thumburl")
+        full = info.get("url")
+        if thumb and full: results.append({"thumb": thumb, "full": full})
+    return results
+
+
+def fetch_image(url: str, blobs: storage.BlobStore = None) -> str:
+    """Downloads an image into the blob store and returns its digest."""
+    try:
+        r = resources.http().get(url, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise TransientError(str(e)) from e
+    _raise_for_status(r)
+    return (blobs or storage.BlobStore()).put(r.content)
+
+
+def translate_text(text: str, target: str = 'ar') -> str:
+    try:
+        # GoogleTranslator keeps request state on the instance: lease one per call
+        with resources.translators('auto', target).lease() as client:
+            return client.translate(text)
+    except (requests.RequestException, RequestError, TooManyRequests) as e:
+        raise TransientError(str(e)) from e
+
+
+class WorkQueue:
+    """
+    Persistent queue of operations waiting for the network (SQLite-backed).
+
+    Jobs survive restarts; anything left 'running' by a crashed worker goes
+    back to 'pending' when the queue is opened.
+    """
+
+    def __init__(self, db_path=None):
+        self._conn = storage.connect(db_path)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind         TEXT NOT NULL,
+                    payload      TEXT NOT NULL,
+                    status       TEXT NOT NULL DEFAULT 'pending',
+                    attempts     INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL DEFAULT 0,
+                    last_error   TEXT,
+                    result       TEXT,
+                    created      REAL NOT NULL,
+                    updated      REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt, id);
+            """)
+            self._conn.execute("UPDATE outbox SET status = ? WHERE status = ?", (PENDING, RUNNING))
+
+    def enqueue(self, kind: str, payload: dict, unique: bool = False) -> int:
+        """
+        Records an operation and returns its job id. Never touches the network.
+        With unique=True an identical job still pending or running is reused.
+        """
+        now = time.time()
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        with self._changed, self._conn:
+            if unique:
+                row = self._conn.execute(
+                    "SELECT id FROM outbox WHERE status IN (?, ?) AND kind = ? AND payload = ? LIMIT 1",
+                    (PENDING, RUNNING, kind, encoded)
+                ).fetchone()
+                if row is not None:
+                    return row[0]
+            cur = self._conn.execute(
+                "INSERT INTO outbox (kind, payload, created, updated) VALUES (?, ?, ?, ?)",
+                (kind, encoded, now, now)
+            )
+            self._changed.notify_all()
+        return cur.lastrowid
+
+    def claim(self, now: float = None):
+        """Marks the next due job as running and returns it, or None."""
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt, id LIMIT 1",
+                (PENDING, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE outbox SET status = ?, updated = ? WHERE id = ?", (RUNNING, now, row['id']))
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def next_due(self):
+        """Timestamp of the earliest pending job, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = ?", (PENDING,)).fetchone()
+        return row[0]
+
+    def _finish(self, job_id: int, **fields):
+        fields['updated'] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._changed, self._conn:
+            self._conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+            self._changed.notify_all()
+
+    def complete(self, job_id: int, result) -> None:
+        self._finish(job_id, status=DONE, result=json.dumps(result, ensure_ascii=False), last_error=None)
+
+    def retry(self, job_id: int, attempts: int, delay: float, error: str) -> None:
+        self._finish(job_id, status=PENDING, attempts=attempts, next_attempt=time.time() + delay, last_error=error)
+
+    def fail(self, job_id: int, attempts: int, error: str) -> None:
+        self._finish(job_id, status=FAILED, attempts=attempts, last_error=error)
+
+    def get(self, job_id: int):
+        """Returns the job (with decoded payload and result) or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def wait(self, job_id: int, timeout: float):
+        """Blocks up to timeout seconds for a job to finish; returns the job."""
+        deadline = time.time() + timeout
+        job = self.get(job_id)
+        while job and job['status'] in (PENDING, RUNNING):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            with self._changed:
+                self._changed.wait(min(remaining, 0.25))
+            job = self.get(job_id)
+        return job
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def purge_finished(self, older_than: float = 7 * 24 * 3600) -> int:
+        """Deletes finished jobs older than the given age (seconds)."""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM outbox WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, time.time() - older_than)
+            )
+        return cur.rowcount
+
+
+class SyncWorker:
+    """
+    Daemon thread that drains the WorkQueue.
+
+    A TransientError puts the whole worker into backoff (exponential with
+    jitter) because the next job would almost certainly fail the same way;
+    PermanentError or too many attempts fails the job for good.
+    """
+
+    def __init__(self, queue: WorkQueue, handlers: dict, base_delay: float = 2.0,
+                 max_delay: float = 300.0, max_attempts: int = 10):
+        self.queue = queue
+        self.handlers = handlers
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.online = True
+        self.offline_until = 0.0
+        self._failures = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="fieldscribe-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self, force: bool = False):
+        """Nudges the worker after an enqueue; force=True also ends the current backoff."""
+        if force:
+            self.offline_until = 0.0
+        self._wake.set()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def run_once(self) -> bool:
+        """Processes at most one due job. Returns True if a job was handled."""
+        if time.time() < self.offline_until:
+            return False
+        job = self.queue.claim()
+        if job is None:
+            return False
+
+        attempts = job['attempts'] + 1
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.queue.fail(job['id'], attempts, f"No handler for {job['kind']}")
+            return True
+        try:
+            result = handler(**job['payload'])
+        except TransientError as e:
+            self._failures += 1
+            delay = self._backoff(self._failures)
+            self.online = False
+            self.offline_until = time.time() + delay
+            if attempts >= self.max_attempts:
+                self.queue.fail(job['id'], attempts, str(e))
+            else:
+                self.queue.retry(job['id'], attempts, delay, str(e))
+            logger.info("Sync offline (%s); retrying in %.1fs", e, delay)
+        except Exception as e:
+            self.queue.fail(job['id'], attempts, str(e))
+            logger.warning("Sync job %s (%s) failed: %s", job['id'], job['kind'], e)
+        else:
+            self._failures = 0
+            self.online = True
+            self.queue.complete(job['id'], result)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.exception("Sync worker error: %s", e)
+            # Sleep until the next job is due, the backoff ends, or something is enqueued
+            now = time.time()
+            next_due = self.queue.next_due()
+            wake_at = max(self.offline_until, next_due if next_due is not None else now + 30)
+            self._wake.wait(max(0.05, min(wake_at - now, 30)))
+            self._wake.clear()
+
+
+# --- APP WIRING ---
+def default_handlers(blobs: storage.BlobStore = None, translations=None) -> dict:
+    """Job kinds the app enqueues, mapped to their network operations."""
+    blobs = blobs or storage.BlobStore()
+
+    def _translate(text, target='ar'):
+        translated = translate_text(text, target)
+        if translations is not None and translated:
+            translations.put(text, target, translated)
+        return translated
+
+    return {
+        'wikimedia_search': lambda query, limit=8: search_wikimedia_images(query, limit),
+        'fetch_image': lambda url: {'blob': fetch_image(url, blobs)},
+        'translate': _translate,
+    }
+
+
+def prefetch_translations(texts, targets=('ar',)) -> int:
+    """
+    Queues background translation, into each target language, of the free
+    text (whatever the glossary does not cover) not yet in the translation
+    cache, so report generation later finds it locally. A fragment already
+    waiting in the queue is not queued twice. Returns the number of fragments
+    waiting for the network.
+    """
+    cache = storage.get_translation_cache()
+    terms = glossary.get_glossary()
+    queued = 0
+    for target in dict.fromkeys(targets):
+        for text in texts:
+            if not text or not text.strip():
+                continue
+            for fragment in dict.fromkeys(terms.match(text, target).leftover):
+                if cache.get(fragment, target) is None:
+                    submit_once('translate', text=fragment, target=target)
+                    queued += 1
+    return queued
+
+
+def cached_translator(cache=None, worker: SyncWorker = None, terms: glossary.Glossary = None):
+    """
+    Builds the translate(text, target) callable used by process_report.
+
+    Glossary terms are translated locally (see glossary.py); only the
+    leftover free text is looked up in the cache and, on a miss, sent to the
+    remote service while the worker believes we are online. Otherwise (or on
+    a network error) those fragments are queued for later and stay
+    untranslated in the result.
+    """
+    cache = cache or storage.get_translation_cache()
+    worker = worker or get_sync_worker()
+    terms = terms or glossary.get_glossary()
+
+    def remote(fragment, target):
+        cached = cache.get(fragment, target)
+        if cached is not None:
+            return cached
+        if worker.online:
+            try:
+                translated = translate_text(fragment, target)
+            except TransientError:
+                worker.online = False
+            except Exception as e:
+                logger.warning("Translation failed, keeping source text: %s", e)
+                return fragment
+            else:
+                if translated:
+                    cache.put(fragment, target, translated)
+                    return translated
+                return fragment
+        submit_once('translate', text=fragment, target=target)
+        return fragment
+
+    def translate(text, target='ar'):
+        return terms.translate(text, target, remote=remote)
+
+    return translate
+
+
+def resolve_pending_photos(defects, queue: WorkQueue, blobs: storage.BlobStore = None):
+    """
+    Returns (defects, pending) where each Defect's finished tool_photo_jobs
+    downloads have been appended to its tool_photos (as handles: the worker
+    already stored them in the BlobStore), and pending counts the downloads
+    still waiting for the network. The input Defects are not modified.
+    """
+    blobs = blobs or storage.BlobStore()
+    resolved, pending = [], 0
+    for defect in defects:
+        if not defect.tool_photo_jobs:
+            resolved.append(defect)
+            continue
+        tool_photos = list(defect.tool_photos)
+        for job_id in defect.tool_photo_jobs:
+            job = queue.get(job_id)
+            if job and job['status'] == DONE and job['result'] and blobs.exists(job['result']['blob']):
+                tool_photos.append(report_model.PhotoHandle(job['result']['blob']))
+            elif job and job['status'] in (PENDING, RUNNING):
+                pending += 1
+        resolved.append(dataclasses.replace(defect, tool_photos=tuple(tool_photos)))
+    return resolved, pending
+
+
+def get_work_queue() -> WorkQueue:
+    return resources.shared('work_queue', WorkQueue)
+
+
+def _start_worker() -> 'SyncWorker':
+    handlers = default_handlers(translations=storage.get_translation_cache())
+    return SyncWorker(get_work_queue(), handlers).start()
+
+
+def get_sync_worker() -> SyncWorker:
+    """Returns the process-wide sync worker, starting it on first use."""
+    return resources.shared('sync_worker', _start_worker)
+
+
+def submit(kind: str, **payload) -> int:
+    """Queues a network operation and wakes the worker; returns the job id."""
+    job_id = get_work_queue().enqueue(kind, payload)
+    get_sync_worker().wake()
+    return job_id
+
+
+def submit_once(kind: str, **payload) -> int:
+    """Like submit, but reuses an identical job that is still waiting."""
+    job_id = get_work_queue().enqueue(kind, payload, unique=True)
+    get_sync_worker().wake()
+    return job_id
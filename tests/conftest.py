@@ -0,0 +1,12 @@
+"""
+Test setup for FieldScribe
+Points the data directory at a throwaway folder before any app module is imported
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["FIELDSCRIBE_DATA_DIR"] = tempfile.mkdtemp(prefix="fieldscribe-tests-")
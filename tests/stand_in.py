@@ -0,0 +1,72 @@
+"""
+Stand-in Server for FieldScribe tests
+Handles Wikimedia-style search requests locally, with scripted outages
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Outcomes a scripted request can have
+UP, ERROR, DROP = 'up', 'error', 'drop'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        outcome = self.server.next_outcome()
+        if outcome == DROP:
+            # Hang up without answering, like a dead link mid-request
+            self.close_connection = True
+            return
+        if outcome == ERROR:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        pages = {"1": {"imageinfo": [{"thumburl": f"{host}/t1.jpg", "url": f"{host}/f1.jpg"}]}}
+        body = json.dumps({"query": {"pages": pages}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Answers searches from 127.0.0.1 on a free port. outage() scripts the next
+    requests (503s or dropped connections); once the script runs out every
+    request succeeds again.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self._lock = threading.Lock()
+        self._script = []
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/w/api.php"
+
+    def outage(self, *outcomes):
+        with self._lock:
+            self._script.extend(outcomes)
+
+    def next_outcome(self) -> str:
+        with self._lock:
+            self.requests += 1
+            return self._script.pop(0) if self._script else UP
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+import analytics
+from report_model import Defect, Report
+
+
+def _report(client, date, *categories, engineer="Dana"):
+    defects = [Defect(f"Defect {i}", "", category=c, code="SI-1142 §4.2") for i, c in enumerate(categories)]
+    return Report(client_name=client, defects=defects, date=date, engineer=engineer)
+
+
+def test_superseded_versions_are_masked_before_and_after_compact(tmp_path):
+    store = analytics.DefectAnalytics(os.path.join(tmp_path, "analytics"))
+    store.add_report(1, _report("Tower A", "2026-08-03", "General", "Safety"))
+    store.add_report(2, _report("Tower B", "2026-08-10", "Plumbing"))
+    # Version 3 replaces version 1; 1 and 2 arrived in earlier segments
+    assert store.add_reports([(3, _report("Tower A", "2026-09-01", "General"), [1], None)]) == 1
+    assert len(store) == 2
+    before = (store.kpis(), store.count_by('category'), store.top_standards())
+    assert store.count_by('category') == [('General', 1), ('Plumbing', 1)]
+
+    assert store.compact() == {'segments': 3, 'rows': 2, 'dropped': 2}
+    assert (store.kpis(), store.count_by('category'), store.top_standards()) == before
+    assert store.stats()['segments'] == 1
+
+    # A reopened store reads the compacted segment and still masks a late copy of version 1
+    reopened = analytics.DefectAnalytics(store.root)
+    assert (reopened.kpis(), reopened.count_by('category')) == before[:2]
+    assert reopened.add_report(1, _report("Tower A", "2026-08-03", "General", "Safety")) == 2
+    assert reopened.count_by('category') == before[1]
+
+
+def test_duplicate_version_is_skipped(tmp_path):
+    store = analytics.DefectAnalytics(os.path.join(tmp_path, "analytics"))
+    assert store.add_report(7, _report("Tower A", "2026-08-03", "General", "Safety")) == 2
+    assert store.add_report(7, _report("Tower A", "2026-08-03", "General")) == 0
+    # Within one batch as well
+    assert store.add_reports([(8, _report("Tower B", "2026-08-04", "General"), (), None),
+                              (8, _report("Tower B", "2026-08-04", "Safety"), (), None)]) == 1
+    assert len(store) == 3 and store.stats()['segments'] == 2
+    assert store.has_version(7) and store.has_version(8)
+
+
+def test_category_by_month_fills_empty_months(tmp_path):
+    store = analytics.DefectAnalytics(os.path.join(tmp_path, "analytics"))
+    store.add_report(1, _report("Tower A", "2026-01-20", "General", "Safety"))
+    store.add_report(2, _report("Tower B", "2026-04-02", "General"))
+
+    months, categories, counts = store.category_by_month()
+    assert months == ["2026-01", "2026-02", "2026-03", "2026-04"]
+    assert categories == ["General", "Safety"]
+    np.testing.assert_array_equal(counts, [[1, 1], [0, 0], [0, 0], [1, 0]])
+
+    months, _, counts = store.category_by_month(since="2026-02-01")
+    assert months == ["2026-04"] and counts.tolist() == [[1, 0]]
+    assert store.category_by_month(since="2027-01-01")[0] == []
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import threading
+
+import api
+import storage
+
+TOKEN = "s3cret"
+
+
+async def _request(reader, writer, method, path, body=b'', headers=None, token=TOKEN):
+    head = [f"{method} {path} HTTP/1.1", "Host: test"]
+    if token:
+        head.append(f"Authorization: Bearer {token}")
+    head.extend(f"{k}: {v}" for k, v in (headers if headers is not None else
+                                          {'Content-Length': len(body)}).items())
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+    return await _response(reader)
+
+
+async def _response(reader):
+    lines = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {k.lower(): v.strip() for k, v in (line.split(":", 1) for line in lines[1:] if ":" in line)}
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, json.loads(body) if body else None
+
+
+def _serve(tmp_path, scenario, translator=None, **service_args):
+    async def main():
+        service = api.ReportService(blobs=storage.BlobStore(os.path.join(tmp_path, "blobs")),
+                                    translator=translator or (lambda text, target='ar': text), **service_args)
+        server = api.ReportServer(service, "127.0.0.1", 0, token=TOKEN)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            try:
+                await scenario(reader, writer)
+            finally:
+                writer.close()
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+
+def test_routing_and_validation_errors(tmp_path):
+    async def scenario(reader, writer):
+        status, headers, body = await _request(reader, writer, "GET", "/health", token="wrong")
+        assert status == 401 and headers['www-authenticate'] == 'Bearer' and headers['connection'] == 'keep-alive'
+        assert (await _request(reader, writer, "GET", "/nowhere"))[0] == 404
+        assert (await _request(reader, writer, "PUT", "/health"))[0] == 405
+        assert (await _request(reader, writer, "GET", "/reports/abc"))[0] == 404
+        assert (await _request(reader, writer, "POST", "/reports", b"{nope"))[0] == 400
+        status, _, body = await _request(reader, writer, "POST", "/reports", b'{"defects": []}')
+        assert status == 400 and "client_name" in body['error']
+        status, _, body = await _request(reader, writer, "POST", "/reports", json.dumps(
+            {'client_name': 'c', 'defects': [{'title': 't', 'photos': ["0" * 64]}]}).encode())
+        assert status == 400 and "unknown photo" in body['error']
+        status, _, body = await _request(reader, writer, "POST", "/reports", headers={})
+        assert status == 411
+        assert (await _request(reader, writer, "GET", "/health"))[0] == 200
+    _serve(tmp_path, scenario)
+
+
+def test_unread_body_is_skipped_not_parsed(tmp_path):
+    async def scenario(reader, writer):
+        # Rejected before the body is read; the next request on the connection still works
+        body = b"GET /health HTTP/1.1\r\n\r\n"
+        status, headers, _ = await _request(reader, writer, "POST", "/reports", body, token="wrong")
+        assert status == 401 and headers['connection'] == 'keep-alive'
+        status, _, health = await _request(reader, writer, "GET", "/health")
+        assert status == 200 and health['submitted'] == 0
+    _serve(tmp_path, scenario)
+
+
+def test_large_unread_body_closes_connection(tmp_path):
+    async def scenario(reader, writer):
+        status, headers, _ = await _request(reader, writer, "POST", "/reports",
+                                            headers={'Content-Length': api.MAX_JSON_BYTES + 1})
+        assert status == 413 and headers['connection'] == 'close'
+        assert await reader.read() == b''
+    _serve(tmp_path, scenario)
+
+
+def test_full_queue_answers_503(tmp_path):
+    release = threading.Event()
+
+    def translator(text, target='ar'):
+        release.wait(5)
+        return text
+
+    async def scenario(reader, writer):
+        definition = json.dumps({'client_name': 'c', 'languages': ['ar'],
+                                 'defects': [{'title': 'סדק בקיר'}]}).encode()
+        try:
+            statuses = []
+            for _ in range(3):
+                status, headers, _ = await _request(reader, writer, "POST", "/reports", definition)
+                statuses.append(status)
+                await asyncio.sleep(0.05)
+            assert statuses == [202, 202, 503]
+            assert int(headers['retry-after']) >= 1
+        finally:
+            release.set()
+    _serve(tmp_path, scenario, translator, workers=1, queue_size=1)
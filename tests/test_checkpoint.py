@@ -0,0 +1,86 @@
+import io
+import logging
+import os
+from datetime import date
+
+import pytest
+
+import checkpoint
+import storage
+from report_model import Defect, PhotoHandle, defect_from_dict
+
+
+@pytest.fixture
+def store(tmp_path):
+    return checkpoint.SessionCheckpoint(os.path.join(tmp_path, "checkpoints"),
+                                        storage.BlobStore(os.path.join(tmp_path, "blobs")))
+
+
+def _photo(data: bytes, name: str):
+    photo = io.BytesIO(data)
+    photo.name = name
+    return photo
+
+
+def _state(store):
+    crack = defect_from_dict({'title': 'Crack', 'desc': 'Lobby', 'code': '1.2', 'category': 'Structural',
+                              'photos': [_photo(b'p1', 'a.jpg')], 'photo_exif': [[32.07, 34.77, '', 800, 600]],
+                              'tool_photo_jobs': [7]}, store.blobs)
+    return {
+        'page': 'deck', 'client_name': 'Tower A', 'temp_title': 'סדק', 'temp_photos': [_photo(b'p2', 'b.jpg')],
+        'selected_defects': [crack, Defect('Leak', category='Plumbing')],
+        'unrelated': 'not saved',
+    }
+
+
+def test_round_trip(store):
+    state = _state(store)
+    assert store.save("abc123abc123", state)
+    restored = store.restore("abc123abc123")
+
+    assert restored['page'] == 'deck' and restored['client_name'] == 'Tower A' and restored['temp_title'] == 'סדק'
+    assert 'unrelated' not in restored
+    assert restored['selected_defects'] == state['selected_defects']
+    assert restored['selected_defects'][0].photos == (PhotoHandle(storage.BlobStore.digest(b'p1'), 'a.jpg'),)
+    photo = restored['temp_photos'][0]
+    assert photo.read() == b'p2' and photo.name == 'b.jpg'
+    assert getattr(photo, storage.BLOB_ATTR) == storage.BlobStore.digest(b'p2')
+
+
+def test_dict_defects_of_older_checkpoints_are_typed(store):
+    store.save("abc123abc123", {'selected_defects': [{'title': 'Crack', 'cat': 'structural',
+                                                      'photos': [_photo(b'p1', 'a.jpg')]}]})
+    crack, = store.restore("abc123abc123")['selected_defects']
+    assert crack == Defect('Crack', category='Structural',
+                           photos=(PhotoHandle(storage.BlobStore.digest(b'p1'), 'a.jpg'),))
+
+
+def test_unchanged_state_is_not_rewritten(store, tmp_path):
+    assert store.save("abc123abc123", _state(store))
+    assert not store.save("abc123abc123", _state(store))
+    state = _state(store)
+    state['selected_defects'].pop()
+    assert store.save("abc123abc123", state)
+    defects = os.listdir(os.path.join(tmp_path, "checkpoints", "abc123abc123", "defects"))
+    assert len(defects) == 1
+    assert len(store.restore("abc123abc123")['selected_defects']) == 1
+
+
+def test_missing_and_deleted(store):
+    assert store.restore("abc123abc123") is None
+    store.save("abc123abc123", _state(store))
+    store.delete("abc123abc123")
+    assert not store.exists("abc123abc123")
+    assert checkpoint.is_valid_inspection_id(checkpoint.new_inspection_id())
+    assert not checkpoint.is_valid_inspection_id("../../etc")
+
+
+def test_unsupported_values_are_skipped(store, caplog):
+    state = {'client_name': 'Tower A', 'temp_when': date(2026, 10, 19), 'temp_list': ['a', object(), 1],
+             'temp_nested': {'keep': True, 'drop': {1, 2}}}
+    with caplog.at_level(logging.WARNING, logger="checkpoint"):
+        store.save("abc123abc123", state)
+    restored = store.restore("abc123abc123")
+    assert 'temp_when' not in restored
+    assert restored['temp_list'] == ['a', 1] and restored['temp_nested'] == {'keep': True}
+    assert "date" in caplog.text and "set" in caplog.text
@@ -0,0 +1,101 @@
+import os
+import random
+import statistics
+import time
+import zipfile
+
+import defect_library
+import logic
+import storage
+from defect_library import DefectEntry, DefectIndex
+from report_model import Defect, Report
+
+
+def _entry(title, uses=1, last_used="2026-10-01T09:00:00", desc=''):
+    return DefectEntry(0, title, desc, '', '', uses, last_used)
+
+
+def _titles(results):
+    return [e.title for e in results]
+
+
+def test_titles_starting_with_the_query_rank_first():
+    index = DefectIndex([
+        _entry("Wall crack", uses=50),
+        _entry("Crack in slab", uses=2, last_used="2026-01-01T09:00:00"),
+        _entry("Crack near window", uses=2, last_used="2026-09-01T09:00:00"),
+        _entry("Cracked tile", uses=9),
+        _entry("Leak under sink", uses=99),
+    ])
+    # Starts-with first, then uses, then the most recent use
+    assert _titles(index.suggest("crack")) == ["Cracked tile", "Crack near window", "Crack in slab", "Wall crack"]
+    assert _titles(index.suggest("CRA", limit=2)) == ["Cracked tile", "Crack near window"]
+    assert index.suggest("  ") == [] and index.suggest("plaster") == []
+
+
+def test_every_query_word_must_prefix_a_title_word():
+    index = DefectIndex([
+        _entry("Crack in wall"),
+        _entry("Crack in slab"),
+        _entry("Wall paint peeling"),
+        _entry("Damp wall near crack"),
+    ])
+    assert sorted(_titles(index.suggest("cra wa"))) == ["Crack in wall", "Damp wall near crack"]
+    assert _titles(index.suggest("wa cra")) == _titles(index.suggest("cra wa"))
+    assert _titles(index.suggest("crack wall")) == ["Crack in wall", "Damp wall near crack"]
+    assert index.suggest("crack roof") == []
+
+
+def test_update_counts_uses_and_adds_new_titles():
+    index = DefectIndex([_entry("Crack in wall", uses=3)])
+    index.update("Cracked tile", "", "SI-1555", "General", "2026-10-02T09:00:00")
+    assert _titles(index.suggest("crack")) == ["Crack in wall", "Cracked tile"]
+    for _ in range(3):
+        index.update("Cracked tile", "", "-", "", "2026-10-03T09:00:00")
+    top = index.suggest("crack")[0]
+    assert (top.title, top.uses, top.code, top.category) == ("Cracked tile", 4, "SI-1555", "General")
+
+
+def test_backfill_from_a_rendered_report(tmp_path):
+    defects = [
+        Defect("סדק בקיר", "סדק אלכסוני מעל החלון\nרוחב 2 מ\"מ", code="SI-1142 §4.2", category="Structural"),
+        Defect("Leak under sink", "Dripping trap", category="Plumbing"),
+        Defect("Loose rail", "", code="-"),
+    ]
+    report = Report(client_name="Tower A", general_notes="", defects=defects, date="2026-10-01")
+    model = logic.transform_report(report, should_translate=False, translator=lambda text, target: text)
+    docx = logic.render_docx(model)
+    with zipfile.ZipFile(docx) as z:
+        xml = z.read('word/document.xml')
+    assert defect_library.defects_from_docx_xml(xml) == [
+        ("סדק בקיר", "סדק אלכסוני מעל החלון\nרוחב 2 מ\"מ", "SI-1142 §4.2"),
+        ("Leak under sink", "Dripping trap", ""),
+        ("Loose rail", "", ""),
+    ]
+
+    db = os.path.join(tmp_path, "fieldscribe.db")
+    archive = storage.ReportArchive(db, storage.BlobStore(os.path.join(tmp_path, "blobs")))
+    docx.seek(0)
+    archive.archive(docx, "report.docx", client="Tower A", created="2026-10-01T09:00:00")
+    library = defect_library.DefectLibrary(db, archive)
+    assert len(library.index) == 3
+    (entry,) = library.suggest("סדק")
+    assert (entry.code, entry.uses, entry.last_used) == ("SI-1142 §4.2", 1, "2026-10-01T09:00:00")
+
+
+def test_suggestions_take_under_5_ms():
+    rng = random.Random(3)
+    vocabulary = ["crack", "wall", "slab", "leak", "pipe", "tile", "damp", "rust", "rail", "door", "window",
+                  "ceiling", "plaster", "paint", "joint", "beam", "column", "stair", "roof", "drain",
+                  "סדק", "קיר", "רטיבות", "צנרת", "ריצוף", "טיח", "חלון", "דלת", "מעקה", "תקרה"]
+    entries = [_entry(" ".join(rng.sample(vocabulary, rng.randint(2, 5))) + f" {i}", uses=rng.randint(1, 50))
+               for i in range(20_000)]
+    index = DefectIndex(entries)
+    queries = [word[:n] for word in vocabulary for n in (1, 2, 4)] + ["cr wa", "סד קי", "pa ce", "r"]
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.suggest(query)
+        timings.append(time.perf_counter() - start)
+    assert statistics.median(timings) < 0.005
+    assert sorted(timings)[int(len(timings) * 0.95)] < 0.005
@@ -0,0 +1,55 @@
+import os
+from datetime import date
+
+import pytest
+
+import kpis
+import storage
+import versions
+from report_model import Defect, Report
+
+
+@pytest.fixture
+def store(tmp_path):
+    return versions.ReportVersions(os.path.join(tmp_path, "fieldscribe.db"),
+                                   storage.BlobStore(os.path.join(tmp_path, "blobs")))
+
+
+def _report(*defects, client="Tower A"):
+    return Report(client_name=client, general_notes="", defects=list(defects), date="2026-10-01")
+
+
+CRACK = Defect("Crack", "In the lobby wall", code="1.2")
+LEAK = Defect("Leak", "Under the sink", category="Plumbing")
+
+
+def test_regenerated_report_retracts_its_previous_version(store, tmp_path):
+    counters = kpis.KpiCounters(os.path.join(tmp_path, "fieldscribe.db"))
+    first = store.commit("s1", _report(CRACK, LEAK))
+    assert counters.record_report(first.id, store.load(first.id))
+    second = store.commit("s1", _report(CRACK, client="Tower B"))
+    assert counters.record_report(second.id, store.load(second.id), supersedes=[first.id])
+    # Counting the same version again changes nothing
+    assert not counters.record_report(second.id, store.load(second.id), supersedes=[first.id])
+
+    today = date(2026, 10, 19)
+    snapshot = counters.snapshot(today)
+    assert (snapshot['reports'], snapshot['defects'], snapshot['customers']) == (1, 1, 1)
+    assert (snapshot['reports_this_month'], snapshot['defects_this_month']) == (1, 1)
+    counters.compact()
+    assert counters.snapshot(today) == snapshot
+
+
+def test_customer_counts_while_one_of_its_reports_does(store, tmp_path):
+    counters = kpis.KpiCounters(os.path.join(tmp_path, "fieldscribe.db"))
+    a = store.commit("s1", _report(CRACK))
+    b = store.commit("s2", _report(LEAK))
+    counters.record_report(a.id, store.load(a.id))
+    counters.record_report(b.id, store.load(b.id))
+    assert counters.snapshot()['customers'] == 1
+    c = store.commit("s1", _report(CRACK, client="Tower B"))
+    counters.record_report(c.id, store.load(c.id), supersedes=[a.id])
+    assert counters.snapshot()['customers'] == 2
+    d = store.commit("s2", _report(LEAK, client="Tower B"))
+    counters.record_report(d.id, store.load(d.id), supersedes=[b.id])
+    assert counters.snapshot()['customers'] == 1
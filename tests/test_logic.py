@@ -0,0 +1,63 @@
+import logging
+import random
+
+import logic
+
+LADDER = [(1600, 85), (1024, 78), (640, 65)]
+
+
+class _SyncPool:
+    def map(self, fn, items):
+        return [fn(item) for item in items]
+
+
+def _encoder(sizes):
+    """An encode() returning sizes[handle][level] bytes, recording each call."""
+    calls = []
+
+    def encode(handle, width, quality):
+        level = LADDER.index((width, quality))
+        calls.append((handle, level))
+        return b"x" * sizes[handle][level]
+    encode.calls = calls
+    return encode
+
+
+def _total(chosen, sizes):
+    return sum(sizes[h][LADDER.index(choice)] for h, choice in chosen.items())
+
+
+def test_result_fits_the_budget():
+    rng = random.Random(7)
+    sizes = {}
+    for i in range(40):
+        small = rng.randint(20_000, 60_000)
+        sizes[f"p{i}"] = [small * 4 + rng.randint(0, 9999), small * 2, small]
+    for budget in (2_000_000, 3_500_000, 6_000_000, 12_000_000):
+        encode = _encoder(sizes)
+        chosen = logic.fit_photo_budget(list(sizes), budget, LADDER, encode, _SyncPool())
+        assert set(chosen) == set(sizes)
+        assert _total(chosen, sizes) <= budget
+        # Each photo is encoded at most once per level
+        assert len(encode.calls) == len(set(encode.calls))
+
+
+def test_over_budget_even_at_the_lowest_level(caplog):
+    sizes = {"a": [900, 500, 300], "b": [800, 400, 250]}
+    with caplog.at_level(logging.WARNING, logger="logic"):
+        chosen = logic.fit_photo_budget(["a", "b"], 100, LADDER, _encoder(sizes), _SyncPool())
+    assert chosen == {"a": LADDER[-1], "b": LADDER[-1]}
+    assert "exceed" in caplog.text
+
+
+def test_upgrade_pass_takes_the_cheapest_photos_first():
+    # Level 1 fits (60 of 110 bytes), level 0 does not (190). Upgrading costs
+    # a 80, b 10, c 40: the 50 bytes left take b and c, not a
+    sizes = {"a": [100, 20, 10], "b": [30, 20, 10], "c": [60, 20, 10]}
+    chosen = logic.fit_photo_budget(["a", "b", "c"], 110, LADDER, _encoder(sizes), _SyncPool())
+    assert chosen == {"a": LADDER[1], "b": LADDER[0], "c": LADDER[0]}
+    assert _total(chosen, sizes) == 110
+
+
+def test_no_photos():
+    assert logic.fit_photo_budget([], 100, LADDER, _encoder({}), _SyncPool()) == {}
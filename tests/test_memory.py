@@ -0,0 +1,66 @@
+import io
+import os
+
+import memory
+import storage
+
+
+def _photo(size: int):
+    photo = io.BytesIO(os.urandom(size))
+    photo.name = "p.jpg"
+    return photo
+
+
+def test_spill_replaces_every_reference(tmp_path):
+    blobs = storage.BlobStore(os.path.join(tmp_path, "blobs"))
+    photo = _photo(200_000)
+    data = photo.getvalue()
+    state = {'temp_photos': [photo], 'temp_tool_photos': [photo, _photo(10)]}
+    del photo
+
+    done = memory.trim_session(state, 0, 300_000, blobs)
+    spilled = state['temp_photos'][0]
+    assert isinstance(spilled, memory.SpilledPhoto) and state['temp_tool_photos'][0] is spilled
+    assert spilled.getvalue() == data and spilled.name == "p.jpg"
+    assert done['spilled'] == 2 and done['retained'] == 0
+    assert done['spilled_bytes'] > 0
+
+
+def test_photo_held_elsewhere_is_not_counted(tmp_path):
+    blobs = storage.BlobStore(os.path.join(tmp_path, "blobs"))
+    held = _photo(200_000)
+    state = {'temp_photos': [held], 'not_persisted': held}
+
+    done = memory.trim_session(state, 0, 300_000, blobs)
+    assert isinstance(state['temp_photos'][0], memory.SpilledPhoto)
+    assert state['not_persisted'] is held
+    assert (done['spilled'], done['spilled_bytes'], done['retained']) == (0, 0, 1)
+
+
+class _Usage:
+    ru_maxrss = 2048
+
+
+def _without_proc(monkeypatch):
+    def no_proc(*args, **kwargs):
+        raise OSError("no /proc")
+    monkeypatch.setattr(memory, "open", no_proc, raising=False)
+    monkeypatch.setattr(memory.resource, "getrusage", lambda who: _Usage())
+
+
+def test_peak_rss_is_kilobytes_on_linux(monkeypatch):
+    _without_proc(monkeypatch)
+    monkeypatch.setattr(memory.sys, "platform", "linux")
+    assert memory.process_rss() == 2048 * 1024
+
+
+def test_peak_rss_is_bytes_on_macos(monkeypatch):
+    _without_proc(monkeypatch)
+    monkeypatch.setattr(memory.sys, "platform", "darwin")
+    assert memory.process_rss() == 2048
+
+
+def test_rss_without_resource_module(monkeypatch):
+    _without_proc(monkeypatch)
+    monkeypatch.setattr(memory, "RESOURCE_AVAILABLE", False)
+    assert memory.process_rss() == 0
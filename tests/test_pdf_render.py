@@ -0,0 +1,45 @@
+import dataclasses
+import threading
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import logic
+import pdf_render
+from report_model import Defect, RenderedDefect, Report
+
+rl_config = pytest.importorskip("reportlab.rl_config")
+
+
+def _model():
+    jpeg = BytesIO()
+    Image.new("RGB", (320, 240), (120, 80, 40)).save(jpeg, "JPEG", quality=70)
+    report = Report(client_name="Tower A", defects=[Defect("Crack", "Lobby wall")], date="2026-10-01")
+    model = logic.transform_report(report, should_translate=False, translator=lambda text, target: text)
+    return dataclasses.replace(model, defects=[RenderedDefect("Crack", "Lobby wall", "SI-1142",
+                                                              photos=[jpeg.getvalue()])])
+
+
+def test_streams_are_binary_only_during_the_render():
+    assert rl_config.useA85 == 1
+    pdf = pdf_render.render_pdf(_model()).getvalue()
+    assert pdf.startswith(b"%PDF") and b"/DCTDecode" in pdf
+    assert b"/ASCII85Decode" not in pdf
+    assert rl_config.useA85 == 1
+
+
+def test_concurrent_renders_restore_the_setting():
+    model, errors = _model(), []
+
+    def render():
+        try:
+            assert b"/ASCII85Decode" not in pdf_render.render_pdf(model).getvalue()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=render) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and rl_config.useA85 == 1
@@ -0,0 +1,79 @@
+import os
+import random
+
+import pytest
+
+import imaging
+import photo_index
+import storage
+from report_model import Defect, PhotoHandle
+
+# (lat, lon, spread in metres): a city, a high-latitude site, both sides of
+# the ±180° meridian and the ground around the North Pole
+SITES = [(32.0853, 34.7818, 300), (78.2232, 15.6267, 300), (-16.5, 179.9995, 300), (-16.5, -179.9995, 300),
+         (89.9995, 0.0, 200)]
+
+
+def _jitter(rng, lat, lon, spread):
+    lat = lat + rng.uniform(-spread, spread) / photo_index._METERS_PER_DEGREE
+    lat = min(lat, 90.0)
+    lon = lon + rng.uniform(-spread, spread) / photo_index._METERS_PER_DEGREE / max(
+        photo_index.math.cos(photo_index.math.radians(lat)), 1e-3)
+    return lat, (lon + 180.0) % 360.0 - 180.0
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = random.Random(47)
+    return [_jitter(rng, *rng.choice(SITES)) for _ in range(3000)]
+
+
+@pytest.fixture(scope="module")
+def index(points, tmp_path_factory):
+    root = tmp_path_factory.mktemp("photo_index")
+    index = photo_index.PhotoLocationIndex(os.path.join(root, "fieldscribe.db"),
+                                           storage.BlobStore(os.path.join(root, "blobs")))
+    for i, (lat, lon) in enumerate(points):
+        exif = imaging.PhotoExif(lat, lon, f"2026-10-{i % 28 + 1:02d}T09:00:00")
+        index.add_defect("s1", Defect(f"d{i}", "", photos=(PhotoHandle(f"{i:064x}"),),
+                                      photo_exif=(exif.to_list(),)))
+    return index
+
+
+def _queries(points, count=50):
+    rng = random.Random(3)
+    queries = [_jitter(rng, *rng.choice(points), 15) + (rng.choice((10.0, 20.0, 60.0, 150.0)),)
+               for _ in range(count - 4)]
+    # Exactly on the meridian, and on the pole
+    return queries + [(-16.5, 180.0, 60.0), (-16.5, -180.0, 60.0), (90.0, 0.0, 100.0), (89.9995, 90.0, 150.0)]
+
+
+def test_cells_within_cover_every_point_in_the_circle(points):
+    for lat, lon, radius in _queries(points):
+        cells = set(photo_index.cells_within(lat, lon, radius))
+        for plat, plon in points:
+            if photo_index.distance_m(lat, lon, plat, plon) <= radius:
+                assert photo_index.cell_of(plat, plon) in cells, (lat, lon, radius, plat, plon)
+
+
+def test_nearby_matches_brute_force(points, index):
+    found_any = 0
+    for lat, lon, radius in _queries(points):
+        expected = {f"d{i}" for i, (plat, plon) in enumerate(points)
+                    if photo_index.distance_m(lat, lon, plat, plon) <= radius}
+        got = {d.title for d in index.nearby(lat, lon, radius, limit=len(points))}
+        assert got == expected, (lat, lon, radius)
+        found_any += bool(expected)
+    assert found_any >= 40
+
+
+def test_results_reach_across_the_meridian(points, index):
+    found = index.nearby(-16.5, 179.9999, 150.0, limit=len(points))
+    assert {points[int(d.title[1:])][1] > 0 for d in found} == {True, False}
+
+
+def test_both_sides_of_the_meridian_share_a_column():
+    row = photo_index._row(-16.5)
+    assert photo_index._column(row, 180.0) == photo_index._column(row, -180.0) == 0
+    assert photo_index._column(row, 179.99999) == photo_index._column_count(row) - 1
+    assert photo_index.cell_of(-16.5, 180.0) == photo_index.cell_of(-16.5, -180.0)
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import standards
+
+
+def test_split_clauses_at_numbered_headings():
+    text = "\n".join([
+        "SI 1142 Guardrails",
+        "1 Scope",
+        "This standard covers guardrails",
+        "of balconies and stairs.",
+        "4.2 Height of guardrails",
+        "The height shall be at least 1.05 m.",
+        "4.2.1. Measurement",
+        "2 Posts are tested under load.",
+        "Rails are tested as well.",
+        "3.1 גובה המעקה",
+        "לפחות 105 ס\"מ",
+    ])
+    assert standards.split_clauses(text) == [
+        ["1", "Scope", "This standard covers guardrails of balconies and stairs."],
+        ["4.2", "Height of guardrails", "The height shall be at least 1.05 m."],
+        # A body line that starts with a number but ends with a period stays in the clause
+        ["4.2.1", "Measurement", "2 Posts are tested under load. Rails are tested as well."],
+        ["3.1", "גובה המעקה", "לפחות 105 ס\"מ"],
+    ]
+    assert standards.split_clauses("No numbered headings here.\nNone at all") == []
+
+
+def test_standard_id_of_latin_and_hebrew_names():
+    assert standards.standard_id("SI 1142 part 2 Guardrails") == "SI-1142-2"
+    assert standards.standard_id("si1142") is None
+    assert standards.standard_id('ת"י 1142 חלק 2 - מעקות') == "SI-1142-2"
+    assert standards.standard_id("ת״י 1205") == "SI-1205"
+    assert standards.standard_id("ת'י-1555") == "SI-1555"
+    assert standards.standard_id("Part 2 only") is None
+
+
+def _write_pdf(path, *lines):
+    canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+    c = canvas.Canvas(str(path))
+    y = 800
+    for line in lines:
+        c.drawString(72, y, line)
+        y -= 16
+    c.save()
+
+
+def test_ingest_reparses_only_changed_files_and_drops_deleted(tmp_path):
+    pytest.importorskip("pypdf")
+    folder, catalogue = tmp_path / "pdfs", str(tmp_path / "catalogue.bin")
+    (folder / "sub").mkdir(parents=True)
+    _write_pdf(folder / "SI-1142.pdf", "SI 1142", "Guardrails", "4.2 Height of guardrails", "At least 1.05 m.")
+    _write_pdf(folder / "sub" / "SI-1205.pdf", "SI 1205", "Plumbing", "1 Scope", "Pipe fittings.")
+
+    first = standards.ingest(str(folder), catalogue, workers=1)
+    assert (first['files'], first['parsed'], first['unchanged'], first['removed']) == (2, 2, 0, 0)
+    documents = standards.read_catalogue(catalogue)['documents']
+    assert documents["SI-1142.pdf"]['standard'] == "SI-1142"
+    assert documents["SI-1142.pdf"]['clauses'] == [["4.2", "Height of guardrails", "At least 1.05 m."]]
+
+    # Nothing changed: nothing is parsed and the catalogue is not rewritten
+    mtime = os.stat(catalogue).st_mtime_ns
+    second = standards.ingest(str(folder), catalogue, workers=1)
+    assert (second['parsed'], second['unchanged'], second['removed']) == (0, 2, 0)
+    assert os.stat(catalogue).st_mtime_ns == mtime
+
+    _write_pdf(folder / "SI-1142.pdf", "SI 1142", "Guardrails", "4.3 Gaps", "At most 10 cm.")
+    os.remove(folder / "sub" / "SI-1205.pdf")
+    third = standards.ingest(str(folder), catalogue, workers=1)
+    assert (third['files'], third['parsed'], third['unchanged'], third['removed']) == (1, 1, 0, 1)
+    documents = standards.read_catalogue(catalogue)['documents']
+    assert list(documents) == ["SI-1142.pdf"]
+    assert documents["SI-1142.pdf"]['clauses'] == [["4.3", "Gaps", "At most 10 cm."]]
@@ -0,0 +1,94 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return os.path.join(tmp_path, "fieldscribe.db")
+
+
+@pytest.fixture
+def registry(db_path):
+    registry = storage.UserRegistry(db_path)
+    for i in range(25):
+        registry.add_user(f"u{i:02d}", f"Engineer {i:02d}", f"eng{i:02d}@example.com",
+                          'Engineer' if i % 2 else 'Inspector')
+    registry.add_user('odd', 'Dana_100%', 'dana@example.com', 'Surveyor')
+    return registry
+
+
+def _docx(*members) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_search_pages_through_all_matches(registry):
+    users, total = registry.search_users('engineer', page_size=10)
+    assert total == 25 and len(users) == 10
+    seen = [u['id'] for page in range(3) for u in registry.search_users('engineer', page=page, page_size=10)[0]]
+    assert seen == [f"u{i:02d}" for i in range(25)]
+    assert registry.search_users('engineer', page=3, page_size=10)[0] == []
+
+
+def test_search_filters_by_role_and_prefix(registry):
+    users, total = registry.search_users(role='Inspector')
+    assert total == 13 and {u['role'] for u in users} == {'Inspector'}
+    assert registry.search_users('ENG07@')[1] == 1
+    # Prefix only, and LIKE wildcards in the query are literal
+    assert registry.search_users('ngineer')[1] == 0
+    assert [u['id'] for u in registry.search_users('Dana_1')[0]] == ['odd']
+    assert registry.search_users('Dana%')[1] == 0
+
+
+def test_search_counts_files(registry):
+    registry.add_file('u03', 'a.docx', 10)
+    registry.add_file('u03', 'b.docx', 20)
+    user = registry.search_users('Engineer 03')[0][0]
+    assert user['file_count'] == 2
+    files, total = registry.list_files('u03', page_size=1)
+    assert total == 2 and [f['name'] for f in files] == ['b.docx']
+
+
+def test_deleting_a_user_cascades_to_files(registry, db_path):
+    registry.add_file('u04', 'a.docx', 10)
+    conn = storage.connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM users WHERE id = 'u04'")
+    assert registry.list_files('u04') == ([], 0)
+    with pytest.raises(storage.sqlite3.IntegrityError):
+        registry.add_file('nobody', 'a.docx', 10)
+
+
+def test_archive_stores_shared_parts_once(db_path, tmp_path):
+    archive = storage.ReportArchive(db_path, storage.BlobStore(os.path.join(tmp_path, "blobs")))
+    photo = os.urandom(50_000)
+    first = archive.archive(_docx(("word/document.xml", "<a/>"), ("word/media/p.jpeg", photo)), "a.docx")
+    second = archive.archive(_docx(("word/document.xml", "<b/>"), ("word/media/p.jpeg", photo)), "b.docx")
+
+    stats = archive.storage_stats()
+    assert stats['blob_count'] == 3
+    assert stats['blob_bytes'] < 50_000 + 100
+    assert stats['reports_bytes'] > 100_000
+    with zipfile.ZipFile(io.BytesIO(archive.report_bytes(second))) as zf:
+        assert zf.read("word/document.xml") == b"<b/>" and zf.read("word/media/p.jpeg") == photo
+    assert archive.read_part(first, "word/document.xml") == b"<a/>"
+
+
+def test_deleting_a_report_cascades_to_parts(db_path, tmp_path):
+    archive = storage.ReportArchive(db_path, storage.BlobStore(os.path.join(tmp_path, "blobs")))
+    report_id = archive.archive(_docx(("word/document.xml", "<a/>")), "a.docx")
+    conn = storage.connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+    assert archive.storage_stats()['blob_count'] == 0
+    with pytest.raises(KeyError):
+        archive.open_report(report_id)
@@ -0,0 +1,123 @@
+import os
+import time
+
+import pytest
+
+import storage
+import sync
+from report_model import Defect, PhotoHandle
+from stand_in import DROP, ERROR, StandInServer
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return sync.WorkQueue(os.path.join(tmp_path, "sync.db"))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with StandInServer() as server:
+        monkeypatch.setattr(sync, "WIKIMEDIA_API_URL", server.url)
+        yield server
+
+
+def _worker(queue, **kwargs):
+    kwargs.setdefault("base_delay", 1.0)
+    return sync.SyncWorker(queue, sync.default_handlers(), **kwargs)
+
+
+def test_outage_backs_off_then_completes(queue, server):
+    server.outage(ERROR, DROP)
+    worker = _worker(queue)
+    job_id = queue.enqueue('wikimedia_search', {'query': 'crack', 'limit': 1})
+
+    assert worker.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == sync.PENDING and job['attempts'] == 1 and "503" in job['last_error']
+    assert not worker.online
+    first_delay = worker.offline_until - time.time()
+    assert 0.4 < first_delay <= 1.0
+    # Still backing off: nothing is attempted
+    assert not worker.run_once()
+    assert server.requests == 1
+
+    worker.offline_until = 0.0
+    queue.retry(job_id, job['attempts'], 0, job['last_error'])
+    assert worker.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == sync.PENDING and job['attempts'] == 2
+    # Consecutive failures double the backoff (with jitter in [0.5, 1])
+    assert 0.9 < worker.offline_until - time.time() <= 2.0
+
+    worker.wake(force=True)
+    queue.retry(job_id, job['attempts'], 0, job['last_error'])
+    assert worker.run_once()
+    job = queue.get(job_id)
+    assert job['status'] == sync.DONE and job['attempts'] == 2
+    assert job['result'] == [{'thumb': server.url.replace('/w/api.php', '/t1.jpg'),
+                              'full': server.url.replace('/w/api.php', '/f1.jpg')}]
+    assert worker.online
+
+
+def test_worker_thread_rides_out_outage(queue, server):
+    server.outage(ERROR, ERROR, DROP)
+    worker = _worker(queue, base_delay=0.05, max_delay=0.2).start()
+    try:
+        job_id = queue.enqueue('wikimedia_search', {'query': 'crack', 'limit': 1})
+        worker.wake()
+        job = queue.wait(job_id, timeout=5)
+    finally:
+        worker.stop()
+    assert job['status'] == sync.DONE
+    assert server.requests == 4
+
+
+def test_gives_up_after_max_attempts(queue, server):
+    server.outage(ERROR, ERROR)
+    worker = _worker(queue, max_attempts=2)
+    job_id = queue.enqueue('wikimedia_search', {'query': 'crack'})
+    for _ in range(2):
+        worker.wake(force=True)
+        queue.retry(job_id, queue.get(job_id)['attempts'], 0, None)
+        worker.run_once()
+    assert queue.get(job_id)['status'] == sync.FAILED
+
+
+def test_unreachable_server_is_transient(monkeypatch):
+    with StandInServer() as server:
+        url = server.url
+    monkeypatch.setattr(sync, "HTTP_TIMEOUT", 1)
+    with pytest.raises(sync.TransientError):
+        sync.search_wikimedia_images('crack', api_url=url)
+
+
+def test_unique_enqueue_reuses_waiting_job(queue):
+    first = queue.enqueue('translate', {'text': 'סדק', 'target': 'ar'}, unique=True)
+    assert queue.enqueue('translate', {'target': 'ar', 'text': 'סדק'}, unique=True) == first
+    assert queue.enqueue('translate', {'text': 'סדק', 'target': 'en'}, unique=True) != first
+    queue.complete(queue.claim()['id'], 'شق')
+    assert queue.enqueue('translate', {'text': 'סדק', 'target': 'ar'}, unique=True) != first
+
+
+def test_prefetch_queues_every_target_once(monkeypatch):
+    queued = []
+    monkeypatch.setattr(sync, "submit_once", lambda kind, **payload: queued.append((kind, payload)))
+    text = "סדק באריח ליד החלון בחדר השינה"
+    count = sync.prefetch_translations([text, "", text], ['ar', 'en', 'ar'])
+    targets = [payload['target'] for _, payload in queued]
+    assert count == len(queued) > 0
+    assert set(targets) == {'ar', 'en'} and targets.count('ar') == targets.count('en')
+
+
+def test_finished_downloads_are_attached_as_handles(queue, tmp_path):
+    blobs = storage.BlobStore(os.path.join(tmp_path, "blobs"))
+    done = queue.enqueue('fetch_image', {'url': 'a'})
+    waiting = queue.enqueue('fetch_image', {'url': 'b'})
+    queue.claim()
+    queue.complete(done, {'blob': blobs.put(b'tool')})
+    defect = Defect('Crack', tool_photo_jobs=(done, waiting))
+
+    (resolved,), pending = sync.resolve_pending_photos([defect], queue, blobs)
+    assert pending == 1
+    assert resolved.tool_photos == (PhotoHandle(storage.BlobStore.digest(b'tool')),)
+    assert defect.tool_photos == ()
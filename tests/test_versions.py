@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import storage
+import versions
+from report_model import Defect, PhotoHandle, Report
+
+
+@pytest.fixture
+def store(tmp_path):
+    return versions.ReportVersions(os.path.join(tmp_path, "fieldscribe.db"),
+                                   storage.BlobStore(os.path.join(tmp_path, "blobs")))
+
+
+def _report(*defects, client="Tower A", notes=""):
+    return Report(client_name=client, general_notes=notes, defects=list(defects), date="2026-10-01")
+
+
+CRACK = Defect("Crack", "In the lobby wall", code="1.2", photos=(PhotoHandle("a" * 64, "a.jpg"),))
+LEAK = Defect("Leak", "Under the sink", category="Plumbing")
+RAIL = Defect("Loose rail", "Stairs", category="Safety")
+
+
+def test_unchanged_report_is_not_a_new_version(store):
+    first = store.commit("s1", _report(CRACK, LEAK))
+    assert store.commit("s1", _report(CRACK, LEAK)).id == first.id
+    second = store.commit("s1", _report(CRACK, LEAK, notes="Revisit in a month"))
+    assert (second.number, second.parent_id, second.new_records) == (2, first.id, 0)
+
+
+def test_load_round_trips_the_report(store):
+    info = store.commit("s1", _report(CRACK, LEAK))
+    loaded = store.load(info.id)
+    assert loaded.client_name == "Tower A" and loaded.defects == [CRACK, LEAK]
+
+
+def test_diff_reports_added_removed_modified(store):
+    old = store.commit("s1", _report(CRACK, LEAK))
+    edited = Defect("Crack", "In the lobby wall, widening", code="1.2",
+                    photos=(PhotoHandle("a" * 64, "a.jpg"), PhotoHandle("b" * 64, "b.jpg")))
+    new = store.commit("s1", _report(RAIL, edited, client="Tower B"))
+
+    diff = store.diff(old.id, new.id)
+    assert diff.header == ('client_name',)
+    assert [(c.kind, c.title) for c in diff.changes] == [('modified', 'Crack'), ('added', 'Loose rail'),
+                                                         ('removed', 'Leak')]
+    modified = diff.changes[0]
+    assert (modified.old_index, modified.new_index) == (0, 1)
+    assert modified.fields == ('desc', 'photos (+1)')
+
+
+def test_diff_of_reordered_defects(store):
+    old = store.commit("s1", _report(CRACK, LEAK))
+    new = store.commit("s1", _report(LEAK, CRACK))
+    diff = store.diff(old.id, new.id)
+    assert diff.changes == [] and diff.unchanged == 2 and diff.reordered
+    assert diff.summary() == "reordered"
+    assert store.diff(new.id, new.id).empty
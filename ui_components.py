@@ -5,17 +5,34 @@ Handles all frontend interface elements and user input collection
 
 import streamlit as st
 import logic
+import storage
+import report_model
+import sync
+import imaging
+import memory
+import resources
+import standards
+import defect_library
+import versions
+import analytics
+import kpis
+import photo_index
+from burst_capture import burst_capture
+from defect_autocomplete import defect_autocomplete
 import streamlit.components.v1 as components
 from datetime import date, datetime
+import pandas as pd
 from PIL import Image, ImageDraw, ImageFont
 import io
-import requests
 try:
     from streamlit_drawable_canvas import st_canvas
     CANVAS_AVAILABLE = True
 except ImportError:
     CANVAS_AVAILABLE = False
 
+# Partial reruns (Streamlit >= 1.33); older versions rerun the whole page
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
 def edit_image(image_file, canvas_data=None):
     """
     Edit image with canvas drawings.
@@ -46,21 +63,6 @@ def edit_image(image_file, canvas_data=None):
         st.error(f"Error editing image: {e}")
         return image_file
 
-# Sample Tekun standards (placeholder - replace with actual PDF extraction)
-TEKUN_STANDARDS = [
-    "SI-1142 (Guardrails) - Height requirements for guardrails",
-    "SI-1205 (Plumbing) - Pipe fitting leakage standards",
-    "SI-1555 (Tiling) - Cracked tile detection",
-    "SI-1752 (Partition Walls) - Moisture levels",
-    "SI-1928 (Painting) - Paint adhesion standards",
-    "SI-900 (Electrical) - Exposed wiring regulations",
-    "SI-2100 (Structural) - Load bearing requirements",
-    "SI-3050 (Safety) - Emergency exit standards",
-    "SI-4100 (Finishing) - Surface finish quality",
-    "SI-5200 (HVAC) - Ventilation requirements"
-]
-
-
 def render_home_screen():
     """Renders the landing page with the two big options."""
     st.title("Civil+")
@@ -104,41 +106,23 @@ def render_home_screen():
 
 
 def render_inspection_deck():
-    # --- INTERNAL HELPER: Wikimedia image search ---
-    # (Integrated from teammate's update)
-    import requests
-    def search_wikimedia_images(query: str, limit: int = 8):
-        if not query or not query.strip():
-            return []
-        url = "https://commons.wikimedia.org/w/api.php"
-        params = {
-            "action": "query", "format": "json", "generator": "search",
-            "gsrsearch": query, "gsrlimit": str(limit), "gsrnamespace": "6",
-            "prop": "imageinfo", "iiprop": "url", "iiurlwidth": "400"
-        }
-        try:
-            r = requests.get(url, params=params, timeout=10)
-            r.raise_for_status()
-            data = r.json()
-        except Exception:
-            return []
-        pages = data.get("query", {}).get("pages", {})
-        results = []
-        for _, p in pages.items():
-            infos = p.get("imageinfo", [])
-            if not infos: continue
-            info = infos[0]
-            thumb = info.get("thumburl")
-            full = info.get("url")
-            if thumb and full: results.append({"thumb": thumb, "full": full})
-        return results
-
     # --- SETUP SESSION STATE ---
     # Standard Fields
     if 'temp_title' not in st.session_state: st.session_state.temp_title = ""
     if 'temp_desc' not in st.session_state: st.session_state.temp_desc = ""
+    # Bumped to start a fresh title input (after adding an item or choosing a suggestion)
+    if 'title_input_id' not in st.session_state: st.session_state.title_input_id = 0
+    if 'manual_code' not in st.session_state: st.session_state.manual_code = "-"
     if 'temp_photos' not in st.session_state: st.session_state.temp_photos = []
+    # Signature per camera shot ([phash, sharpness], parallel to temp_photos)
+    if 'temp_photo_sigs' not in st.session_state: st.session_state.temp_photo_sigs = []
+    # EXIF per camera shot ([lat, lon, taken, w, h], parallel to temp_photos) and per gallery upload
+    if 'temp_photo_exif' not in st.session_state: st.session_state.temp_photo_exif = []
+    if 'temp_upload_exif' not in st.session_state: st.session_state.temp_upload_exif = {}
+    if 'capture_notice' not in st.session_state: st.session_state.capture_notice = ""
     if 'cam_id' not in st.session_state: st.session_state.cam_id = 0
+    # Last standards search (None: no search shown); kept so a pick survives the rerun it causes
+    if 'standards_results' not in st.session_state: st.session_state.standards_results = None
 
     # NEW: Map (House Plan) State
     if 'temp_map_photos' not in st.session_state: st.session_state.temp_map_photos = []
@@ -151,6 +135,7 @@ def render_inspection_deck():
     if 'tool_cam_id' not in st.session_state: st.session_state.tool_cam_id = 0
     if 'tool_name' not in st.session_state: st.session_state.tool_name = ""
     if 'tool_desc' not in st.session_state: st.session_state.tool_desc = ""
+    if 'tool_search_job' not in st.session_state: st.session_state.tool_search_job = None
 
     # Detect Mode
     mode = st.session_state.report_mode
@@ -171,6 +156,14 @@ def render_inspection_deck():
             st.session_state.page = 'review'
             st.rerun()
 
+    # Network work waiting in the offline queue (capture itself never waits for it)
+    worker = sync.get_sync_worker()
+    queued = sync.get_work_queue().counts()
+    waiting = queued.get(sync.PENDING, 0) + queued.get(sync.RUNNING, 0)
+    if waiting:
+        status = "syncing" if worker.online else "offline, will retry automatically"
+        st.caption(f"⏳ {waiting} network operation(s) queued ({status})")
+
     st.divider()
 
     # Dynamic Labels
@@ -186,12 +179,14 @@ def render_inspection_deck():
         st.write("#### New Entry")
 
         # 1. Basic Inputs
-        st.session_state.temp_title = st.text_input(lbl_title, value=st.session_state.temp_title,
-                                                    placeholder=lbl_ph_title)
+        if is_defensive:
+            st.session_state.temp_title = st.text_input(lbl_title, value=st.session_state.temp_title,
+                                                        placeholder=lbl_ph_title)
+        else:
+            render_defect_title_input(lbl_title, lbl_ph_title)
         st.session_state.temp_desc = st.text_area(lbl_desc, value=st.session_state.temp_desc)
 
-        c_cat = st.selectbox("Category", ["Structural", "Electrical", "Plumbing", "Finishing", "Safety", "General"],
-                             key="category_select")
+        c_cat = st.selectbox("Category", report_model.CATEGORIES, key="category_select")
 
         # 2. EVIDENCE PHOTOS (Your Drawing Feature Preserved)
         st.write("Attach Evidence ")
@@ -202,11 +197,37 @@ def render_inspection_deck():
                                                key="evidence_gallery")
 
         with tab_cam:
-            st.caption("Taking a photo auto-saves it to the list below.")
+            st.caption("Capture several shots, then upload them together; they are added to the list below.")
+            auto_drop = st.checkbox("Auto-drop duplicates & blurry shots", key="capture_auto_drop")
+            if st.session_state.capture_notice:
+                st.warning(st.session_state.capture_notice)
+                st.session_state.capture_notice = ""
             cam_key = f"camera_{st.session_state.cam_id}"
-            camera_photo = st.camera_input("Take Photo", key=cam_key)
-            if camera_photo:
-                st.session_state.temp_photos.append(camera_photo)
+            burst = burst_capture(cam_key, label="Open camera")
+            if burst:
+                notices = []
+                for camera_photo in burst:
+                    # Compare with this defect's earlier shots (small grayscale copy only)
+                    sig = imaging.analyze_photo(camera_photo)
+                    if sig is not None:
+                        existing = [imaging.PhotoSignature.from_list(s) if s else None
+                                    for s in st.session_state.temp_photo_sigs]
+                        check = imaging.check_capture(sig, existing)
+                        reasons = []
+                        if check.is_duplicate:
+                            reasons.append(f"looks like a duplicate of Photo {check.duplicate_of + 1}")
+                        if check.is_blurry:
+                            reasons.append("looks blurry")
+                        if reasons:
+                            notice = f"Shot {camera_photo.name} " + " and ".join(reasons)
+                            notices.append(notice + (" - dropped." if auto_drop else ""))
+                        if check.flagged and auto_drop:
+                            continue
+                    exif = imaging.read_exif(camera_photo)
+                    st.session_state.temp_photos.append(camera_photo)
+                    st.session_state.temp_photo_sigs.append(sig.to_list() if sig else None)
+                    st.session_state.temp_photo_exif.append(exif.to_list() if exif else None)
+                st.session_state.capture_notice = "\n\n".join(notices)
                 st.session_state.cam_id += 1
                 st.rerun()
 
@@ -215,12 +236,30 @@ def render_inspection_deck():
             st.write("---")
             st.write("**Attached Photos:**")
             if st.session_state.temp_photos:
+                sigs = st.session_state.temp_photo_sigs
+                if len(sigs) != len(st.session_state.temp_photos):
+                    # Photos restored from an older checkpoint: recompute
+                    sigs = [s.to_list() if s else None
+                            for s in map(imaging.analyze_photo, st.session_state.temp_photos)]
+                    st.session_state.temp_photo_sigs = sigs
+                if len(st.session_state.temp_photo_exif) != len(st.session_state.temp_photos):
+                    st.session_state.temp_photo_exif = [e.to_list() if e else None
+                                                        for e in map(imaging.read_exif, st.session_state.temp_photos)]
+                # One contact sheet for all shots; the controls below follow its numbering
+                render_photo_sheet(st.session_state.temp_photos)
                 cols = st.columns(4)
                 for i, pic in enumerate(st.session_state.temp_photos):
                     with cols[i % 4]:
-                        st.image(pic, width=100)
-                        # YOUR DRAWING FEATURE
-                        with st.expander(f"Edit Photo {i + 1}"):
+                        st.caption(f"Photo {i + 1}")
+                        if sigs[i]:
+                            earlier = [imaging.PhotoSignature.from_list(s) if s else None for s in sigs[:i]]
+                            check = imaging.check_capture(imaging.PhotoSignature.from_list(sigs[i]), earlier)
+                            if check.is_blurry:
+                                st.caption("⚠️ blurry")
+                            if check.is_duplicate:
+                                st.caption(f"⚠️ duplicate of #{check.duplicate_of + 1}")
+                        # YOUR DRAWING FEATURE (a toggle: expanders cannot nest inside "Add Item")
+                        if st.checkbox(f"Edit Photo {i + 1}", key=f"edit_toggle_{i}"):
                             try:
                                 if CANVAS_AVAILABLE:
                                     st.write("Draw on image:")
@@ -234,6 +273,8 @@ def render_inspection_deck():
                                         if st.button(f"Save Edit {i + 1}", key=f"edit_{i}"):
                                             edited = edit_image(pic, canvas_result)
                                             st.session_state.temp_photos[i] = edited
+                                            sig = imaging.analyze_photo(edited)
+                                            st.session_state.temp_photo_sigs[i] = sig.to_list() if sig else None
                                             st.success("Saved!")
                                             st.rerun()
                                 else:
@@ -243,34 +284,50 @@ def render_inspection_deck():
 
                 if st.button("🗑️ Clear Camera Photos", key="clear_evidence_cam"):
                     st.session_state.temp_photos = []
+                    st.session_state.temp_photo_sigs = []
+                    st.session_state.temp_photo_exif = []
                     st.rerun()
 
             # (Optional: Add editing for uploaded photos here if desired, kept simple for now)
 
+            # Returning to a site: what was found here before (by the photos' GPS position)
+            here = photo_index.locate(_upload_exif(uploaded_photos) + st.session_state.temp_photo_exif)
+            if here:
+                render_nearby_defects(*here)
+
         # 3. Standard Code (Your Search Feature Preserved)
         st.write("**Standard (Tekken) Selection**")
         search_term = st.text_input("Search Tekun Standards", placeholder="Type keyword to search...",
                                     key="tekken_search")
         if st.button("🔍 Search Standards", key="tekken_search_btn"):
             if search_term:
-                matching_standards = [std for std in TEKUN_STANDARDS if search_term.lower() in std.lower()]
-                if matching_standards:
-                    st.success(f"Found {len(matching_standards)} matching standards:")
-                    selected_from_search = st.selectbox("Select from search results:", matching_standards,
-                                                        key="search_select")
-                    c_code = selected_from_search.split(" ")[0]
-                else:
-                    st.warning("No standards found.")
-                    c_code = st.text_input("Enter Manual Code", value="-", key="manual_code_search")
+                # Ingested catalogue (python -m standards), loaded once per process on first search
+                st.session_state.standards_results = standards.get_catalogue().search(search_term)
             else:
+                st.session_state.standards_results = None
                 st.warning("Enter a search term.")
-                c_code = st.text_input("Enter Manual Code", value="-", key="manual_code_empty")
+        matching_standards = st.session_state.standards_results
+        if matching_standards is not None:
+            if matching_standards:
+                st.success(f"Found {len(matching_standards)} matching standards:")
+                labels = [entry.label for entry in matching_standards]
+                selected_label = st.selectbox("Select from search results:", labels, key="search_select")
+                selected = matching_standards[labels.index(selected_label)]
+                c_code = f"{selected.code} §{selected.clause}" if selected.clause else selected.code
+                if selected.text:
+                    st.caption(selected.text[:300] + ("…" if len(selected.text) > 300 else ""))
+            else:
+                st.warning("No standards found.")
+                c_code = st.text_input("Enter Manual Code", value="-", key="manual_code_search")
+            if st.button("✖️ Clear search", key="tekken_search_clear"):
+                st.session_state.standards_results = None
+                st.rerun()
         else:
             common_codes = ["Other (Manual Input)", "SI-1142 (Guardrails)", "SI-1205 (Plumbing)", "SI-1555 (Tiling)",
                             "SI-1752 (Partition Walls)", "SI-1928 (Painting)", "SI-900 (Electrical)"]
             c_code_selection = st.selectbox("Quick Select Standard", common_codes, key="tekken_select")
             if "Other" in c_code_selection:
-                c_code = st.text_input("Enter Manual Code", value="-", key="manual_code")
+                c_code = st.text_input("Enter Manual Code", key="manual_code")
             else:
                 c_code = c_code_selection.split(" ")[0]
 
@@ -280,10 +337,31 @@ def render_inspection_deck():
 
         with tab_tool_search:
             tool_query = st.text_input("Search tool name (e.g., saw, drill)", key="tool_query")
+            just_submitted = False
             if st.button("Search Tool", key="tool_search_btn"):
                 st.session_state.selected_tool_url = ""
-                st.session_state.tool_results = search_wikimedia_images(tool_query, limit=8)
-                if not st.session_state.tool_results: st.warning("No images found.")
+                st.session_state.tool_results = []
+                if tool_query and tool_query.strip():
+                    st.session_state.tool_search_job = sync.submit('wikimedia_search', query=tool_query, limit=8)
+                    just_submitted = True
+                else:
+                    st.warning("No images found.")
+
+            # Results arrive through the sync queue; only wait briefly, and only when online
+            if st.session_state.tool_search_job:
+                wait_s = 3.0 if (just_submitted and worker.online) else 0
+                job = sync.get_work_queue().wait(st.session_state.tool_search_job, timeout=wait_s)
+                if job is None or job['status'] == sync.FAILED:
+                    st.session_state.tool_search_job = None
+                    st.warning("Image search failed.")
+                elif job['status'] == sync.DONE:
+                    st.session_state.tool_search_job = None
+                    st.session_state.tool_results = job['result'] or []
+                    if not st.session_state.tool_results: st.warning("No images found.")
+                else:
+                    st.info("⏳ Search queued — results will appear once the network is back.")
+                    if st.button("🔄 Check again", key="tool_search_refresh"):
+                        st.rerun()
 
             if st.session_state.tool_results:
                 st.write("**Choose an image:**")
@@ -303,20 +381,18 @@ def render_inspection_deck():
             st.text_area("What does it do?", key="tool_desc", height=80)
 
         with tab_tool_cam:
-            st.caption("Taking a photo auto-saves it to the list below.")
+            st.caption("Capture several shots, then upload them together; they are added to the list below.")
             tool_cam_key = f"tool_camera_{st.session_state.tool_cam_id}"
-            tool_camera_photo = st.camera_input("Take Tool Photo", key=tool_cam_key)
-            if tool_camera_photo:
-                st.session_state.temp_tool_photos.append(tool_camera_photo)
+            tool_burst = burst_capture(tool_cam_key, label="Open camera for tool")
+            if tool_burst:
+                st.session_state.temp_tool_photos.extend(tool_burst)
                 st.session_state.tool_cam_id += 1
                 st.rerun()
 
         if st.session_state.temp_tool_photos:
             st.write("---")
             st.write("**Attached Tool Photos:**")
-            cols = st.columns(4)
-            for i, pic in enumerate(st.session_state.temp_tool_photos):
-                with cols[i % 4]: st.image(pic, width=100)
+            render_photo_sheet(st.session_state.temp_tool_photos)
             if st.button("🗑️ Clear Tool Photos", key="clear_tool_photos"):
                 st.session_state.temp_tool_photos = []
                 st.rerun()
@@ -330,11 +406,11 @@ def render_inspection_deck():
                                                    accept_multiple_files=True, key="map_gallery_uploader")
 
         with tab_map_cam:
-            st.caption("Taking a photo auto-saves it to the list below.")
+            st.caption("Capture several shots, then upload them together; they are added to the list below.")
             map_cam_key = f"map_camera_{st.session_state.map_cam_id}"
-            map_camera_photo = st.camera_input("Take Map Photo", key=map_cam_key)
-            if map_camera_photo:
-                st.session_state.temp_map_photos.append(map_camera_photo)
+            map_burst = burst_capture(map_cam_key, label="Open camera for map")
+            if map_burst:
+                st.session_state.temp_map_photos.extend(map_burst)
                 st.session_state.map_cam_id += 1
                 st.rerun()
 
@@ -342,9 +418,7 @@ def render_inspection_deck():
             st.write("---")
             st.write("**Attached Map Photos:**")
             if st.session_state.temp_map_photos:
-                cols = st.columns(4)
-                for i, pic in enumerate(st.session_state.temp_map_photos):
-                    with cols[i % 4]: st.image(pic, width=100)
+                render_photo_sheet(st.session_state.temp_map_photos)
                 if st.button("🗑️ Clear Map Photos", key="clear_map_photos"):
                     st.session_state.temp_map_photos = []
                     st.rerun()
@@ -360,6 +434,12 @@ def render_inspection_deck():
                 if uploaded_photos: final_photos.extend(uploaded_photos)
                 if st.session_state.temp_photos: final_photos.extend(st.session_state.temp_photos)
 
+                # Signatures travel with the defect (gallery uploads are analyzed here)
+                photo_signatures = [s.to_list() if s else None
+                                    for s in map(imaging.analyze_photo, uploaded_photos or [])]
+                photo_signatures.extend(st.session_state.temp_photo_sigs[:len(st.session_state.temp_photos)])
+                photo_exif = _upload_exif(uploaded_photos) + st.session_state.temp_photo_exif[:len(st.session_state.temp_photos)]
+
                 final_map_photos = []
                 if uploaded_map_photos: final_map_photos.extend(uploaded_map_photos)
                 if st.session_state.temp_map_photos: final_map_photos.extend(st.session_state.temp_map_photos)
@@ -367,38 +447,55 @@ def render_inspection_deck():
                 final_tool_photos = []
                 if st.session_state.temp_tool_photos: final_tool_photos.extend(st.session_state.temp_tool_photos)
 
-                # CRITICAL: Handle Web Tool URL -> Bytes conversion to prevent crash
+                # Web tool image: queue the download instead of blocking capture on the network.
+                # The bytes are attached at generate time (see sync.resolve_pending_photos).
+                tool_photo_jobs = []
                 if st.session_state.selected_tool_url:
-                    try:
-                        response = requests.get(st.session_state.selected_tool_url, timeout=5)
-                        if response.status_code == 200:
-                            url_image = io.BytesIO(response.content)
-                            final_tool_photos.append(url_image)
-                    except Exception as e:
-                        st.error(f"Failed to download tool image: {e}")
-
-                # Save Data
-                st.session_state.selected_defects.append({
+                    tool_photo_jobs.append(sync.submit('fetch_image', url=st.session_state.selected_tool_url))
+
+                # Saved as a typed Defect: photos go to the BlobStore now and only their handles stay
+                st.session_state.selected_defects.append(report_model.defect_from_dict({
                     "title": st.session_state.temp_title,
                     "desc": st.session_state.temp_desc,
                     "code": c_code,
                     "category": c_cat,
                     "photos": final_photos,
+                    "photo_signatures": photo_signatures,
+                    "photo_exif": photo_exif,
                     "map_photos": final_map_photos,
                     "tool_photos": final_tool_photos,
+                    "tool_photo_jobs": tool_photo_jobs,
                     "tool_name": st.session_state.tool_name,
                     "tool_desc": st.session_state.tool_desc,
                     "mode": mode
-                })
+                }, storage.BlobStore()))
+
+                try:
+                    photo_index.get_photo_index().add_defect(st.session_state.get('inspection_id'),
+                                                             st.session_state.selected_defects[-1])
+                except Exception as e:
+                    st.session_state.capture_notice = f"Photo locations were not saved: {e}"
+
+                # Warm the translation cache in the background while we are (maybe) online
+                sync.prefetch_translations([st.session_state.temp_title, st.session_state.temp_desc],
+                                           _translation_targets())
+                if not is_defensive:
+                    defect_library.get_defect_library().record(st.session_state.temp_title,
+                                                               st.session_state.temp_desc, c_code, c_cat)
 
                 # Reset
                 st.session_state.temp_title = ""
                 st.session_state.temp_desc = ""
+                st.session_state.title_input_id += 1
                 st.session_state.temp_photos = []
+                st.session_state.temp_photo_sigs = []
+                st.session_state.temp_photo_exif = []
+                st.session_state.temp_upload_exif = {}
                 st.session_state.temp_map_photos = []
                 st.session_state.temp_tool_photos = []
                 st.session_state.selected_tool_url = ""
                 st.session_state.tool_results = []
+                st.session_state.standards_results = None
                 #st.session_state.tool_name = ""
                 #st.session_state.tool_desc = ""
 
@@ -427,8 +524,114 @@ def render_inspection_deck():
                     st.subheader(f"{defect['icon']} {defect['title']}")
                     st.write(defect["desc"])
                     if st.button("Add", key=f"btn_{i}"):
-                        st.session_state.selected_defects.append(defect)
+                        added = report_model.defect_from_dict(defect, storage.BlobStore())
+                        st.session_state.selected_defects.append(added)
+                        sync.prefetch_translations([defect['title'], defect['desc']], _translation_targets())
+                        defect_library.get_defect_library().record(added.title, added.desc, added.code,
+                                                                   added.category)
                         st.rerun()
+
+
+def render_photo_sheet(photos):
+    """The photos as one numbered contact sheet (a single image per rerun, rebuilt only when they change)."""
+    sheet = imaging.photo_contact_sheet(photos)
+    if sheet:
+        st.image(sheet)
+
+
+NEARBY_DEFECT_ROWS = 10
+NEARBY_THUMB_SIZE = 80
+
+
+def _upload_exif(uploaded_photos):
+    """EXIF of gallery uploads as PhotoExif lists, read once per uploaded file."""
+    cache = st.session_state.temp_upload_exif
+    result = []
+    for photo in uploaded_photos or []:
+        key = getattr(photo, 'file_id', None) or photo.name
+        if key not in cache:
+            exif = imaging.read_exif(photo)
+            cache[key] = exif.to_list() if exif else None
+        result.append(cache[key])
+    return result
+
+
+def render_nearby_defects(lat, lon):
+    """Earlier defects photographed within photo_index.NEARBY_METERS of (lat, lon), with their floor plans."""
+    index = photo_index.get_photo_index()
+    nearby = index.nearby(lat, lon, exclude_inspection=st.session_state.get('inspection_id'))
+    if not nearby:
+        return
+    # A toggle: this is drawn inside the "Add Item" expander, and expanders cannot nest
+    if st.checkbox(f"📍 Show {len(nearby)} earlier defect(s) within {photo_index.NEARBY_METERS:.0f} m",
+                   key="show_nearby_defects"):
+        pyramid = imaging.RenditionPyramid(blobs=index.blobs)
+        for item in nearby[:NEARBY_DEFECT_ROWS]:
+            c_img, c_text = st.columns([1, 4])
+            with c_img:
+                try:
+                    st.image(pyramid.thumbnail(item.photo, NEARBY_THUMB_SIZE), width=NEARBY_THUMB_SIZE)
+                except Exception:
+                    pass
+            with c_text:
+                st.write(f"**{item.title}** · {item.category}" + (f" · {item.code}" if item.code not in ("", "-") else ""))
+                st.caption(f"{item.taken[:10] or 'undated'} · {item.distance:.0f} m away")
+        map_digests = index.nearby_map_photos(lat, lon, exclude_inspection=st.session_state.get('inspection_id'))
+        if map_digests and not st.session_state.temp_map_photos:
+            if st.button(f"🗺️ Attach the floor plan used here before ({len(map_digests)})", key="reuse_nearby_map"):
+                for i, digest in enumerate(map_digests):
+                    with index.blobs.open(digest) as f:
+                        photo = io.BytesIO(f.read())
+                    photo.name = f"floor_plan_{i + 1}.jpg"
+                    st.session_state.temp_map_photos.append(photo)
+                st.rerun()
+
+
+def _defect_suggestions(text):
+    return [{
+        'title': e.title, 'desc': e.desc, 'code': e.code, 'category': e.category, 'uses': e.uses,
+        # Translation already complete from the glossary and the cache (no network at generate time)
+        'translated': defect_library.cached_translation(e.title) is not None,
+    } for e in defect_library.get_defect_library().suggest(text)]
+
+
+def _translation_targets():
+    """Languages the report is translated into (as last chosen on the review screen; Arabic until then)."""
+    return st.session_state.get('translation_targets', ['ar'])
+
+
+@_fragment
+def render_defect_title_input(label, placeholder):
+    """
+    Defect title with suggestions from the defect library. Typing reruns only
+    this fragment; choosing a suggestion fills in the description, category
+    and standard and reruns the page.
+    """
+    title, picked = defect_autocomplete(f"defect_title_{st.session_state.title_input_id}", _defect_suggestions,
+                                        label, value=st.session_state.temp_title, placeholder=placeholder)
+    st.session_state.temp_title = title
+    if picked:
+        st.session_state.temp_title = picked['title']
+        st.session_state.temp_desc = picked.get('desc') or st.session_state.temp_desc
+        if picked.get('category') in report_model.CATEGORIES:
+            st.session_state.category_select = picked['category']
+        if picked.get('code'):
+            st.session_state.tekken_select = "Other (Manual Input)"
+            st.session_state.manual_code = picked['code']
+        # Only fragments missing from the translation cache are queued
+        sync.prefetch_translations([st.session_state.temp_title, st.session_state.temp_desc],
+                                   _translation_targets())
+        st.session_state.title_input_id += 1
+        st.rerun()
+
+
+# Review items laid out per rerun (the rest of the list is not rendered)
+REVIEW_PAGE_SIZE = 10
+# Photos per review item preview (one contact sheet image per item)
+REVIEW_SHEET_PHOTOS = 4
+REVIEW_SHEET_COLUMNS = 2
+
+
 def render_review_screen():
     """Renders the final list for review."""
     st.title("Review Checklist")
@@ -440,55 +643,174 @@ def render_review_screen():
         with col1:
             st.session_state.client_name = st.text_input("Client / Property Name", value=st.session_state.client_name)
         with col2:
-            translate = st.checkbox("Translate Report to Arabic? ", value=False)
+            languages = st.multiselect("Report languages", list(logic.REPORT_LANGUAGES),
+                                       default=[logic.ORIGINAL_LANGUAGE], key="report_languages",
+                                       format_func=lambda lang: logic.REPORT_LANGUAGES[lang])
+            # Remembered outside the widget (its state is dropped while the deck is showing)
+            targets = [lang for lang in languages if lang != logic.ORIGINAL_LANGUAGE]
+            previous = _translation_targets()
+            if targets != previous:
+                st.session_state.translation_targets = targets
+                added = [lang for lang in targets if lang not in previous]
+                if added:
+                    sync.prefetch_translations([text for d in st.session_state.selected_defects
+                                                for text in (d.title, d.desc)], added)
+            st.checkbox("Also export PDF", value=False, key="export_pdf")
+            st.radio("Output size", list(logic.OUTPUT_PRESETS), key="output_preset", horizontal=True,
+                     format_func=lambda p: logic.OUTPUT_PRESETS[p]['label'])
+            st.checkbox("🔬 Profile this generation", value=False, key="profile_generation",
+                        help="Re-encodes every photo under the profiler and offers a bundle to download "
+                             "(per-photo timings, cProfile, stack samples). Slower; off by default.")
         notes = st.text_area("Additional General Notes", height=100)
 
+        # Engineer the generated report is filed under in the CRM
+        engineers, _ = storage.get_user_registry().search_users(page_size=500)
+        engineer_ids = [u['id'] for u in engineers]
+        engineer_names = {u['id']: f"{u['name']} ({u['role']})" for u in engineers}
+        if engineer_ids:
+            current = st.session_state.get('current_user')
+            st.session_state.current_user = st.selectbox(
+                "Engineer", engineer_ids,
+                index=engineer_ids.index(current) if current in engineer_ids else 0,
+                format_func=lambda uid: engineer_names.get(uid, uid)
+            )
+
     # Company Logo Section
     with st.container(border=True):
         st.subheader("Company Logo")
         st.write("Upload your company logo to include it in the report header.")
-        logo_file = st.file_uploader("Select Logo Image", type=['png', 'jpg', 'jpeg'], help="Recommended: PNG or JPG format, will be compressed automatically")
+        logo_file = st.file_uploader("Select Logo Image", type=['png', 'jpg', 'jpeg'], help="Recommended: PNG or JPG format; transparency is kept")
         if logo_file:
-            st.image(logo_file, width=200, caption="Logo Preview")
+            # Prepared once here (cached by content), so generating the report does no logo work
+            preset = logic.OUTPUT_PRESETS[st.session_state.get('output_preset', logic.DEFAULT_PRESET)]
+            prepared = imaging.prepare_logo(storage.BlobStore().put_file(logo_file), preset['logo_dpi'])
+            if prepared:
+                st.image(prepared, width=200, caption=f"Logo Preview ({logic.format_file_size(len(prepared))} in the report)")
+            else:
+                st.warning("This logo could not be read; the report will leave its space empty.")
 
     st.subheader("Items to Report")
 
-    if not st.session_state.selected_defects:
+    defects = st.session_state.selected_defects
+    if not defects:
         st.info("No items selected. Go back to add some!")
     else:
-        for i, item in enumerate(st.session_state.selected_defects):
+        # Only the visible page is laid out; previews are cached thumbnails, not the originals
+        page_size = REVIEW_PAGE_SIZE
+        num_pages = (len(defects) + page_size - 1) // page_size
+        page = min(st.session_state.get('review_page', 0), num_pages - 1)
+        st.session_state.review_page = page
+        start = page * page_size
+
+        for i in range(start, min(start + page_size, len(defects))):
+            item = defects[i]
             with st.container(border=True):
                 c_img, c_txt, c_del = st.columns([2, 6, 1])
 
                 with c_img:
                     st.write(f"**#{i + 1}**")
 
-                    photos = []
-                    if 'photos' in item and item['photos']:
-                        photos = item['photos']
-                    elif 'photo' in item and item['photo']:
-                        photos = [item['photo']]
-
-                    if photos:
-                        if len(photos) > 1:
-                            # FIX IS HERE: use_container_width instead of use_column_width
-                            st.image(photos[0], use_container_width=True, caption=f"+{len(photos) - 1} more")
-                        else:
-                            # FIX IS HERE: use_container_width instead of use_column_width
-                            st.image(photos[0], use_container_width=True)
+                    if item.photos:
+                        shown = item.photos[:REVIEW_SHEET_PHOTOS]
+                        sheet = imaging.contact_sheet([h.digest for h in shown], columns=REVIEW_SHEET_COLUMNS)
+                        if sheet:
+                            extra = len(item.photos) - len(shown)
+                            st.image(sheet, use_container_width=True, caption=f"+{extra} more" if extra else None)
 
                 with c_txt:
                     lbl = "Claim:" if st.session_state.report_mode == 'defensive' else "Defect:"
-                    st.write(f"**{lbl} {item['title']}** ({item['category']})")
-                    st.caption(item['desc'])
-                    st.caption(f"Code: {item.get('code', '-')}")
+                    st.write(f"**{lbl} {item.title}** ({item.category})")
+                    st.caption(item.desc)
+                    st.caption(f"Code: {item.code or '-'}")
 
                 with c_del:
                     if st.button("🗑️", key=f"del_{i}"):
-                        st.session_state.selected_defects.pop(i)
+                        defects.pop(i)
                         st.rerun()
 
-    return st.session_state.client_name, notes, translate, logo_file
+        if num_pages > 1:
+            p_prev, p_info, p_next = st.columns([1, 2, 1])
+            with p_prev:
+                if st.button("‹ Previous", key="review_prev", disabled=page == 0):
+                    st.session_state.review_page = page - 1
+                    st.rerun()
+            with p_info:
+                st.caption(f"{len(defects)} items · page {page + 1} of {num_pages}")
+            with p_next:
+                if st.button("Next ›", key="review_next", disabled=page + 1 >= num_pages):
+                    st.session_state.review_page = page + 1
+                    st.rerun()
+
+    return st.session_state.client_name, notes, languages, logo_file
+
+
+# Versions listed with their changes (older ones stay available for compare/rebuild)
+VERSION_HISTORY_ROWS = 10
+
+
+def render_report_versions(series):
+    """Version history of this inspection's report: changes per version, compare and rebuild."""
+    store = versions.get_report_versions()
+    history = store.list_versions(series)
+    if not history:
+        return
+    with st.expander(f"🕘 Report versions ({len(history)})"):
+        stats = store.storage_stats(series)
+        st.caption(f"{stats['versions']} version(s) stored in {logic.format_file_size(stats['stored_bytes'])} "
+                   f"(full copies would take {logic.format_file_size(stats['full_copy_bytes'])})")
+        for v in history[:VERSION_HISTORY_ROWS]:
+            changes = store.diff(v.parent_id, v.id).summary() if v.parent_id else "first version"
+            st.write(f"**v{v.number}** · {v.created.replace('T', ' ')} · {v.defects} items — {changes}")
+
+        labels = {v.id: f"v{v.number} ({v.created[:10]})" for v in history}
+        ids = list(labels)
+        c_old, c_new = st.columns(2)
+        with c_old:
+            old_id = st.selectbox("Compare", ids, index=min(1, len(ids) - 1), format_func=labels.get,
+                                  key="version_old")
+        with c_new:
+            new_id = st.selectbox("with", ids, format_func=labels.get, key="version_new")
+        if old_id != new_id:
+            diff = store.diff(old_id, new_id)
+            if diff.empty:
+                st.info("No differences.")
+            for name in diff.header:
+                st.write(f"✏️ {name.replace('_', ' ').capitalize()} changed")
+            for change in diff.changes:
+                if change.kind == 'modified':
+                    st.write(f"✏️ #{change.new_index + 1} **{change.title}**: {', '.join(change.fields)}")
+                elif change.kind == 'added':
+                    st.write(f"➕ #{change.new_index + 1} **{change.title}**")
+                else:
+                    st.write(f"➖ #{change.old_index + 1} **{change.title}**")
+            if diff.reordered:
+                st.write("↕️ Items reordered")
+
+        c_version, c_language, c_go = st.columns([2, 2, 1])
+        with c_version:
+            rebuild_id = st.selectbox("Rebuild version", ids, format_func=labels.get, key="version_rebuild")
+        with c_language:
+            language = st.selectbox("Language", list(logic.REPORT_LANGUAGES), format_func=logic.REPORT_LANGUAGES.get,
+                                    key="version_rebuild_language")
+        with c_go:
+            st.write("")
+            rebuild = st.button("Rebuild", key="version_rebuild_btn")
+        if rebuild:
+            with st.spinner("Rebuilding..."):
+                buffer = store.rebuild(rebuild_id, [language], translator=sync.cached_translator())[language]['docx']
+            version = next(v for v in history if v.id == rebuild_id)
+            suffix = '' if language == logic.ORIGINAL_LANGUAGE else f"_{language}"
+            st.download_button(
+                label=f"📥 Download {labels[rebuild_id]} ({logic.format_file_size(buffer.getbuffer().nbytes)})",
+                data=buffer,
+                file_name=f"FieldScribe_{version.client_name}_v{version.number}{suffix}.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key="download_rebuilt_version"
+            )
+
+
+# Months shown in the dashboard's defects-per-category chart
+ANALYTICS_MONTHS = 12
 
 
 # --- CRM DASHBOARD SECTION (Same as before) ---
@@ -640,22 +962,54 @@ def render_crm_dashboard():
     st.markdown('<div id="section-dashboard" class="crm-header">CRM Dashboard</div>', unsafe_allow_html=True)
     st.markdown('<div style="height: 2rem;"></div>', unsafe_allow_html=True)
 
-    col1, col2 = st.columns([1, 1])
+    # Headline numbers are materialized counters (kpis.py); only the charts scan the analytics store
+    counters = kpis.get_kpi_counters().snapshot()
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
     with col1:
         st.markdown(f"""
         <div class="metric-card">
             <div>Total Customers</div>
-            <div class="metric-value">{st.session_state.customer_count}</div>
+            <div class="metric-value">{counters['customers']}</div>
         </div>
         """, unsafe_allow_html=True)
     with col2:
         st.markdown(f"""
         <div class="metric-card">
-            <div>Revenue This Month</div>
-            <div class="metric-value">${st.session_state.monthly_revenue:,.2f}</div>
+            <div>Reports This Month</div>
+            <div class="metric-value">{counters['reports_this_month']}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col3:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div>Defects This Month</div>
+            <div class="metric-value">{counters['defects_this_month']}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col4:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div>Events This Month</div>
+            <div class="metric-value">{counters['events_this_month']}</div>
         </div>
         """, unsafe_allow_html=True)
 
+    if counters['defects']:
+        defect_stats = analytics.get_defect_analytics()
+        st.markdown('<div style="height: 1.5rem;"></div>', unsafe_allow_html=True)
+        c_chart, c_codes = st.columns([2, 1])
+        with c_chart:
+            st.write("**Defects per category per month**")
+            first_month = date.today().year * 12 + date.today().month - ANALYTICS_MONTHS
+            months, categories, counts = defect_stats.category_by_month(
+                since=date(first_month // 12, first_month % 12 + 1, 1))
+            if months:
+                st.bar_chart(pd.DataFrame(counts, index=months, columns=categories).loc[:, counts.sum(axis=0) > 0])
+        with c_codes:
+            st.write("**Top standards cited**")
+            for code, count in defect_stats.top_standards(limit=8):
+                st.write(f"{code} · {count}")
+
     st.markdown('<div style="height: 2.5rem;"></div>', unsafe_allow_html=True)
 
     # Apple-like custom CSS with mobile optimization
@@ -766,13 +1120,17 @@ def render_crm_dashboard():
             return None
 
     # Header with navigation
-    col_header1, col_header2 = st.columns([1, 20])
+    col_header1, col_header2, col_header3 = st.columns([1, 17, 3])
     with col_header1:
         if st.button("←", help="Back to Home", use_container_width=True):
             st.session_state.page = 'home'
             if 'selected_calendar_date' in st.session_state:
                 st.session_state.selected_calendar_date = None
             st.rerun()
+    with col_header3:
+        if st.button("🧠 Memory", help="Session memory (admin)", use_container_width=True):
+            st.session_state.page = 'admin'
+            st.rerun()
 
     # --- CALENDAR SECTION ---
     st.markdown('<div id="section-files" class="section-title">📅 Calendar</div>', unsafe_allow_html=True)
@@ -1037,6 +1395,7 @@ def render_crm_dashboard():
                     st.markdown('<div style="padding-top: 0.75rem;"></div>', unsafe_allow_html=True)
                     if st.button("🗑️", key=f"delete_{selected_date}_{i}", help="Delete event"):
                         st.session_state.crm_events[selected_date].pop(i)
+                        kpis.get_kpi_counters().record_event(selected_date, -1)
                         if not st.session_state.crm_events[selected_date]:
                             del st.session_state.crm_events[selected_date]
                         st.rerun()
@@ -1069,6 +1428,7 @@ def render_crm_dashboard():
                         'description': event_description
                     }
                     st.session_state.crm_events[selected_date].append(new_event)
+                    kpis.get_kpi_counters().record_event(selected_date)
                     st.success(f"✓ Event '{event_title}' added!")
                     st.rerun()
 
@@ -1080,9 +1440,9 @@ def render_crm_dashboard():
         </div>
         """, unsafe_allow_html=True)
 
-    # --- DEMO USERS SECTION ---
+    # --- USERS SECTION ---
     st.markdown('<div style="height: 3rem;"></div>', unsafe_allow_html=True)
-    st.markdown('<div id="section-users" class="section-title">👥 Demo Users</div>', unsafe_allow_html=True)
+    st.markdown('<div id="section-users" class="section-title">👥 Users</div>', unsafe_allow_html=True)
 
     # Add CSS for user cards
     st.markdown("""
@@ -1171,10 +1531,31 @@ def render_crm_dashboard():
     </style>
     """, unsafe_allow_html=True)
 
-    # Display users
-    demo_users = st.session_state.demo_users
-
-    for user_id, user_data in demo_users.items():
+    # Display users (one page at a time, straight from the registry)
+    registry = storage.get_user_registry()
+    page_size = 10
+
+    c_search, c_role = st.columns([3, 1])
+    with c_search:
+        user_query = st.text_input("Search users", placeholder="Name, email or role...", key="crm_user_query")
+    with c_role:
+        role_filter = st.selectbox("Role", ["All"] + registry.list_roles(), key="crm_user_role")
+
+    # Reset paging whenever the filter changes
+    filter_key = (user_query, role_filter)
+    if st.session_state.get('crm_user_filter') != filter_key:
+        st.session_state.crm_user_filter = filter_key
+        st.session_state.crm_user_page = 0
+
+    users, total_users = registry.search_users(
+        user_query, role=None if role_filter == "All" else role_filter,
+        page=st.session_state.crm_user_page, page_size=page_size
+    )
+    num_pages = max(1, (total_users + page_size - 1) // page_size)
+    st.caption(f"{total_users} users · page {st.session_state.crm_user_page + 1} of {num_pages}")
+
+    for user_data in users:
+        user_id = user_data['id']
         is_selected = st.session_state.selected_user == user_id
 
         with st.container():
@@ -1190,22 +1571,52 @@ def render_crm_dashboard():
             """
             st.markdown(user_card_html, unsafe_allow_html=True)
 
-            # Show files if user is selected
+            # Show files if user is selected (loaded lazily, one page at a time)
             if is_selected:
                 st.markdown('<div class="file-list">', unsafe_allow_html=True)
                 st.markdown('<div style="font-size: 0.875rem; font-weight: 600; color: #1d1d1f; margin-bottom: 0.75rem;">📁 Files:</div>', unsafe_allow_html=True)
 
-                for file in user_data['files']:
+                file_page = st.session_state.get('crm_file_page', 0)
+                files, total_files = registry.list_files(user_id, page=file_page, page_size=page_size)
+                for file in files:
                     file_html = f"""
                     <div class="file-item">
                         <div class="file-info">
                             <div class="file-name">{file['name']}</div>
-                            <div class="file-meta">📅 {file['date']}</div>
+                            <div class="file-meta">📅 {file['created']}</div>
                         </div>
-                        <div class="file-size">{file['size']}</div>
+                        <div class="file-size">{logic.format_file_size(file['size_bytes'])}</div>
                     </div>
                     """
                     st.markdown(file_html, unsafe_allow_html=True)
+                    # Archived reports stream back from disk; only rebuilt when requested
+                    if file.get('report_id'):
+                        if st.session_state.get('crm_download_file') == file['id']:
+                            archive = storage.get_report_archive()
+                            if archive.get_report(file['report_id']):
+                                st.download_button("📥 Download",
+                                                   data=archive.report_bytes(file['report_id']),
+                                                   file_name=file['name'], key=f"dl_file_{file['id']}",
+                                                   mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+                            else:
+                                st.caption("This report is no longer in the archive.")
+                        elif st.button("⬇️ Prepare download", key=f"prep_file_{file['id']}"):
+                            st.session_state.crm_download_file = file['id']
+                            st.rerun()
+
+                if total_files > page_size:
+                    f_prev, f_info, f_next = st.columns([1, 2, 1])
+                    with f_prev:
+                        if st.button("‹ Newer", key=f"files_prev_{user_id}", disabled=file_page == 0):
+                            st.session_state.crm_file_page = file_page - 1
+                            st.rerun()
+                    with f_info:
+                        st.caption(f"{total_files} files · page {file_page + 1} of {(total_files + page_size - 1) // page_size}")
+                    with f_next:
+                        if st.button("Older ›", key=f"files_next_{user_id}",
+                                     disabled=(file_page + 1) * page_size >= total_files):
+                            st.session_state.crm_file_page = file_page + 1
+                            st.rerun()
 
                 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -1218,7 +1629,104 @@ def render_crm_dashboard():
                         st.session_state.selected_user = None
                     else:
                         st.session_state.selected_user = user_id
+                    st.session_state.crm_file_page = 0
                     st.rerun()
 
             st.markdown('</div>', unsafe_allow_html=True)
-            st.markdown('<div style="height: 0.5rem;"></div>', unsafe_allow_html=True)
\ No newline at end of file
+            st.markdown('<div style="height: 0.5rem;"></div>', unsafe_allow_html=True)
+
+    # Page navigation
+    if num_pages > 1:
+        p_prev, p_info, p_next = st.columns([1, 2, 1])
+        with p_prev:
+            if st.button("‹ Previous", key="users_prev", disabled=st.session_state.crm_user_page == 0):
+                st.session_state.crm_user_page -= 1
+                st.rerun()
+        with p_next:
+            if st.button("Next ›", key="users_next", disabled=st.session_state.crm_user_page + 1 >= num_pages):
+                st.session_state.crm_user_page += 1
+                st.rerun()
+
+
+# --- MEMORY ADMIN (next to the CRM dashboard) ---
+def render_memory_admin():
+    col_back, col_title = st.columns([1, 20])
+    with col_back:
+        if st.button("←", help="Back to CRM", use_container_width=True, key="admin_back"):
+            st.session_state.page = 'crm'
+            st.rerun()
+    with col_title:
+        st.title("Session Memory")
+
+    tracker = memory.get_tracker()
+    own = memory.account_session(st.session_state, force=True, tracker=tracker)
+    sessions = tracker.sessions()
+    stats = tracker.stats()
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Live sessions", stats['sessions'])
+    m2.metric("Session state", logic.format_file_size(stats['tracked_bytes']))
+    m3.metric("Process RSS", logic.format_file_size(memory.process_rss()))
+    m4.metric("Spilled to disk", logic.format_file_size(stats['spilled_bytes']),
+              help=f"{stats['spills']} trims, {stats['evictions']} evicted keys")
+    limits = [f"per session {logic.format_file_size(memory.SESSION_SOFT_LIMIT)}" if memory.SESSION_SOFT_LIMIT else
+              "no per-session limit"]
+    if memory.PROCESS_SOFT_LIMIT:
+        limits.append(f"all sessions {logic.format_file_size(memory.PROCESS_SOFT_LIMIT)}")
+    st.caption(f"Soft limits: {', '.join(limits)} · trimmed to {memory.LOW_WATER:.0%} · "
+               f"sessions measured at most every {memory.MEASURE_INTERVAL:g}s")
+
+    st.subheader("Top sessions")
+    now = datetime.now().timestamp()
+    st.dataframe([{
+        'Session': u.session_id + (' (you)' if own and u.session_id == own.session_id else ''),
+        'User': u.user, 'Page': u.page, 'Size': logic.format_file_size(u.total_bytes),
+        'Largest keys': ", ".join(f"{k} {logic.format_file_size(v)}" for k, v in u.top_keys(3)),
+        'Seen': f"{now - u.measured_at:.0f}s ago",
+    } for u in sessions[:20]], use_container_width=True, hide_index=True)
+
+    if sessions:
+        chosen = st.selectbox("Session detail", [u.session_id for u in sessions], key="admin_session")
+        usage = next(u for u in sessions if u.session_id == chosen)
+        st.dataframe([{'Key': k, 'Size': logic.format_file_size(v), 'Bytes': v} for k, v in usage.top_keys(25)],
+                     use_container_width=True, hide_index=True)
+        st.caption(f"Measured in {usage.measure_ms:.1f} ms")
+
+    st.subheader("Top keys across sessions")
+    st.dataframe([{'Key': k, 'Size': logic.format_file_size(v)} for k, v in tracker.top_keys(10)],
+                 use_container_width=True, hide_index=True)
+
+    if st.button("💾 Spill my session's photos to disk", key="admin_spill"):
+        done = memory.trim_session(st.session_state, 0, own.total_bytes if own else 0)
+        st.success(f"Spilled {done['spilled']} photos ({logic.format_file_size(done['spilled_bytes'])}).")
+        if done['retained']:
+            st.caption(f"{done['retained']} more photo(s) were moved to disk but are still held elsewhere "
+                       f"(e.g. by a widget), so no memory was freed for them.")
+
+    st.subheader("Shared caches")
+    caches = [{'Resource': name, 'Entries': s.get('entries'), 'Size': logic.format_file_size(s.get('bytes') or 0),
+               'Hit rate': f"{s.get('hit_rate', 0):.0%}"}
+              for name, s in resources.get_registry().stats().items() if 'hit_rate' in s]
+    if caches:
+        st.dataframe(caches, use_container_width=True, hide_index=True)
+
+    st.subheader("Allocation sites (tracemalloc)")
+    if stats['tracemalloc']:
+        c_snap, c_stop = st.columns(2)
+        with c_stop:
+            if st.button("Stop tracing", key="admin_trace_stop"):
+                memory.stop_tracing()
+                st.rerun()
+        with c_snap:
+            take = st.button("Take snapshot", key="admin_trace_snap")
+        if take:
+            sites = tracker.allocation_sites()
+            st.dataframe([{'Site': r['site'], 'Size': logic.format_file_size(r['bytes']),
+                           'Change': f"{r['change_bytes'] / 1024:+.0f} KB", 'Blocks': r['blocks']} for r in sites],
+                         use_container_width=True, hide_index=True)
+            st.caption("Change is relative to the previous snapshot.")
+    else:
+        st.caption("Tracing adds overhead to every allocation; enable it only while investigating.")
+        if st.button("Start tracing", key="admin_trace_start"):
+            memory.start_tracing()
+            st.rerun()
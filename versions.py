@@ -0,0 +1,435 @@
+"""
+Report Versions for FieldScribe
+Handles the version chain of a report: every regeneration is stored as a
+small manifest over content-addressed defect records, and any version can be
+rebuilt on demand or diffed against another
+"""
+
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import logic
+import report_model
+import resources
+import storage
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Report fields compared by the diff (besides the defects)
+HEADER_FIELDS = ('client_name', 'general_notes', 'report_mode', 'logo', 'date', 'engineer')
+DEFECT_FIELDS = ('title', 'desc', 'code', 'category', 'mode', 'tool_name', 'tool_desc')
+PHOTO_FIELDS = ('photos', 'map_photos', 'tool_photos')
+
+
+def _dumps(obj) -> bytes:
+    if MSGPACK_AVAILABLE:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def _loads(data: bytes):
+    if data[:1] in (b'{', b'['):
+        return json.loads(data.decode('utf-8'))
+    return msgpack.unpackb(data, raw=False)
+
+
+# --- RECORDS ---
+def _handles(refs):
+    return tuple(report_model.PhotoHandle(digest, name) for digest, name in refs)
+
+
+def defect_record(defect: report_model.Defect) -> dict:
+    record = {name: getattr(defect, name) for name in DEFECT_FIELDS}
+    for name in PHOTO_FIELDS:
+        record[name] = [[h.digest, h.name] for h in getattr(defect, name)]
+    return record
+
+
+def defect_from_record(record: dict) -> report_model.Defect:
+    return report_model.Defect(**{name: record.get(name, '') for name in DEFECT_FIELDS},
+                               **{name: _handles(record.get(name) or []) for name in PHOTO_FIELDS})
+
+
+def header_record(report: report_model.Report) -> dict:
+    header = {name: getattr(report, name) for name in HEADER_FIELDS if name != 'logo'}
+    header['logo'] = [report.logo.digest, report.logo.name] if report.logo else None
+    return header
+
+
+@dataclass(slots=True)
+class VersionInfo:
+    id: int
+    series: str
+    number: int
+    parent_id: int
+    created: str
+    client_name: str
+    defects: int
+    new_records: int
+    preset: str
+
+
+@dataclass(slots=True)
+class DefectChange:
+    """kind is 'added', 'removed' or 'modified'; fields names what differs for 'modified'."""
+    kind: str
+    title: str
+    old_index: int = None
+    new_index: int = None
+    fields: tuple = ()
+
+
+@dataclass(slots=True)
+class ReportDiff:
+    old: int
+    new: int
+    header: tuple = ()
+    changes: list = field(default_factory=list)
+    unchanged: int = 0
+    reordered: bool = False
+
+    @property
+    def empty(self) -> bool:
+        return not (self.header or self.changes or self.reordered)
+
+    def summary(self) -> str:
+        counts = {}
+        for change in self.changes:
+            counts[change.kind] = counts.get(change.kind, 0) + 1
+        parts = [f"{n} {kind}" for kind, n in counts.items()]
+        if self.reordered:
+            parts.append("reordered")
+        parts.extend(f"{name.replace('_', ' ')} changed" for name in self.header)
+        return ", ".join(parts) or "no changes"
+
+
+def _field_changes(old: dict, new: dict) -> tuple:
+    changed = [name for name in DEFECT_FIELDS if (old.get(name) or '') != (new.get(name) or '')]
+    for name in PHOTO_FIELDS:
+        before = [digest for digest, _ in old.get(name) or []]
+        after = [digest for digest, _ in new.get(name) or []]
+        if before != after:
+            added = len(set(after) - set(before))
+            removed = len(set(before) - set(after))
+            detail = " ".join(p for p in (f"+{added}" if added else '', f"-{removed}" if removed else '') if p)
+            changed.append(f"{name} ({detail or 'order'})")
+    return tuple(changed)
+
+
+# --- VERSION CHAIN ---
+class ReportVersions:
+    """
+    Version chains of generated reports, one chain per series (the inspection id).
+
+    A version is a manifest row: the report header and the ordered digests of
+    its defect records. Defect records live in the BlobStore under their
+    content hash, so a new version only stores the defects that changed since
+    the previous one; photos were already stored once by build_report.
+    Rendered fragments (the compressed JPEGs of each defect's photos, per
+    unbudgeted output preset) are kept in the BlobStore too, so rebuilding an
+    old version does not re-encode its photos.
+    """
+
+    def __init__(self, db_path=None, blobs: storage.BlobStore = None):
+        self._conn = storage.connect(db_path)
+        self._lock = threading.Lock()
+        self.blobs = blobs or storage.BlobStore()
+        self._records = resources.cache('version_records', max_entries=4096)
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS report_versions (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    series      TEXT NOT NULL,
+                    number      INTEGER NOT NULL,
+                    parent_id   INTEGER REFERENCES report_versions(id),
+                    created     TEXT NOT NULL,
+                    client      TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+                    preset      TEXT NOT NULL DEFAULT '',
+                    header      BLOB NOT NULL,
+                    defects     BLOB NOT NULL,
+                    new_records INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (series, number)
+                );
+                CREATE TABLE IF NOT EXISTS version_fragments (
+                    defect TEXT NOT NULL,
+                    preset TEXT NOT NULL,
+                    photos BLOB NOT NULL,
+                    PRIMARY KEY (defect, preset)
+                ) WITHOUT ROWID;
+            """)
+
+    # --- RECORDS ---
+    def _put_record(self, record: dict):
+        data = _dumps(record)
+        digest = storage.BlobStore.digest(data)
+        is_new = not self.blobs.exists(digest)
+        if is_new:
+            self.blobs.put(data)
+        self._records.put(digest, record)
+        return digest, is_new
+
+    def _record(self, digest: str) -> dict:
+        record = self._records.get(digest)
+        if record is None:
+            record = _loads(self.blobs.read(digest))
+            self._records.put(digest, record)
+        return record
+
+    @staticmethod
+    def _pack_digests(digests) -> bytes:
+        return b''.join(bytes.fromhex(d) for d in digests)
+
+    @staticmethod
+    def _unpack_digests(data: bytes) -> list:
+        return [data[i:i + 32].hex() for i in range(0, len(data), 32)]
+
+    def _row(self, version_id: int):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM report_versions WHERE id = ?", (version_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Report version {version_id} does not exist")
+        return row
+
+    @staticmethod
+    def _info(row) -> VersionInfo:
+        return VersionInfo(id=row['id'], series=row['series'], number=row['number'], parent_id=row['parent_id'],
+                           created=row['created'], client_name=row['client'], defects=len(row['defects']) // 32,
+                           new_records=row['new_records'], preset=row['preset'])
+
+    # --- COMMIT ---
+    def commit(self, series: str, report: report_model.Report, preset: str = logic.DEFAULT_PRESET) -> VersionInfo:
+        """
+        Records report as the next version of series and returns it. When
+        nothing changed since the latest version, that version is returned
+        instead. Call it after rendering, so the photos just compressed for
+        an unbudgeted preset are kept as rendered fragments.
+        """
+        header = _dumps(header_record(report))
+        digests, new_records = [], 0
+        for defect in report.defects:
+            digest, is_new = self._put_record(defect_record(defect))
+            digests.append(digest)
+            new_records += is_new
+        packed = self._pack_digests(digests)
+        self.store_fragments(report, preset, digests)
+
+        with self._lock, self._conn:
+            latest = self._conn.execute(
+                "SELECT * FROM report_versions WHERE series = ? ORDER BY number DESC LIMIT 1", (series,)
+            ).fetchone()
+            if latest is not None and latest['header'] == header and latest['defects'] == packed:
+                return self._info(latest)
+            number = latest['number'] + 1 if latest is not None else 1
+            cur = self._conn.execute(
+                "INSERT INTO report_versions (series, number, parent_id, created, client, preset, header, defects, "
+                "new_records) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (series, number, latest['id'] if latest is not None else None,
+                 datetime.now().isoformat(timespec='seconds'), report.client_name or '', preset, header, packed,
+                 new_records)
+            )
+            row = self._conn.execute("SELECT * FROM report_versions WHERE id = ?", (cur.lastrowid,)).fetchone()
+        logger.info("Report %s version %d: %d defects, %d new records", series, number, len(digests), new_records)
+        return self._info(row)
+
+    def list_versions(self, series: str) -> list:
+        """Versions of series, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM report_versions WHERE series = ? ORDER BY number DESC", (series,)
+            ).fetchall()
+        return [self._info(r) for r in rows]
+
+    def latest_versions(self) -> list:
+        """The newest version of every series."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM report_versions v WHERE number = "
+                "(SELECT MAX(number) FROM report_versions WHERE series = v.series) ORDER BY id"
+            ).fetchall()
+        return [self._info(r) for r in rows]
+
+    def load(self, version_id: int) -> report_model.Report:
+        """The typed Report of a version (photos as BlobStore handles)."""
+        row = self._row(version_id)
+        header = _loads(row['header'])
+        logo = header.pop('logo', None)
+        return report_model.Report(
+            **header,
+            defects=[defect_from_record(self._record(d)) for d in self._unpack_digests(row['defects'])],
+            logo=report_model.PhotoHandle(*logo) if logo else None,
+        )
+
+    # --- RENDERED FRAGMENTS ---
+    def store_fragments(self, report, preset, digests=None) -> int:
+        """
+        Keeps the compressed photos of each defect (from the compression
+        cache, i.e. just rendered) as that defect's fragment for preset.
+        Budgeted presets size photos for the whole report, so their
+        encodings are not reusable per defect and are skipped.
+        """
+        options = logic.OUTPUT_PRESETS[preset]
+        if options['budget_bytes'] is not None:
+            return 0
+        digests = digests or [storage.BlobStore.digest(_dumps(defect_record(d))) for d in report.defects]
+        cache = logic.compression_cache()
+        rows = []
+        for defect, digest in zip(report.defects, digests):
+            if not defect.photos:
+                continue
+            encoded = [cache.get((h.digest, options['max_width'])) for h in defect.photos]
+            if any(data is None for data in encoded):
+                continue
+            pairs = [[h.digest, self.blobs.put(data)] for h, data in zip(defect.photos, encoded)]
+            rows.append((digest, preset, _dumps(pairs)))
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO version_fragments (defect, preset, photos) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def _seed_fragments(self, digests, preset) -> int:
+        """Puts the stored fragments of these defects back into the compression cache."""
+        options = logic.OUTPUT_PRESETS[preset]
+        if options['budget_bytes'] is not None or not digests:
+            return 0
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT photos FROM version_fragments WHERE preset = ? AND defect IN "
+                f"({','.join('?' * len(digests))})", [preset, *digests]
+            ).fetchall()
+        cache = logic.compression_cache()
+        seeded = 0
+        for row in rows:
+            for photo_digest, jpeg_digest in _loads(row['photos']):
+                key = (photo_digest, options['max_width'])
+                if cache.get(key) is None and self.blobs.exists(jpeg_digest):
+                    cache.put(key, self.blobs.read(jpeg_digest))
+                    seeded += 1
+        return seeded
+
+    def rebuild(self, version_id: int, languages=(logic.ORIGINAL_LANGUAGE,), formats=('docx',), translator=None,
+                preset=None):
+        """
+        Renders a stored version again: {language: {format: BytesIO}}.
+        Photos come from the version's rendered fragments where available;
+        text goes through translator (the translation cache in the app).
+        """
+        row = self._row(version_id)
+        preset = preset or row['preset'] or logic.DEFAULT_PRESET
+        self._seed_fragments(list(dict.fromkeys(self._unpack_digests(row['defects']))), preset)
+        report = self.load(version_id)
+        outputs = logic.render_reports(report, languages, translator, formats, preset)
+        self.store_fragments(report, preset)
+        return outputs
+
+    # --- DIFF ---
+    def diff(self, old_id: int, new_id: int) -> ReportDiff:
+        """
+        Structural diff of two versions. Defects with the same record digest
+        are unchanged (no record is read); the others are paired by title,
+        then by position, and compared field by field.
+        """
+        old_row, new_row = self._row(old_id), self._row(new_id)
+        result = ReportDiff(old=old_id, new=new_id)
+        if old_row['header'] != new_row['header']:
+            old_header, new_header = _loads(old_row['header']), _loads(new_row['header'])
+            result.header = tuple(name for name in HEADER_FIELDS if old_header.get(name) != new_header.get(name))
+        old_digests = self._unpack_digests(old_row['defects'])
+        new_digests = self._unpack_digests(new_row['defects'])
+        if old_digests == new_digests:
+            result.unchanged = len(new_digests)
+            return result
+
+        # Multiset match on digests: these defects are identical in both versions
+        remaining = {}
+        for i, digest in enumerate(old_digests):
+            remaining.setdefault(digest, []).append(i)
+        matched_old, new_only = [], []
+        for j, digest in enumerate(new_digests):
+            if remaining.get(digest):
+                matched_old.append(remaining[digest].pop(0))
+            else:
+                new_only.append(j)
+        result.unchanged = len(matched_old)
+        result.reordered = matched_old != sorted(matched_old)
+        old_only = [i for positions in remaining.values() for i in positions]
+        old_only.sort()
+
+        old_records = {i: self._record(old_digests[i]) for i in old_only}
+        new_records = {j: self._record(new_digests[j]) for j in new_only}
+        by_title = {}
+        for i in old_only:
+            by_title.setdefault((old_records[i].get('title') or '').casefold(), []).append(i)
+        pairs, unpaired_new = [], []
+        for j in new_only:
+            candidates = by_title.get((new_records[j].get('title') or '').casefold())
+            if candidates:
+                pairs.append((candidates.pop(0), j))
+            else:
+                unpaired_new.append(j)
+        unpaired_old = [i for i in old_only if all(i != p for p, _ in pairs)]
+        # A retitled defect in the same place is a modification, not remove + add
+        for i, j in list(zip(unpaired_old, unpaired_new)):
+            if i == j:
+                pairs.append((i, j))
+                unpaired_old.remove(i)
+                unpaired_new.remove(j)
+
+        for i, j in sorted(pairs, key=lambda p: p[1]):
+            result.changes.append(DefectChange('modified', new_records[j].get('title', ''), i, j,
+                                               _field_changes(old_records[i], new_records[j])))
+        result.changes.extend(DefectChange('added', new_records[j].get('title', ''), new_index=j)
+                              for j in unpaired_new)
+        result.changes.extend(DefectChange('removed', old_records[i].get('title', ''), old_index=i)
+                              for i in unpaired_old)
+        return result
+
+    # --- STORAGE ---
+    def storage_stats(self, series: str) -> dict:
+        """
+        Bytes the chain of series takes (manifests, unique defect records,
+        unique photos) against storing every version as a full copy.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT header, defects FROM report_versions WHERE series = ?", (series,)
+            ).fetchall()
+        sizes = {}
+
+        def size(digest):
+            if digest not in sizes:
+                sizes[digest] = self.blobs.size(digest)
+            return sizes[digest]
+
+        stored, full, seen = 0, 0, set()
+        for row in rows:
+            manifest = len(row['header']) + len(row['defects'])
+            stored += manifest
+            version_bytes = manifest
+            logo = _loads(row['header']).get('logo')
+            blobs = [logo[0]] if logo else []
+            for digest in self._unpack_digests(row['defects']):
+                blobs.append(digest)
+                record = self._record(digest)
+                blobs.extend(d for name in PHOTO_FIELDS for d, _ in record.get(name) or [])
+            for digest in blobs:
+                version_bytes += size(digest)
+                if digest not in seen:
+                    seen.add(digest)
+                    stored += size(digest)
+            full += version_bytes
+        return {'versions': len(rows), 'stored_bytes': stored, 'full_copy_bytes': full}
+
+
+def get_report_versions() -> ReportVersions:
+    """Returns the process-wide report version store."""
+    return resources.shared('report_versions', ReportVersions)